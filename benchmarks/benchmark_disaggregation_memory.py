@@ -0,0 +1,317 @@
+"""Benchmark the allocations of the disaggregation hot path on LAU-sized synthetic data.
+
+Compares the duration, the peak memory and the memory still allocated at the end (traced
+with ``tracemalloc``) of the current implementations with the previous ones, which
+merged and copied whole frames:
+
+- binary_criteria: ``apply_binary_disaggregation_criteria``, previously copy + merge
+- proxy_based: ``get_proxy_based_disaggregated_data``, previously merge + drop
+- share_based: ``get_share_disaggregated_data``, previously one outer product per
+  source region and concatenation of the pieces
+- equal: ``get_equally_distributed_data``, previously merge with the regions
+
+No database is needed: the regions are read from a temporary region catalogue file and
+the criterion var is put into the proxy cache.
+
+Usage::
+
+    python benchmarks/benchmark_disaggregation_memory.py --sources 400 --targets 100000 --years 9
+"""
+import os
+import argparse
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from zoomin import disaggregation
+from zoomin import disaggregation_utils as disagg_utils
+from zoomin.proxy_cache import proxy_cache
+
+CRITERION_VAR = "benchmark_criterion"
+
+
+def get_lau_data(n_sources: int, n_targets: int, n_years: int) -> tuple:
+    """Return synthetic regions, staged data at NUTS3 and proxy data at LAU."""
+    rng = np.random.default_rng(0)
+
+    source_ids = np.arange(1, n_sources + 1)
+    source_codes = np.array([f"X{i:04d}" for i in range(n_sources)])
+
+    target_ids = np.arange(n_sources + 1, n_sources + n_targets + 1)
+    match_positions = np.sort(rng.integers(0, n_sources, n_targets))
+    target_codes = np.array(
+        [f"{source_codes[pos]}_{i:06d}" for i, pos in enumerate(match_positions)]
+    )
+
+    regions = pd.DataFrame(
+        {
+            "id": np.concatenate([source_ids, target_ids]),
+            "region_code": np.concatenate([source_codes, target_codes]),
+            "resolution": ["NUTS3"] * n_sources + ["LAU"] * n_targets,
+        }
+    )
+
+    var_data = pd.DataFrame(
+        {
+            "region_id": np.repeat(source_ids, n_years),
+            "region_code": np.repeat(source_codes, n_years),
+            "value": rng.random(n_sources * n_years) * 1000,
+            "confidence_level_id": rng.integers(1, 6, n_sources * n_years),
+            "year": np.tile(np.arange(2020, 2020 + n_years), n_sources),
+            "var_detail_id": 7,
+            "proxy_detail_id": 2,
+        }
+    )
+
+    proxy_data = pd.DataFrame(
+        {
+            "region_id": target_ids,
+            "region_code": target_codes,
+            "value": rng.random(n_targets),
+            "year": 2018,
+            "confidence_level_id": rng.integers(1, 6, n_targets),
+            "match_region_id": source_ids[match_positions],
+        }
+    )
+
+    return regions, var_data, proxy_data
+
+
+############## Previous implementations ##################
+def previous_apply_binary_disaggregation_criteria(
+    proxy_data, binary_disaggregation_criteria, target_resolution
+):
+    out_proxy_data = proxy_data.copy()
+
+    [equation, threshold] = binary_disaggregation_criteria.split(">=")
+
+    result = disagg_utils.solve_proxy_equation(equation, target_resolution)
+    result = result[["region_id", "region_code", "value"]].copy()
+    merged = out_proxy_data.merge(result, on=["region_id", "region_code"], how="left")
+    merged.loc[merged["value_y"] < float(threshold), "value_x"] = 0
+
+    return merged.drop(columns=["value_y"]).rename(columns={"value_x": "value"})
+
+
+def previous_get_proxy_based_disaggregated_data(
+    var_data, proxy_data, proxy_confidence_level
+):
+    n_sources = len(var_data)
+
+    source_index = pd.DataFrame(
+        {
+            "match_region_id": var_data["region_id"].to_numpy(),
+            "source_pos": np.arange(n_sources),
+        }
+    )
+    disagg_data = proxy_data.merge(source_index, on="match_region_id", how="inner")
+    source_pos = disagg_data.pop("source_pos").to_numpy()
+
+    proxy_values = disagg_data.pop("value").to_numpy(dtype=float)
+    totals = np.bincount(source_pos, weights=proxy_values, minlength=n_sources)
+    counts = np.bincount(source_pos, minlength=n_sources)
+    is_bad_proxy = totals == 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = np.where(
+            is_bad_proxy[source_pos],
+            1 / counts[source_pos],
+            proxy_values / totals[source_pos],
+        )
+
+    disagg_data["value"] = shares * var_data["value"].to_numpy(dtype=float)[source_pos]
+
+    source_confidence_level = np.minimum(
+        var_data["confidence_level_id"].to_numpy(), proxy_confidence_level
+    )
+    disagg_data["confidence_level_id"] = np.minimum(
+        disagg_data["confidence_level_id"].to_numpy(),
+        source_confidence_level[source_pos],
+    )
+
+    for col in ["year", "var_detail_id", "proxy_detail_id"]:
+        disagg_data[col] = var_data[col].to_numpy()[source_pos]
+
+    disagg_data.drop(columns=["region_code", "match_region_id"], inplace=True)
+
+    return disagg_data
+
+
+def previous_get_share_disaggregated_data(
+    var_data, target_regions, shares, proxy_confidence_level
+):
+    target_ids = target_regions["region_id"].to_numpy()
+    match_ids = target_regions["match_region_id"].to_numpy()
+    target_confidence_levels = target_regions["confidence_level_id"].to_numpy()
+
+    row_source_ids = var_data["region_id"].to_numpy()
+    row_values = var_data["value"].to_numpy(dtype=float)
+    row_confidence_levels = np.minimum(
+        var_data["confidence_level_id"].to_numpy(), proxy_confidence_level
+    )
+
+    row_pos_list, target_pos_list, value_list = [], [], []
+    for source_id in np.unique(row_source_ids):
+        row_pos = np.flatnonzero(row_source_ids == source_id)
+        target_pos = np.flatnonzero(match_ids == source_id)
+
+        value_list.append(np.outer(row_values[row_pos], shares[target_pos]).ravel())
+        row_pos_list.append(np.repeat(row_pos, len(target_pos)))
+        target_pos_list.append(np.tile(target_pos, len(row_pos)))
+
+    values = np.concatenate(value_list)
+    row_pos = np.concatenate(row_pos_list).astype(int)
+    target_pos = np.concatenate(target_pos_list).astype(int)
+
+    final_df = pd.DataFrame(
+        {
+            "region_id": target_ids[target_pos],
+            "confidence_level_id": np.minimum(
+                row_confidence_levels[row_pos], target_confidence_levels[target_pos]
+            ),
+            "value": values,
+        }
+    )
+    for col in ["var_detail_id", "proxy_detail_id", "year"]:
+        final_df[col] = var_data[col].to_numpy()[row_pos]
+
+    return final_df
+
+
+def previous_get_equally_distributed_data(var_data, regions_df, proxy_confidence_level):
+    var_data = var_data.assign(
+        confidence_level_id=np.minimum(
+            var_data["confidence_level_id"].to_numpy(), proxy_confidence_level
+        )
+    )
+
+    final_df = pd.merge(
+        regions_df[["region_id", "match_region_id"]],
+        var_data.drop(columns=["region_code"]).rename(
+            columns={"region_id": "match_region_id"}
+        ),
+        on="match_region_id",
+        how="right",
+    )
+    final_df.drop(columns=["match_region_id"], inplace=True)
+
+    return final_df
+
+
+############## Benchmark ##################
+def trace(func) -> tuple:
+    """Return the result of `func`, its duration, the peak memory and the memory still
+    allocated at the end (e.g. the result) in MB.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size for stat in snapshot.statistics("filename"))
+
+    return result, duration, peak / 1024**2, allocated / 1024**2
+
+
+def assert_same_result(result: pd.DataFrame, expected: pd.DataFrame) -> None:
+    sort_cols = [col for col in ["year", "region_id"] if col in result.columns]
+    result = result.sort_values(sort_cols).reset_index(drop=True)
+    expected = expected.sort_values(sort_cols).reset_index(drop=True)
+
+    for col in expected.select_dtypes("number").columns:
+        np.testing.assert_allclose(
+            result[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float)
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sources", type=int, default=400)
+    parser.add_argument("--targets", type=int, default=100000)
+    parser.add_argument("--years", type=int, default=9)
+    args = parser.parse_args()
+
+    regions, var_data, proxy_data = get_lau_data(args.sources, args.targets, args.years)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # NOTE: the region catalogue is read from this file instead of the DB
+        os.environ["REGION_CATALOGUE_FILE"] = os.path.join(tmp_dir, "regions.parquet")
+        regions.to_parquet(os.environ["REGION_CATALOGUE_FILE"], index=False)
+
+        criterion = proxy_data.drop(columns=["match_region_id"])
+        proxy_cache.put(CRITERION_VAR, "LAU", criterion, var_detail_id=-1)
+
+        target_regions = proxy_data[["region_id", "match_region_id"]].assign(
+            confidence_level_id=proxy_data["confidence_level_id"]
+        )
+        shares, _ = disagg_utils.get_proxy_shares(proxy_data)
+        regions_df = proxy_data[["region_id", "match_region_id"]]
+
+        stages = {
+            "binary_criteria": (
+                lambda: previous_apply_binary_disaggregation_criteria(
+                    proxy_data, f"{CRITERION_VAR}>=0.5", "LAU"
+                ),
+                lambda: disagg_utils.apply_binary_disaggregation_criteria(
+                    proxy_data, f"{CRITERION_VAR}>=0.5", "LAU"
+                ),
+            ),
+            "proxy_based": (
+                lambda: previous_get_proxy_based_disaggregated_data(
+                    var_data, proxy_data, 4
+                ),
+                lambda: disaggregation.get_proxy_based_disaggregated_data(
+                    var_data, proxy_data, 4, False
+                )[0],
+            ),
+            "share_based": (
+                lambda: previous_get_share_disaggregated_data(
+                    var_data, target_regions, shares, 4
+                ),
+                lambda: disaggregation.get_share_disaggregated_data(
+                    var_data, target_regions, shares, 4, False
+                )[0],
+            ),
+            "equal": (
+                lambda: previous_get_equally_distributed_data(var_data, regions_df, 4),
+                lambda: disaggregation.get_equally_distributed_data(
+                    var_data, "NUTS3", "LAU", 4
+                ),
+            ),
+        }
+
+        # NOTE: builds the region catalogue and its child index outside the traced calls
+        disaggregation.get_equally_distributed_data(
+            var_data.iloc[:1], "NUTS3", "LAU", 4
+        )
+
+        print(
+            f"{args.sources} sources x {args.years} years, {args.targets} targets"
+            f" -> {args.targets * args.years} rows"
+        )
+        print(
+            f"{'stage':<16} {'version':<9} {'seconds':>8} {'peak MB':>9} {'alive MB':>9}"
+        )
+        for stage, (previous_func, current_func) in stages.items():
+            results = []
+            for version, func in [
+                ("previous", previous_func),
+                ("current", current_func),
+            ]:
+                result, duration, peak_mb, alive_mb = trace(func)
+                results.append(result)
+                print(
+                    f"{stage:<16} {version:<9} {duration:>8.3f} {peak_mb:>9.1f} {alive_mb:>9.1f}"
+                )
+
+            assert_same_result(results[1], results[0])
+
+        proxy_cache.invalidate(var_names=[CRITERION_VAR])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Benchmark writes of LAU-sized disaggregation outputs into processed_data.
+
+Compares the binary COPY writer (``db_access.write_table``) with the two previous paths of
+``add_to_processed_data``: CSV COPY through ``csv.writer`` (<= 10k rows) and dask
+``to_sql(parallel=True)`` with 10 partitions (> 10k rows).
+
+The rows are written into the table ``benchmark_processed_data``, a copy of the
+processed_data definition that is dropped afterwards. With ``--encode-only`` only the
+serialization is timed and no database is needed.
+
+Usage::
+
+    python benchmarks/benchmark_processed_data_write.py --rows 10000 1000000 10000000
+"""
+import argparse
+import csv
+import time
+from io import StringIO
+import numpy as np
+import pandas as pd
+from zoomin import binary_copy
+from zoomin import db_access
+from zoomin import staging
+
+BENCHMARK_TABLE = "benchmark_processed_data"
+
+COLUMN_TYPES = {
+    "region_id": "int4",
+    "var_detail_id": "int4",
+    "confidence_level_id": "int4",
+    "proxy_detail_id": "int4",
+    "year": "int4",
+    "value": "float8",
+}
+
+
+def get_lau_output(n_rows: int) -> pd.DataFrame:
+    """Return synthetic disaggregation output with `n_rows` rows."""
+    rng = np.random.default_rng(0)
+
+    return pd.DataFrame(
+        {
+            "region_id": rng.integers(1, 100000, n_rows),
+            "var_detail_id": rng.integers(1, 2000, n_rows),
+            "confidence_level_id": rng.integers(1, 6, n_rows),
+            "proxy_detail_id": rng.integers(1, 500, n_rows),
+            "year": rng.integers(2015, 2051, n_rows),
+            "value": rng.random(n_rows) * 1000,
+        }
+    )
+
+
+def _psql_insert_copy(table, conn, keys, data_iter):
+    """Previous CSV COPY method of add_to_processed_data."""
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        s_buf = StringIO()
+        writer = csv.writer(s_buf)
+        writer.writerows(data_iter)
+        s_buf.seek(0)
+
+        columns = ", ".join(keys)
+        cur.copy_expert(
+            sql=f"COPY {table.name} ({columns}) FROM STDIN WITH CSV", file=s_buf
+        )
+
+
+def write_csv_copy(data: pd.DataFrame) -> None:
+    data.to_sql(
+        BENCHMARK_TABLE,
+        db_access.get_db_engine(),
+        index=False,
+        if_exists="append",
+        method=_psql_insert_copy,
+    )
+
+
+def write_dask_to_sql(data: pd.DataFrame) -> None:
+    import dask.dataframe as dd
+
+    ddf = dd.from_pandas(data, npartitions=10)
+    ddf.to_sql(
+        name=BENCHMARK_TABLE,
+        uri=db_access.get_db_uri(),
+        index=False,
+        if_exists="append",
+        parallel=True,
+    )
+
+
+def write_binary_copy(data: pd.DataFrame) -> None:
+    db_access.write_table(data, BENCHMARK_TABLE)
+
+
+def encode_csv(data: pd.DataFrame) -> None:
+    s_buf = StringIO()
+    csv.writer(s_buf).writerows(data.itertuples(index=False))
+
+
+def encode_binary(data: pd.DataFrame) -> None:
+    for _ in binary_copy.iter_binary_copy(data, COLUMN_TYPES):
+        pass
+
+
+def run(name: str, func, data: pd.DataFrame) -> None:
+    start = time.perf_counter()
+    func(data)
+    duration = time.perf_counter() - start
+
+    print(
+        f"{name:<14} {len(data):>10} rows {duration:>9.3f} s {len(data) / duration:>12.0f} rows/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[10000, 1000000, 10000000]
+    )
+    parser.add_argument("--encode-only", action="store_true")
+    args = parser.parse_args()
+
+    if args.encode_only:
+        methods = {"csv.writer": encode_csv, "binary": encode_binary}
+    else:
+        methods = {
+            "csv_copy": write_csv_copy,
+            "dask_to_sql": write_dask_to_sql,
+            "binary_copy": write_binary_copy,
+        }
+        db_access.execute_sql_cmd(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE};")
+        staging.create_staging_table(BENCHMARK_TABLE, unlogged=False)
+
+    try:
+        for n_rows in args.rows:
+            data = get_lau_output(n_rows)
+            for name, func in methods.items():
+                run(name, func, data)
+
+    finally:
+        if not args.encode_only:
+            db_access.execute_sql_cmd(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE};")
+
+
+if __name__ == "__main__":
+    main()
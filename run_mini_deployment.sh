@@ -1,64 +1,18 @@
 #!/bin/bash
 set -e # exits upon first error in any of the commands
 
+# stages of different countries overlap, each stage with its own DB connection budget.
+# About WORKERS * (CONNECTIONS_PER_COUNTRY + 1) connections are opened to the DB server
+# (one per running job and one for each Snakemake process, see zoomin/orchestrator.py)
+WORKERS=${WORKERS:-4}
+CORES_PER_COUNTRY=${CORES_PER_COUNTRY:-$(( $(nproc) / WORKERS > 0 ? $(nproc) / WORKERS : 1 ))}
+CONNECTIONS_PER_COUNTRY=${CONNECTIONS_PER_COUNTRY:-8}
+
 # List of databases
 DATABASES=("it")
 
-# Run snakemake for each database in parallel
-for db_name in "${DATABASES[@]}"; do 
-    export DB_NAME=$db_name
-
-    # copy and agggregate data 
-    cd snakemake/copy_and_agg
-    START=$(date +%s)
-    snakemake -c 1 -j 1
-    END=$(date +%s)
-
-    duration=$((END - START))
-    echo "Time taken to copy and aggregate data: $duration seconds ===================================="
-
-    # # Disaggregate to NUTS1
-    # cd ../nuts1_disagg
-    # START=$(date +%s)
-    # snakemake -c 1 -j 1
-    # END=$(date +%s)
-
-    # duration=$((END - START))
-    # echo "Time taken to disaggregate to NUTS1: $duration seconds ===================================="
-
-    # # Disaggregate to NUTS2
-    # cd ../nuts2_disagg
-    # START=$(date +%s)
-    # snakemake -c 1 -j 1
-    # END=$(date +%s)
-
-    # duration=$((END - START))
-    # echo "Time taken to disaggregate to NUTS2: $duration seconds ===================================="
-
-    # Disaggregate to NUTS3
-    cd ../nuts3_disagg
-    START=$(date +%s)
-    snakemake -c 1 -j 1
-    END=$(date +%s)
-
-    duration=$((END - START))
-    echo "Time taken to disaggregate to NUTS3: $duration seconds ===================================="
-
-    # # Disaggregate to LAU
-    # cd ../lau_disagg
-    # START=$(date +%s)
-    # snakemake -c 1 -j 1
-    # END=$(date +%s)
-
-    # duration=$((END - START))
-    # echo "Time taken to disaggregate to LAU: $duration seconds ===================================="
-
-    # Post disaggregation calculation 
-    cd ../post_disagg_calculation
-    START=$(date +%s)
-    snakemake -c 1 -j 1
-    END=$(date +%s)
-
-    duration=$((END - START))
-    echo "Time taken to perform post disaggregation calculation: $duration seconds ===================================="
-done
\ No newline at end of file
+# Run the stages of all databases. Finished stages are skipped, so rerun to resume
+python -m zoomin.orchestrator "${DATABASES[@]}" --stages copy_and_agg nuts3_disagg post_disagg_calculation \
+    --workers $WORKERS \
+    --cores-per-country $CORES_PER_COUNTRY \
+    --connections-per-country $CONNECTIONS_PER_COUNTRY
@@ -0,0 +1,78 @@
+import struct
+import numpy as np
+import pandas as pd
+from zoomin.binary_copy import (
+    COPY_HEADER,
+    COPY_TRAILER,
+    encode_rows,
+    is_supported,
+    iter_binary_copy,
+)
+
+COLUMN_TYPES = {
+    "region_id": "int4",
+    "proxy_detail_id": "int4",
+    "year": "int2",
+    "value": "float8",
+    "pathway": "varchar",
+}
+
+
+def encode_row(row):
+    """Reference encoding of one row with struct."""
+    formats = {"int2": ">h", "int4": ">i", "float8": ">d"}
+
+    encoded = struct.pack(">h", len(row))
+    for (column, type_name), value in zip(COLUMN_TYPES.items(), row):
+        if pd.isna(value):
+            encoded += struct.pack(">i", -1)
+        elif type_name == "varchar":
+            value = value.encode()
+            encoded += struct.pack(">i", len(value)) + value
+        else:
+            value = float(value) if type_name == "float8" else int(value)
+            value = struct.pack(formats[type_name], value)
+            encoded += struct.pack(">i", len(value)) + value
+
+    return encoded
+
+
+def test_encode_rows():
+    data = pd.DataFrame(
+        {
+            "region_id": [1, 2, 3],
+            "proxy_detail_id": [np.nan, 2.0, 3.0],
+            "year": [2020, 2025, 2030],
+            "value": [0.5, np.nan, -3.25],
+            "pathway": ["national", None, "with_behavioural_changes"],
+        }
+    )
+
+    expected = b"".join(encode_row(row) for row in data.itertuples(index=False))
+    assert encode_rows(data, COLUMN_TYPES) == expected
+
+    # rows without NULLs and with equally long strings share one layout
+    data = data.fillna({"proxy_detail_id": 1, "value": 0}).assign(pathway="national")
+
+    expected = b"".join(encode_row(row) for row in data.itertuples(index=False))
+    assert encode_rows(data, COLUMN_TYPES) == expected
+
+
+def test_iter_binary_copy():
+    data = pd.DataFrame(
+        {
+            "region_id": np.arange(5),
+            "proxy_detail_id": 1,
+            "year": 2020,
+            "value": np.linspace(0, 1, 5),
+            "pathway": "national",
+        }
+    )
+
+    chunks = list(iter_binary_copy(data, COLUMN_TYPES, chunksize=2))
+
+    assert len(chunks) == 3
+    assert chunks[-1] == COPY_HEADER + encode_row(data.iloc[4]) + COPY_TRAILER
+
+    assert is_supported(COLUMN_TYPES)
+    assert not is_supported({"value": "numeric"})
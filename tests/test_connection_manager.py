@@ -0,0 +1,36 @@
+import os
+from zoomin.connection_manager import ConnectionManager
+
+
+def test_connection_manager(tmp_path):
+    manager = ConnectionManager(lambda: f"sqlite:///{tmp_path / 'test.db'}")
+
+    # nothing is created before first use
+    assert manager.metrics()["checkouts"] == 0
+    assert manager._engine is None
+
+    with manager.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE regions (id INTEGER, region_code TEXT)")
+        cursor.execute("INSERT INTO regions VALUES (1, 'ITC11')")
+
+        assert manager.metrics()["checked_out"] == 1
+
+    with manager.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT region_code FROM regions")
+        assert cursor.fetchall() == [("ITC11",)]
+
+    metrics = manager.metrics()
+    assert metrics["checkouts"] == 2
+    assert metrics["checked_out"] == 0
+    # the pooled connection is reused
+    assert metrics["connects"] == 1
+
+    # a forked process gets its own engine
+    engine = manager.get_engine()
+    manager._pid = os.getpid() + 1
+    assert manager.get_engine() is not engine
+    assert manager.metrics()["checkouts"] == 0
+
+    manager.dispose()
@@ -1,4 +1,5 @@
 from zoomin.db_access import get_values
+from zoomin.copy_and_aggregate_collected_data import get_aggregation_expression
 import pytest
 import numpy as np
 
@@ -82,3 +83,13 @@ def test_lau_data_aggregation(region):
     )
 
     assert agg_value == np.sum(lau_values).round(5)
+
+
+def test_aggregation_expression():
+    sql_expression = get_aggregation_expression(["SUM", "AVG"])
+
+    assert "WHEN 'SUM' THEN CAST(SUM(scd.value) AS numeric)" in sql_expression
+    assert "WHEN 'AVG' THEN CAST(AVG(scd.value) AS numeric)" in sql_expression
+
+    with pytest.raises(ValueError):
+        get_aggregation_expression(["SUM(1); DROP TABLE regions; --"])
@@ -0,0 +1,96 @@
+from collections import namedtuple
+from contextlib import contextmanager
+import pytest
+from zoomin import db_access
+
+Column = namedtuple("Column", ["name", "type_code"])
+
+
+class FakeCursor:
+    """Cursor that returns `csv_text` for COPY ... TO STDOUT."""
+
+    def __init__(self, csv_text, copy_error=None):
+        self.csv_text = csv_text
+        self.copy_error = copy_error
+        self.description = [
+            Column("region_id", 23),
+            Column("region_code", 1043),
+            Column("value", 701),
+            Column("is_valid", 16),
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql_cmd, params=None):
+        pass
+
+    def copy_expert(self, sql_cmd, file):
+        assert sql_cmd.startswith("COPY (SELECT")
+        # NOTE: written in small pieces, like the rows arrive from the server
+        for start in range(0, len(self.csv_text), 7):
+            file.write(self.csv_text[start : start + 7].encode())
+        if self.copy_error is not None:
+            raise self.copy_error
+
+
+def mock_connection(monkeypatch, cursor):
+    class FakeConnection:
+        def cursor(self):
+            return cursor
+
+    @contextmanager
+    def db_connection():
+        yield FakeConnection()
+
+    monkeypatch.setattr(db_access, "db_connection", db_connection)
+
+
+def test_get_table(monkeypatch):
+    csv_text = "region_id,region_code,value,is_valid\n"
+    csv_text += "".join(
+        f"{i},IT{i:05d},{i / 2},{'t' if i % 2 else 'f'}\n" for i in range(5000)
+    )
+    mock_connection(monkeypatch, FakeCursor(csv_text))
+
+    table = db_access.get_table("SELECT * FROM regions;")
+
+    assert len(table) == 5000
+    assert table["region_id"].tolist()[:3] == [0, 1, 2]
+    assert table["region_code"].iloc[-1] == "IT04999"
+    assert table["value"].iloc[3] == 1.5
+    assert table["is_valid"].tolist()[:2] == [False, True]
+
+
+def test_get_table_without_rows(monkeypatch):
+    mock_connection(monkeypatch, FakeCursor("region_id,region_code,value,is_valid\n"))
+
+    table = db_access.get_table("SELECT * FROM regions")
+
+    assert len(table) == 0
+    assert list(table.columns) == ["region_id", "region_code", "value", "is_valid"]
+
+
+def test_get_table_raises_error_of_copy(monkeypatch):
+    # the query fails after the first rows were sent
+    cursor = FakeCursor(
+        "region_id,region_code,value,is_valid\n1,IT1,0.5,t\n",
+        copy_error=RuntimeError("division by zero"),
+    )
+    mock_connection(monkeypatch, cursor)
+
+    with pytest.raises(RuntimeError, match="division by zero"):
+        db_access.get_table("SELECT * FROM regions")
+
+
+def test_get_table_raises_parse_error(monkeypatch):
+    csv_text = "region_id,region_code,value,is_valid\n"
+    csv_text += "x,IT1,0.5,t\n" * 100000
+    mock_connection(monkeypatch, FakeCursor(csv_text))
+
+    # the COPY is not left blocked on the pipe
+    with pytest.raises(Exception, match="invalid value"):
+        db_access.get_table("SELECT * FROM regions")
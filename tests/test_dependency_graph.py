@@ -0,0 +1,45 @@
+import pandas as pd
+from zoomin import dependency_graph as dep_graph
+
+
+def test_build_dependency_graph():
+    var_proxies = pd.DataFrame(
+        {
+            "var_name": ["population", "road_network", "deaths"],
+            "disaggregation_proxy": [
+                "no proxy, same value all regions",
+                "population * 0.5 + statistical_area",
+                "population",
+            ],
+            "disaggregation_binary_criteria": [None, None, "road_network>=10"],
+        }
+    )
+    post_disagg_calculations = pd.DataFrame(
+        {
+            "var_name": ["relative_deaths"],
+            "post_disagg_calculation_eq": ["deaths / population * 100"],
+        }
+    )
+
+    graph = dep_graph.build_dependency_graph(var_proxies, post_disagg_calculations)
+
+    assert graph == {
+        "population": set(),
+        "road_network": {"population", "statistical_area"},
+        "deaths": {"population", "road_network"},
+        "relative_deaths": {"deaths", "population"},
+    }
+    assert dep_graph.find_cycle(graph) is None
+
+    stage_outputs = dep_graph.get_stage_outputs(
+        ["population", "cproj_annual_mean_temperature-2025"], "{job_name}.log"
+    )
+    assert dep_graph.get_input_files("deaths", graph, stage_outputs) == [
+        "population.log"
+    ]
+
+
+def test_find_cycle():
+    graph = {"a": {"b"}, "b": {"c"}, "c": {"a"}, "d": set()}
+
+    assert dep_graph.find_cycle(graph) == ["a", "b", "c", "a"]
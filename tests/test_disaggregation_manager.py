@@ -0,0 +1,250 @@
+import numpy as np
+import pandas as pd
+from zoomin import disaggregation_manager as disagg_manager
+from zoomin import region_catalogue
+from zoomin.region_catalogue import RegionCatalogue
+
+
+def get_test_proxy_data():
+    # LAU regions of the NUTS0 region IT (1)
+    return pd.DataFrame(
+        {
+            "region_id": [11, 12, 13],
+            "region_code": ["IT_1", "IT_2", "IT_3"],
+            "value": [1.0, 1.0, 1.0],
+            "year": [2018, 2018, 2018],
+            "confidence_level_id": [5, 5, 5],
+            "match_region_id": [1, 1, 1],
+        }
+    )
+
+
+def get_test_eucalc_data(var_unit):
+    return pd.DataFrame(
+        {
+            "region_id": [1, 1],
+            "var_detail_id": [7, 7],
+            "pathway": ["national", "with_behavioural_changes"],
+            "value": [10.0, 20.0],
+            "confidence_level_id": [5, 5],
+            "year": [2030, 2030],
+            "proxy_detail_id": [2, 2],
+            "var_unit": [var_unit] * 2,
+            "disaggregation_proxy": ["population"] * 2,
+            "proxy_confidence_level": [4, 4],
+            "disaggregation_binary_criteria": [None, None],
+        }
+    )
+
+
+def mock_eucalc_disaggregation(monkeypatch, var_unit):
+    """Replace the DB access of the EUCalc disaggregation and return the written frames."""
+    written = []
+
+    monkeypatch.setattr(
+        disagg_manager, "get_table", lambda sql_cmd: get_test_eucalc_data(var_unit)
+    )
+    monkeypatch.setattr(
+        disagg_manager.disagg,
+        "get_disaggregation_proxy_data",
+        lambda *args: get_test_proxy_data(),
+    )
+    monkeypatch.setattr(disagg_manager, "add_to_processed_data", written.append)
+
+    return written
+
+
+def test_eucalc_number_vars_are_truncated(monkeypatch):
+    written = mock_eucalc_disaggregation(monkeypatch, "number")
+
+    disagg_manager.disaggregate_eucalc_var_all_pathways("eucalc_var", "LAU")
+
+    # NOTE: EUCalc vars with var_unit "number" are truncated like collected vars
+    disagg_data = pd.concat(written).sort_values(["pathway", "region_id"])
+    assert disagg_data["value"].tolist() == [3.0, 3.0, 3.0, 6.0, 6.0, 6.0]
+
+
+def test_eucalc_var_all_pathways_is_written_in_chunks(monkeypatch):
+    written = mock_eucalc_disaggregation(monkeypatch, "kt")
+    # NOTE: small chunks, so that each pathway is written in a chunk of its own
+    monkeypatch.setenv("ZOOMIN_MAX_CHUNK_MB", "0.0001")
+
+    disagg_manager.disaggregate_eucalc_var_all_pathways("eucalc_var", "LAU")
+
+    assert [chunk["pathway"].unique().tolist() for chunk in written] == [
+        ["national"],
+        ["with_behavioural_changes"],
+    ]
+    np.testing.assert_allclose(pd.concat(written)["value"], [10 / 3] * 3 + [20 / 3] * 3)
+
+
+def test_eucalc_vars_of_other_units_are_not_truncated(monkeypatch):
+    written = mock_eucalc_disaggregation(monkeypatch, "kt")
+
+    disagg_manager.disaggregate_eucalc_var_all_pathways("eucalc_var", "LAU")
+
+    disagg_data = pd.concat(written).sort_values(["pathway", "region_id"])
+    np.testing.assert_allclose(disagg_data["value"], [10 / 3] * 3 + [20 / 3] * 3)
+
+
+def test_disaggregate_eucalc_var_passes_var_unit(monkeypatch):
+    calls = []
+
+    def get_table(sql_cmd):
+        if "proxy_details" in sql_cmd:
+            return pd.DataFrame(
+                {
+                    "disaggregation_proxy": ["population"],
+                    "proxy_confidence_level": [4],
+                    "disaggregation_binary_criteria": [None],
+                }
+            )
+        return get_test_eucalc_data("number").iloc[:1]
+
+    monkeypatch.setattr(disagg_manager, "get_table", get_table)
+    monkeypatch.setattr(disagg_manager, "get_values", lambda sql_cmd: "number")
+    monkeypatch.setattr(
+        disagg_manager.disagg,
+        "perform_proxy_based_disaggregation",
+        lambda *args, **kwargs: calls.append(args),
+    )
+
+    disagg_manager.disaggregate_eucalc_var("eucalc_var", "national", 2030, "LAU")
+
+    # the unit read from var_details, not the query string
+    assert calls[0][-1] == "number"
+
+
+def get_test_collected_data():
+    # 3 collected vars at NUTS2, ITC1 (10) and ITF3 (20)
+    var_data = pd.DataFrame(
+        {
+            "var_name": ["population"] * 2 + ["deaths"] * 2 + ["area"] * 2,
+            "var_unit": ["number"] * 4 + ["km2"] * 2,
+            "region_id": [10, 20] * 3,
+            "region_code": ["ITC1", "ITF3"] * 3,
+            "var_detail_id": [1, 1, 2, 2, 3, 3],
+            "value": [10.0, 7.0, 5.0, 3.0, 2.0, 1.0],
+            "confidence_level_id": [5, 3, 5, 5, 4, 4],
+            "year": [2020] * 6,
+            "proxy_detail_id": [1, 1, 1, 1, 2, 2],
+            "disaggregation_proxy": ["road_network"] * 4
+            + ["no proxy, same value all regions"] * 2,
+            "proxy_confidence_level": [4] * 4 + [2] * 2,
+            "disaggregation_binary_criteria": [None] * 6,
+        }
+    )
+    # NUTS3 regions of ITC1 (10) and ITF3 (20). The proxy is 0 in all regions of ITF3
+    proxy_data = pd.DataFrame(
+        {
+            "region_id": [1, 2, 3, 4, 5],
+            "region_code": ["ITC11", "ITC12", "ITC13", "ITF31", "ITF32"],
+            "value": [1.0, 3.0, 0.0, 0.0, 0.0],
+            "year": [2018] * 5,
+            "confidence_level_id": [4, 2, 4, 4, 4],
+            "match_region_id": [10, 10, 10, 20, 20],
+        }
+    )
+    regions = pd.DataFrame(
+        {
+            "id": [10, 20, 1, 2, 3, 4, 5],
+            "region_code": [
+                "ITC1",
+                "ITF3",
+                "ITC11",
+                "ITC12",
+                "ITC13",
+                "ITF31",
+                "ITF32",
+            ],
+            "resolution": ["NUTS2"] * 2 + ["NUTS3"] * 5,
+        }
+    )
+
+    return var_data, proxy_data, regions
+
+
+def test_disaggregate_batch_matches_per_var_path(monkeypatch):
+    var_data, proxy_data, regions = get_test_collected_data()
+    written = []
+
+    def get_table(sql_cmd):
+        if "FROM proxy_details" in sql_cmd:
+            proxy_detail_id = int(sql_cmd.split("id=")[-1])
+            return (
+                var_data.loc[
+                    var_data["proxy_detail_id"] == proxy_detail_id,
+                    [
+                        "disaggregation_proxy",
+                        "proxy_confidence_level",
+                        "disaggregation_binary_criteria",
+                    ],
+                ]
+                .iloc[:1]
+                .reset_index(drop=True)
+            )
+        if "staged_eucalc_data" in sql_cmd:
+            return var_data.iloc[:0]
+        if "v.var_name IN" in sql_cmd:
+            return var_data
+        var_name = sql_cmd.split("var_name = '")[1].split("'")[0]
+        return var_data[var_data["var_name"] == var_name].reset_index(drop=True)
+
+    def get_values(sql_cmd):
+        var_name = sql_cmd.split("var_name = '")[1].split("'")[0]
+        return var_data.loc[var_data["var_name"] == var_name, "var_unit"].iloc[0]
+
+    monkeypatch.setattr(disagg_manager, "get_table", get_table)
+    monkeypatch.setattr(disagg_manager, "get_values", get_values)
+    monkeypatch.setattr(disagg_manager, "add_to_processed_data", written.append)
+    monkeypatch.setattr(disagg_manager.disagg, "add_to_processed_data", written.append)
+    monkeypatch.setattr(
+        disagg_manager.disagg,
+        "get_disaggregation_proxy_data",
+        lambda *args: proxy_data.copy(),
+    )
+    monkeypatch.setattr(
+        disagg_manager.disagg,
+        "get_child_index",
+        RegionCatalogue(regions).get_child_index,
+    )
+    monkeypatch.setattr(
+        region_catalogue.region_hierarchy,
+        "get_parent_ids",
+        lambda region_ids, resolution: np.where(np.asarray(region_ids) <= 3, 10, 20),
+    )
+    # NOTE: small chunks, so that the result is written in several chunks
+    monkeypatch.setenv("ZOOMIN_MAX_CHUNK_MB", "0.0001")
+
+    var_names = ["population", "deaths", "area"]
+    bad_proxy_dict = disagg_manager.disaggregate_batch(var_names, "NUTS2", "NUTS3")
+    batch_data = pd.concat(written, ignore_index=True)
+    n_batch_chunks = len(written)
+
+    written.clear()
+    per_var_bad_proxy = {}
+    for var_name in var_names:
+        bad_proxy = disagg_manager.disaggregate_collected_var(
+            var_name, "NUTS2", "NUTS3"
+        )
+        if bad_proxy is not None:
+            per_var_bad_proxy[var_name] = bad_proxy
+    per_var_data = pd.concat(written, ignore_index=True)
+
+    assert n_batch_chunks > 1
+    assert (
+        bad_proxy_dict
+        == per_var_bad_proxy
+        == {
+            "population": "bad_proxy",
+            "deaths": "bad_proxy",
+        }
+    )
+
+    columns = ["var_detail_id", "region_id", "value", "confidence_level_id", "year"]
+    sort_cols = ["var_detail_id", "region_id"]
+    pd.testing.assert_frame_equal(
+        batch_data[columns].sort_values(sort_cols).reset_index(drop=True),
+        per_var_data[columns].sort_values(sort_cols).reset_index(drop=True),
+        check_dtype=False,
+    )
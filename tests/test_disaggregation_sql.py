@@ -0,0 +1,165 @@
+from uuid import uuid4
+import pandas as pd
+import pytest
+from zoomin import db_access
+from zoomin import disaggregation as disagg
+from zoomin import disaggregation_manager as disagg_manager
+from zoomin import disaggregation_sql
+
+
+def test_is_sql_backend(monkeypatch):
+    monkeypatch.delenv("ZOOMIN_DISAGG_BACKEND", raising=False)
+    assert not disaggregation_sql.is_sql_backend()
+
+    monkeypatch.setenv("ZOOMIN_DISAGG_BACKEND", "sql")
+    assert disaggregation_sql.is_sql_backend()
+
+
+def test_distribute_data_equally_dispatches_to_sql_backend(monkeypatch):
+    calls = []
+    monkeypatch.setenv("ZOOMIN_DISAGG_BACKEND", "sql")
+    monkeypatch.setattr(
+        disaggregation_sql,
+        "distribute_data_equally",
+        lambda *args: calls.append(args),
+    )
+
+    disagg.distribute_data_equally(
+        pd.DataFrame(),
+        "NUTS3",
+        "LAU",
+        3,
+        staged_source=("staged_climate_data", "d.year = 2025"),
+    )
+
+    assert calls == [("staged_climate_data", "d.year = 2025", "NUTS3", "LAU", 3)]
+
+
+def test_insert_columns():
+    assert (
+        disaggregation_sql._get_insert_columns("staged_eucalc_data")
+        == "region_id, var_detail_id, confidence_level_id, proxy_detail_id, pathway, year, value"
+    )
+
+
+def test_staged_data_is_not_loaded_with_sql_backend(monkeypatch):
+    calls = []
+    sql_cmds = []
+    monkeypatch.setenv("ZOOMIN_DISAGG_BACKEND", "sql")
+
+    def get_table(sql_cmd):
+        sql_cmds.append(sql_cmd)
+        return pd.DataFrame(
+            {
+                "disaggregation_proxy": ["population"],
+                "proxy_confidence_level": [4],
+                "disaggregation_binary_criteria": [None],
+            }
+        )
+
+    monkeypatch.setattr(disagg_manager, "get_table", get_table)
+    monkeypatch.setattr(disagg_manager, "get_values", lambda sql_cmd: 2)
+    monkeypatch.setattr(
+        disagg_manager.disagg,
+        "perform_proxy_based_disaggregation",
+        lambda var_data, *args, **kwargs: calls.append(var_data),
+    )
+
+    disagg_manager.disaggregate_collected_var("population", "NUTS2", "NUTS3")
+
+    # only the proxy details are read, the staged rows are selected in the database
+    assert calls == [None]
+    assert len(sql_cmds) == 1
+    assert "FROM proxy_details WHERE id=2" in sql_cmds[0]
+
+
+@pytest.fixture
+def scratch_table(monkeypatch):
+    """Redirect the writes of the SQL backend to a scratch copy of processed_data."""
+    try:
+        db_access.get_values("SELECT 1;")
+    except Exception:
+        pytest.skip("database not available")
+
+    table = f"tmp_disagg_sql_test_{uuid4().hex[:8]}"
+    disaggregation_sql.staging.create_staging_table(table, unlogged=False)
+    monkeypatch.setattr(disaggregation_sql.staging, "get_target_table", lambda: table)
+
+    yield table
+
+    db_access.execute_sql_cmd(f"DROP TABLE {table};")
+
+
+def _sorted(data, columns):
+    return data[columns].sort_values(columns[:-1]).reset_index(drop=True)
+
+
+def test_proxy_based_disaggregation_matches_pandas(scratch_table):
+    where_clause = "d.var_detail_id = (SELECT id FROM var_details WHERE var_name = 'air_transport_of_freight')"
+    var_data = db_access.get_table(
+        f"""SELECT d.region_id, d.var_detail_id, d.value, d.confidence_level_id, d.year, d.proxy_detail_id
+        FROM staged_collected_data d WHERE {where_clause}"""
+    )
+    proxy_details_row = db_access.get_table(
+        f"""SELECT disaggregation_proxy, proxy_confidence_level, disaggregation_binary_criteria
+        FROM proxy_details WHERE id = {var_data['proxy_detail_id'][0]}"""
+    )
+    proxy_confidence_level = proxy_details_row["proxy_confidence_level"][0]
+    proxy_data = disagg.get_disaggregation_proxy_data(
+        "NUTS2",
+        "NUTS3",
+        proxy_details_row["disaggregation_proxy"][0],
+        proxy_details_row["disaggregation_binary_criteria"][0],
+    )
+
+    expected = pd.concat(
+        final_df
+        for final_df, _ in disagg.iter_proxy_based_disaggregated_data(
+            var_data, proxy_data, proxy_confidence_level, True
+        )
+    )
+    disaggregation_sql.perform_proxy_based_disaggregation(
+        proxy_data,
+        "staged_collected_data",
+        where_clause,
+        proxy_confidence_level,
+        True,
+    )
+    actual = db_access.get_table(f"SELECT * FROM {scratch_table}")
+
+    columns = ["region_id", "var_detail_id", "year", "confidence_level_id", "value"]
+    pd.testing.assert_frame_equal(
+        _sorted(actual, columns), _sorted(expected, columns), check_dtype=False
+    )
+
+
+def test_distribute_data_equally_matches_pandas(scratch_table):
+    var_name, year = db_access.get_table(
+        """SELECT v.var_name, MIN(d.year) AS year FROM staged_climate_data d
+        JOIN var_details v ON d.var_detail_id = v.id
+        GROUP BY v.var_name ORDER BY v.var_name LIMIT 1"""
+    ).iloc[0]
+    where_clause = f"d.var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}') AND d.year = {year}"
+    var_data = db_access.get_table(
+        f"""SELECT d.region_id, d.climate_experiment, d.var_detail_id, d.value, d.confidence_level_id, d.year, d.proxy_detail_id
+        FROM staged_climate_data d WHERE {where_clause}"""
+    )
+
+    expected = pd.concat(
+        disagg.iter_equally_distributed_data(var_data, "NUTS3", "LAU", 3)
+    )
+    disaggregation_sql.distribute_data_equally(
+        "staged_climate_data", where_clause, "NUTS3", "LAU", 3
+    )
+    actual = db_access.get_table(f"SELECT * FROM {scratch_table}")
+
+    columns = [
+        "region_id",
+        "climate_experiment",
+        "year",
+        "confidence_level_id",
+        "value",
+    ]
+    pd.testing.assert_frame_equal(
+        _sorted(actual, columns), _sorted(expected, columns), check_dtype=False
+    )
@@ -0,0 +1,307 @@
+import numpy as np
+import pandas as pd
+from zoomin import disaggregation
+from zoomin import disaggregation_utils
+from zoomin.disaggregation import get_share_disaggregated_data
+from zoomin.disaggregation_utils import (
+    apply_binary_disaggregation_criteria,
+    disaggregate_data,
+    get_proxy_shares,
+)
+from zoomin.proxy_cache import proxy_cache
+from zoomin import region_catalogue
+from zoomin.region_catalogue import RegionCatalogue
+
+
+def get_test_proxy_data():
+    proxy_data = pd.DataFrame(
+        {
+            "region_id": [1, 2, 3, 4, 5],
+            "region_code": ["ITC11", "ITC12", "ITC13", "ITF31", "ITF32"],
+            "value": [1.0, 3.0, 0.0, 0.0, 0.0],
+            "year": [2018, 2018, 2018, 2018, 2018],
+            "confidence_level_id": [4, 2, 4, 4, 4],
+        }
+    )
+    # ids of the NUTS2 regions ITC1 (10) and ITF3 (20)
+    proxy_data["match_region_id"] = [10, 10, 10, 20, 20]
+
+    return proxy_data
+
+
+def test_disaggregate_data():
+    target_data = pd.DataFrame(
+        {
+            "region_id": [10, 20],
+            "region_code": ["ITC1", "ITF3"],
+            "value": [8.0, 10.0],
+            "confidence_level_id": [3, 5],
+            "year": [2020, 2021],
+            "var_detail_id": [7, 7],
+            "proxy_detail_id": [2, 2],
+        }
+    )
+
+    disagg_data, is_bad_proxy = disaggregate_data(target_data, get_test_proxy_data(), 4)
+    disagg_data = disagg_data.set_index("region_code")
+
+    # proxy based shares
+    np.testing.assert_allclose(
+        disagg_data.loc[["ITC11", "ITC12", "ITC13"], "value"], [2.0, 6.0, 0.0]
+    )
+    # equal distribution in case of zero-sum proxy
+    np.testing.assert_allclose(disagg_data.loc[["ITF31", "ITF32"], "value"], [5, 5])
+
+    assert is_bad_proxy.tolist() == [False, True]
+
+    assert disagg_data.loc["ITC11", "confidence_level_id"] == 3
+    assert disagg_data.loc["ITC12", "confidence_level_id"] == 2
+    assert disagg_data.loc["ITF31", "confidence_level_id"] == 4
+
+    assert disagg_data.loc["ITC11", "year"] == 2020
+    assert disagg_data.loc["ITF31", "year"] == 2021
+    assert (disagg_data["var_detail_id"] == 7).all()
+    assert "pathway" not in disagg_data.columns
+
+
+def test_disaggregate_data_with_pathways():
+    target_data = pd.DataFrame(
+        {
+            "region_id": [10, 10],
+            "region_code": ["ITC1", "ITC1"],
+            "pathway": ["national", "with_behavioural_changes"],
+            "value": [4.0, 12.0],
+            "confidence_level_id": [5, 5],
+            "year": [2030, 2030],
+            "var_detail_id": [7, 7],
+            "proxy_detail_id": [2, 2],
+        }
+    )
+
+    disagg_data, is_bad_proxy = disaggregate_data(target_data, get_test_proxy_data(), 5)
+
+    sums = disagg_data.groupby("pathway")["value"].sum()
+
+    assert sums["national"] == 4.0
+    assert sums["with_behavioural_changes"] == 12.0
+    assert not is_bad_proxy.any()
+
+
+def test_get_proxy_shares():
+    shares, bad_proxy_source_ids = get_proxy_shares(get_test_proxy_data())
+
+    np.testing.assert_allclose(shares, [0.25, 0.75, 0.0, 0.5, 0.5])
+    assert bad_proxy_source_ids.tolist() == [20]
+
+
+def test_get_share_disaggregated_data():
+    proxy_data = get_test_proxy_data()
+    shares, _ = get_proxy_shares(proxy_data)
+
+    # 2 pathways x 2 years of the source region ITC1 (10), ITF3 (30) has no target regions
+    var_data = pd.DataFrame(
+        {
+            "region_id": [10, 10, 10, 10, 30],
+            "pathway": ["national"] * 2
+            + ["with_behavioural_changes"] * 2
+            + ["national"],
+            "value": [4.0, 8.0, 12.0, 16.0, 1.0],
+            "confidence_level_id": [3, 5, 5, 5, 5],
+            "year": [2020, 2030, 2020, 2030, 2020],
+            "var_detail_id": [7] * 5,
+            "proxy_detail_id": [2] * 5,
+        }
+    )
+
+    disagg_data, source_ids_without_targets = get_share_disaggregated_data(
+        var_data, proxy_data, shares, 4, is_number=True
+    )
+
+    assert source_ids_without_targets.tolist() == [30]
+    assert len(disagg_data) == 4 * 3
+
+    disagg_data = disagg_data.set_index(["pathway", "year", "region_id"])
+    assert disagg_data.loc[("with_behavioural_changes", 2030, 2), "value"] == 12.0
+    # values are truncated to whole numbers
+    assert disagg_data.loc[("national", 2020, 2), "value"] == 3.0
+    # the lowest confidence level of the data, the proxy and the proxy data is kept
+    assert disagg_data.loc[("national", 2020, 1), "confidence_level_id"] == 3
+    assert disagg_data.loc[("national", 2030, 1), "confidence_level_id"] == 4
+    assert disagg_data.loc[("national", 2030, 2), "confidence_level_id"] == 2
+    assert (disagg_data["var_detail_id"] == 7).all()
+
+
+def test_iter_equally_distributed_data(monkeypatch):
+    regions = pd.DataFrame(
+        {
+            "id": [10, 20, 1, 2, 3, 4, 5],
+            "region_code": [
+                "ITC1",
+                "ITF3",
+                "ITC11",
+                "ITC12",
+                "ITC13",
+                "ITF31",
+                "ITF32",
+            ],
+            "resolution": ["NUTS2"] * 2 + ["NUTS3"] * 5,
+        }
+    )
+    monkeypatch.setattr(
+        disaggregation, "get_child_index", RegionCatalogue(regions).get_child_index
+    )
+    # the NUTS3 regions 1 to 3 belong to ITC1 (10), 4 and 5 to ITF3 (20)
+    monkeypatch.setattr(
+        region_catalogue.region_hierarchy,
+        "get_parent_ids",
+        lambda region_ids, resolution: np.where(np.asarray(region_ids) <= 3, 10, 20),
+    )
+
+    # 2 climate experiments of ITC1 and ITF3, ITG1 (30) is no known region
+    var_data = pd.DataFrame(
+        {
+            "region_id": [10, 20, 10, 30],
+            "climate_experiment": ["RCP4.5", "RCP4.5", "RCP8.5", "RCP4.5"],
+            "value": [1.0, 2.0, 3.0, 4.0],
+            "confidence_level_id": [2, 5, 5, 5],
+            "year": [2030] * 4,
+            "var_detail_id": [7] * 4,
+        }
+    )
+
+    chunks = list(
+        disaggregation.iter_equally_distributed_data(
+            var_data, "NUTS2", "NUTS3", 3, chunksize=4
+        )
+    )
+
+    # the target rows of a source row are never split across chunks
+    assert [len(chunk) for chunk in chunks] == [3, 2, 3]
+
+    disagg_data = pd.concat(chunks, ignore_index=True)
+    assert disagg_data["region_id"].tolist() == [1, 2, 3, 4, 5, 1, 2, 3]
+    assert disagg_data["value"].tolist() == [1.0] * 3 + [2.0] * 2 + [3.0] * 3
+    assert disagg_data["climate_experiment"].tolist()[-3:] == ["RCP8.5"] * 3
+    assert disagg_data["confidence_level_id"].tolist() == [2] * 3 + [3] * 5
+
+
+def test_iter_proxy_based_disaggregated_data(monkeypatch):
+    target_data = pd.DataFrame(
+        {
+            "region_id": [10, 20, 10],
+            "region_code": ["ITC1", "ITF3", "ITC1"],
+            "value": [8.0, 10.0, 4.0],
+            "confidence_level_id": [3, 5, 5],
+            "year": [2020, 2020, 2030],
+            "var_detail_id": [7, 7, 7],
+            "proxy_detail_id": [2, 2, 2],
+        }
+    )
+
+    disagg_data, is_bad_proxy = disaggregation.get_proxy_based_disaggregated_data(
+        target_data, get_test_proxy_data(), 4, False
+    )
+
+    proxy_indexes = []
+    get_proxy_index = disaggregation_utils.get_proxy_index
+    monkeypatch.setattr(
+        disaggregation_utils,
+        "get_proxy_index",
+        lambda proxy_data: proxy_indexes.append(get_proxy_index(proxy_data))
+        or proxy_indexes[-1],
+    )
+
+    chunks = list(
+        disaggregation.iter_proxy_based_disaggregated_data(
+            target_data, get_test_proxy_data(), 4, False, chunksize=4
+        )
+    )
+
+    # 3 + 2 target rows exceed the chunk size
+    assert [len(chunk) for chunk, _ in chunks] == [3, 2, 3]
+    # the proxy rows are indexed once for all chunks
+    assert len(proxy_indexes) == 1
+    pd.testing.assert_frame_equal(
+        pd.concat([chunk for chunk, _ in chunks])
+        .sort_values(["year", "region_id"])
+        .reset_index(drop=True),
+        disagg_data.sort_values(["year", "region_id"]).reset_index(drop=True),
+    )
+    assert pd.concat([bad for _, bad in chunks]).tolist() == is_bad_proxy.tolist()
+
+    # the default chunk size follows the memory ceiling
+    monkeypatch.setenv("ZOOMIN_MAX_CHUNK_MB", "1")
+    assert disaggregation.get_max_chunk_rows(1024) == 1024
+
+
+def test_apply_binary_disaggregation_criteria():
+    proxy_data = get_test_proxy_data()
+    proxy_data["value"] = 1.0
+
+    # normalized values of the criterion var, ITF32 (5) has no data
+    criterion = get_test_proxy_data().drop(columns=["match_region_id"]).iloc[:4]
+    criterion["value"] = [0.2, 0.6, 0.5, 0.1]
+    proxy_cache.put("forest_cover", "NUTS3", criterion, var_detail_id=-1)
+
+    result = apply_binary_disaggregation_criteria(
+        proxy_data, "forest_cover>=0.5", "NUTS3"
+    )
+
+    assert result["value"].tolist() == [0.0, 1.0, 1.0, 0.0, 1.0]
+    # the other columns are passed on as they are
+    assert result["match_region_id"].tolist() == [10, 10, 10, 20, 20]
+    assert (proxy_data["value"] == 1.0).all()
+
+    proxy_cache.invalidate(var_names=["forest_cover"])
+
+
+def test_get_disaggregation_proxy_data_solves_one_batch(monkeypatch):
+    proxy_data = get_test_proxy_data()
+    loaded_var_names = []
+
+    def get_normalized_proxy_data(var_name, target_resolution):
+        loaded_var_names.append(var_name)
+        return proxy_data.drop(columns=["match_region_id"])
+
+    monkeypatch.setattr(
+        disaggregation_utils, "get_normalized_proxy_data", get_normalized_proxy_data
+    )
+    monkeypatch.setattr(
+        disaggregation_utils.region_hierarchy,
+        "get_parent_ids",
+        lambda region_ids, resolution: proxy_data["match_region_id"].to_numpy(),
+    )
+
+    result = disaggregation.get_disaggregation_proxy_data(
+        "NUTS2", "NUTS3", "population ** 2", "population>=2"
+    )
+
+    # the var shared by the proxy equation and the binary criteria is loaded once
+    assert loaded_var_names == ["population"]
+    assert result["value"].tolist() == [0.0, 9.0, 0.0, 0.0, 0.0]
+    assert result["match_region_id"].tolist() == [10, 10, 10, 20, 20]
+
+
+def test_number_vars_are_truncated_alike():
+    target_data = pd.DataFrame(
+        {
+            "region_id": [10, 20],
+            "value": [8.0, -10.0],
+            "confidence_level_id": [3, 5],
+            "year": [2020, 2020],
+            "var_detail_id": [7, 7],
+            "proxy_detail_id": [2, 2],
+        }
+    )
+
+    # one is_number for all rows and one per row
+    disagg_data, _ = disaggregation.get_proxy_based_disaggregated_data(
+        target_data, get_test_proxy_data(), 4, True
+    )
+    per_row_data, _ = disaggregation.get_proxy_based_disaggregated_data(
+        target_data, get_test_proxy_data(), 4, np.array([True, True])
+    )
+
+    # truncated towards 0, e.g. -5.0 of ITF3 (20) stays -5.0
+    assert disagg_data["value"].tolist() == [2.0, 6.0, 0.0, -5.0, -5.0]
+    pd.testing.assert_frame_equal(disagg_data, per_row_data)
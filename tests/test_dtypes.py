@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from zoomin import dtypes
+from zoomin.disaggregation import get_proxy_based_disaggregated_data
+from zoomin.dtypes import to_compact_dtypes
+
+
+def get_test_data():
+    rng = np.random.default_rng(0)
+    n_targets = 1000
+
+    var_data = pd.DataFrame(
+        {
+            "region_id": [10, 20, 10, 20],
+            "region_code": ["ITC1", "ITF3", "ITC1", "ITF3"],
+            "value": [1234.567, 0.001, 98765.4321, 3.3],
+            "confidence_level_id": [3, 5, 5, 4],
+            "year": [2020, 2020, 2030, 2030],
+            "var_detail_id": [7, 7, 7, 7],
+            "proxy_detail_id": [2, 2, 2, 2],
+        }
+    )
+    proxy_data = pd.DataFrame(
+        {
+            "region_id": np.arange(100, 100 + n_targets),
+            "region_code": [f"IT{i:05d}" for i in range(n_targets)],
+            "value": rng.random(n_targets),
+            "year": 2018,
+            "confidence_level_id": rng.integers(1, 6, n_targets),
+            "match_region_id": np.repeat([10, 20], n_targets // 2),
+        }
+    )
+
+    return var_data, proxy_data
+
+
+def test_to_compact_dtypes(monkeypatch):
+    var_data, _ = get_test_data()
+    var_data["proxy_detail_id"] = var_data["proxy_detail_id"].astype(float)
+    var_data.loc[0, "proxy_detail_id"] = np.nan
+
+    compact_data = to_compact_dtypes(var_data, "test_data")
+
+    assert compact_data["region_id"].dtype == "int32"
+    assert compact_data["confidence_level_id"].dtype == "int8"
+    assert compact_data["year"].dtype == "int16"
+    assert compact_data["region_code"].dtype == "category"
+    assert compact_data["value"].dtype == "float64"
+    # columns with missing values keep their dtype
+    assert compact_data["proxy_detail_id"].dtype == "float64"
+    assert dtypes.memory_savings.stats()["test_data"]["saved"] > 0
+    counters = dtypes.memory_savings.counters()["test_data"]
+    assert counters["bytes_before"] > counters["bytes_after"]
+    assert (
+        dtypes.get_savings_stats(dtypes.memory_savings.counters())
+        == dtypes.memory_savings.stats()
+    )
+
+    monkeypatch.setenv("ZOOMIN_FLOAT32_VALUES", "1")
+    assert to_compact_dtypes(var_data)["value"].dtype == "float32"
+
+    monkeypatch.setenv("ZOOMIN_COMPACT_DTYPES", "0")
+    assert to_compact_dtypes(var_data) is var_data
+
+    dtypes.memory_savings.clear()
+
+
+def test_compact_dtypes_match_float64(monkeypatch):
+    monkeypatch.setenv("ZOOMIN_FLOAT32_VALUES", "1")
+    var_data, proxy_data = get_test_data()
+
+    expected, expected_is_bad_proxy = get_proxy_based_disaggregated_data(
+        var_data, proxy_data, 4, False
+    )
+    result, is_bad_proxy = get_proxy_based_disaggregated_data(
+        to_compact_dtypes(var_data), to_compact_dtypes(proxy_data), 4, False
+    )
+
+    expected = expected.sort_values(["year", "region_id"]).reset_index(drop=True)
+    result = result.sort_values(["year", "region_id"]).reset_index(drop=True)
+
+    # float32 inputs keep about 7 significant digits
+    np.testing.assert_allclose(result["value"], expected["value"], rtol=1e-6)
+    for col in ["region_id", "confidence_level_id", "year", "var_detail_id"]:
+        np.testing.assert_array_equal(result[col], expected[col])
+    assert is_bad_proxy.tolist() == expected_is_bad_proxy.tolist()
+
+    dtypes.memory_savings.clear()
@@ -1,16 +1,4 @@
-import os
 from zoomin import disaggregation_manager as disagg_manager
-from dotenv import load_dotenv, find_dotenv
-
-# find .env automagically by walking up directories until it's found
-dotenv_path = find_dotenv()
-# load up the entries as environment variables
-load_dotenv(dotenv_path)
-
-db_country = os.environ.get("DB_COUNTRY")
-db_version = os.environ.get("DB_VERSION")
-
-db_name = f"{db_country.lower()}_v{db_version}"
 
 # {
 #  'business_investment',
@@ -0,0 +1,135 @@
+from zoomin import index_advisor
+from zoomin import db_access
+from zoomin import disaggregation_manager
+from zoomin import snakemake_utils
+from zoomin import copy_and_aggregate_collected_data
+
+
+class FakeCursor:
+    def __init__(self, existing_indexes):
+        self.existing_indexes = existing_indexes
+        self.statements = []
+
+    def execute(self, sql_cmd):
+        self.statements.append(sql_cmd)
+
+    def fetchall(self):
+        return [(name,) for name in self.existing_indexes]
+
+
+def test_get_missing_indexes():
+    cursor = FakeCursor(
+        ["idx_regions_region_code", "idx_var_details_var_name", "other_index"]
+    )
+
+    missing_indexes = index_advisor.get_missing_indexes.__wrapped__(cursor)
+
+    missing_names = [name for name, _, _ in missing_indexes]
+    assert "idx_regions_region_code" not in missing_names
+    assert "idx_var_details_var_name" not in missing_names
+    assert len(missing_indexes) == len(index_advisor.RECOMMENDED_INDEXES) - 2
+    # in the order of the recommendations
+    assert missing_indexes == [
+        index
+        for index in index_advisor.RECOMMENDED_INDEXES
+        if index[0] in missing_names
+    ]
+
+
+def test_create_indexes():
+    cursor = FakeCursor([])
+    indexes = [
+        ("idx_a", "regions", "region_code"),
+        ("idx_b", "processed_data", "var_detail_id"),
+        ("idx_c", "regions", "resolution"),
+    ]
+
+    index_advisor.create_indexes.__wrapped__(cursor, indexes)
+
+    assert cursor.statements == [
+        "CREATE INDEX IF NOT EXISTS idx_a ON regions (region_code);",
+        "CREATE INDEX IF NOT EXISTS idx_b ON processed_data (var_detail_id);",
+        "CREATE INDEX IF NOT EXISTS idx_c ON regions (resolution);",
+        "ANALYZE processed_data;",
+        "ANALYZE regions;",
+    ]
+
+
+def test_get_query_templates():
+    templates = index_advisor.get_query_templates(
+        "population", "cproj_annual_mean_temperature", ["sum", "avg"]
+    )
+
+    assert list(templates) == [
+        "get_proxy_data",
+        "get_regions",
+        "get_collected_var_data",
+        "get_climate_var_data",
+        "clear_rows_from_processed_data",
+        "aggregate_collected_data",
+        "aggregate_climate_data",
+    ]
+    # the templates are the queries of the pipeline
+    assert templates["get_proxy_data"] == db_access.get_proxy_data_sql(
+        "population", "LAU"
+    )
+    assert templates[
+        "get_climate_var_data"
+    ] == disaggregation_manager.get_climate_var_sql(
+        disaggregation_manager.get_climate_var_where_clause(
+            "cproj_annual_mean_temperature"
+        )
+    )
+    assert templates["clear_rows_from_processed_data"] == (
+        snakemake_utils.get_clear_rows_sql("population", "LAU")
+    )
+    assert templates[
+        "aggregate_collected_data"
+    ] == copy_and_aggregate_collected_data.get_aggregate_collected_data_sql(
+        ["sum", "avg"]
+    )
+    # all years of the climate var are read
+    assert "d.year IN" not in templates["get_climate_var_data"]
+
+
+def test_get_query_templates_without_agg_modes():
+    templates = index_advisor.get_query_templates(
+        "population", "cproj_annual_mean_temperature"
+    )
+
+    assert "aggregate_collected_data" not in templates
+
+
+class ExplainCursor(FakeCursor):
+    def __init__(self):
+        super().__init__([])
+
+    def fetchone(self):
+        return [
+            [
+                {
+                    "Planning Time": 1.0,
+                    "Execution Time": 2.0,
+                    "Plan": {"Node Type": "ModifyTable"},
+                }
+            ]
+        ]
+
+
+def test_explain_rolls_back():
+    cursor = ExplainCursor()
+
+    timing = index_advisor._explain(cursor, "DELETE FROM processed_data")
+
+    assert timing == {"planning_ms": 1.0, "execution_ms": 2.0, "node": "ModifyTable"}
+    assert cursor.statements == [
+        "SAVEPOINT index_advisor;",
+        "EXPLAIN (ANALYZE, FORMAT JSON) DELETE FROM processed_data",
+        "ROLLBACK TO SAVEPOINT index_advisor;",
+    ]
+
+
+def test_recommended_indexes_are_unique():
+    names = [name for name, _, _ in index_advisor.RECOMMENDED_INDEXES]
+
+    assert len(names) == len(set(names))
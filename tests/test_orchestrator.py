@@ -0,0 +1,61 @@
+import threading
+from zoomin import orchestrator
+
+
+def test_run_deployment():
+    calls = []
+    lock = threading.Lock()
+
+    def run_stage(country, stage):
+        if (country, stage) == ("es", "nuts2_disagg"):
+            raise RuntimeError("snakemake failed")
+        with lock:
+            calls.append((country, stage))
+
+    def is_done(country, stage):
+        # de finished copy_and_agg and nuts2_disagg in an earlier run
+        return country == "de" and stage in ["copy_and_agg", "nuts2_disagg"]
+
+    timings = orchestrator.run_deployment(
+        ["de", "es"],
+        ["copy_and_agg", "nuts1_disagg", "nuts2_disagg", "nuts3_disagg"],
+        n_workers=2,
+        run_stage=run_stage,
+        is_done=is_done,
+    )
+
+    # the stages of a country run in order
+    assert [stage for country, stage in calls if country == "de"] == [
+        "nuts1_disagg",
+        "nuts2_disagg",
+        "nuts3_disagg",
+    ]
+    assert [stage for country, stage in calls if country == "es"] == [
+        "copy_and_agg",
+        "nuts1_disagg",
+    ]
+
+    assert timings["de"]["copy_and_agg"]["status"] == "skipped"
+    # nuts2_disagg has to run again, because nuts1_disagg ran
+    assert timings["de"]["nuts2_disagg"]["status"] == "done"
+    assert timings["es"]["nuts2_disagg"]["status"] == "failed"
+    assert timings["es"]["nuts3_disagg"]["status"] == "not run"
+
+    assert "nuts3_disagg" in orchestrator.format_timings(timings)
+
+
+def test_run_snakemake_stage_bounds_the_pool(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setenv("DB_VERSION", "1")
+    monkeypatch.setattr(
+        orchestrator.subprocess, "run", lambda args, **kwargs: calls.append(kwargs)
+    )
+
+    orchestrator.run_snakemake_stage(
+        "it", "nuts3_disagg", cores=2, connections=4, snakemake_dir=str(tmp_path)
+    )
+
+    env = calls[0]["env"]
+    assert env["DB_COUNTRY"] == "it"
+    assert env["DB_POOL_SIZE"] == "4"
+    assert env["DB_MAX_OVERFLOW"] == "0"
@@ -0,0 +1,35 @@
+import pandas as pd
+from zoomin.proxy_cache import ProxyCache
+
+
+def test_proxy_cache():
+    cache = ProxyCache(maxsize=2)
+    proxy_data = pd.DataFrame({"region_id": [1, 2], "value": [0.5, 1.0]})
+
+    assert cache.get("population", "LAU") is None
+
+    cache.put("population", "LAU", proxy_data, var_detail_id=1)
+    cache.put("employment", "LAU", proxy_data, var_detail_id=2)
+
+    # returned data is a copy
+    cached_data = cache.get("population", "LAU")
+    cached_data["value"] = 0
+    assert cache.get("population", "LAU")["value"].tolist() == [0.5, 1.0]
+
+    # least recently used entry is evicted
+    cache.put("road_network", "LAU", proxy_data, var_detail_id=3)
+    assert cache.get("employment", "LAU") is None
+
+    # invalidation by var_detail_id and by var name
+    cache.invalidate(var_detail_ids=[1])
+    assert cache.get("population", "LAU") is None
+    cache.invalidate(var_names=["road_network"])
+    assert cache.get("road_network", "LAU") is None
+
+    assert cache.stats() == {
+        "hits": 2,
+        "misses": 4,
+        "evictions": 1,
+        "size": 0,
+        "maxsize": 2,
+    }
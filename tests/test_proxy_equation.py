@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+from zoomin.proxy_equation import ProxyEquationError, get_var_names, solve_equations
+
+var_data = {
+    "population": pd.DataFrame(
+        {
+            "region_id": [1, 2, 3],
+            "region_code": ["ITC11", "ITC12", "ITC13"],
+            "value": [1.0, 0.5, 0.0],
+            "year": [2020, 2020, 2020],
+            "confidence_level_id": [5, 5, 5],
+        }
+    ),
+    "road_network": pd.DataFrame(
+        {
+            "region_id": [2, 3],
+            "region_code": ["ITC12", "ITC13"],
+            "value": [1.0, 0.0],
+            "year": [2018, 2018],
+            "confidence_level_id": [3, 3],
+        }
+    ),
+}
+
+
+def test_get_var_names():
+    assert get_var_names("population * 0.5 + road_network / population") == [
+        "population",
+        "road_network",
+    ]
+
+
+def test_solve_equations():
+    results = solve_equations(
+        ["population", "population * 2 + population / road_network"],
+        lambda var_name: var_data[var_name],
+    )
+
+    np.testing.assert_allclose(results["population"]["value"], [1.0, 0.5, 0.0])
+
+    # only regions with data for all variables, 0/0 set to 0
+    result = results["population * 2 + population / road_network"]
+    assert result["region_id"].tolist() == [2, 3]
+    np.testing.assert_allclose(result["value"], [1.5, 0.0])
+    assert result["year"].tolist() == [2018, 2018]
+    assert result["confidence_level_id"].tolist() == [3, 3]
+
+
+def test_solve_equation_with_power():
+    results = solve_equations(
+        ["population ** 2 + road_network ** -1 * 2 ** -1"],
+        lambda var_name: var_data[var_name],
+    )
+
+    # 1/0 set to 0
+    np.testing.assert_allclose(
+        results["population ** 2 + road_network ** -1 * 2 ** -1"]["value"],
+        [0.75, 0.0],
+    )
+
+
+@pytest.mark.parametrize(
+    "equation",
+    [
+        ("population // 2"),
+        ("population +"),
+        ("log(population)"),
+        ("unknown_var * 2"),
+    ],
+)
+def test_invalid_equations(equation):
+    with pytest.raises(ProxyEquationError):
+        solve_equations(
+            [equation], lambda var_name: var_data.get(var_name, pd.DataFrame())
+        )
@@ -0,0 +1,58 @@
+import pandas as pd
+from zoomin import proxy_snapshot
+
+
+def test_proxy_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROXY_SNAPSHOT_DIR", str(tmp_path))
+
+    proxy_data = pd.DataFrame(
+        {
+            "region_id": [1, 2],
+            "region_code": ["ITC11", "ITC12"],
+            "var_detail_id": [5, 5],
+            "value": [10.0, 20.0],
+            "year": [2020, 2020],
+            "confidence_level_id": [3, 3],
+        }
+    )
+
+    assert proxy_snapshot.read_snapshot("population", "NUTS3") is None
+
+    assert proxy_snapshot.write_snapshot("population", "NUTS3", proxy_data)
+    # identical content is not rewritten
+    assert not proxy_snapshot.write_snapshot("population", "NUTS3", proxy_data)
+
+    pd.testing.assert_frame_equal(
+        proxy_snapshot.read_snapshot("population", "NUTS3"), proxy_data
+    )
+
+    proxy_snapshot.invalidate_snapshots(var_detail_ids=[5])
+    assert proxy_snapshot.read_snapshot("population", "NUTS3") is None
+
+
+def test_proxy_snapshot_of_var_name_suffix(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROXY_SNAPSHOT_DIR", str(tmp_path))
+
+    def get_proxy_data(var_detail_id, value):
+        return pd.DataFrame(
+            {
+                "region_id": [1],
+                "region_code": ["ITC11"],
+                "var_detail_id": [var_detail_id],
+                "value": [value],
+                "year": [2020],
+                "confidence_level_id": [3],
+            }
+        )
+
+    # the file of "x__a" ends in "__a.parquet" like the one of "a"
+    assert proxy_snapshot.write_snapshot("x__a", "NUTS3", get_proxy_data(1, 10.0))
+    assert proxy_snapshot.read_snapshot("a", "NUTS3") is None
+
+    assert proxy_snapshot.write_snapshot("a", "NUTS3", get_proxy_data(2, 20.0))
+    assert proxy_snapshot.read_snapshot("a", "NUTS3")["value"].tolist() == [20.0]
+    assert proxy_snapshot.read_snapshot("x__a", "NUTS3")["value"].tolist() == [10.0]
+
+    proxy_snapshot.invalidate_snapshots(var_names=["a"])
+    assert proxy_snapshot.read_snapshot("a", "NUTS3") is None
+    assert proxy_snapshot.read_snapshot("x__a", "NUTS3") is not None
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+from zoomin import region_catalogue
+from zoomin.region_catalogue import RegionCatalogue
+from zoomin.region_hierarchy import RegionHierarchy
+
+REGIONS = pd.DataFrame(
+    {
+        "id": [1, 2, 3, 4, 5, 6],
+        "region_code": ["IT", "ITC", "ITC1", "ITC11", "ITC11_001272", "ITC11_001003"],
+        "resolution": ["NUTS0", "NUTS1", "NUTS2", "NUTS3", "LAU", "LAU"],
+    }
+)
+
+HIERARCHY = RegionHierarchy(
+    pd.DataFrame(
+        {
+            "region_id": [1, 2, 3, 4, 5, 6],
+            "nuts0_id": [1, 1, 1, 1, 1, 1],
+            "nuts1_id": [None, 2, 2, 2, 2, 2],
+            "nuts2_id": [None, None, 3, 3, 3, 3],
+            "nuts3_id": [None, None, None, 4, 4, 4],
+        }
+    )
+)
+
+
+def test_region_catalogue():
+    catalogue = RegionCatalogue(REGIONS)
+
+    lau_regions = catalogue.get_regions("LAU")
+    assert lau_regions["id"].tolist() == [5, 6]
+    assert lau_regions["region_code"].dtype == "category"
+    assert lau_regions.columns.tolist() == ["id", "region_code"]
+
+    # columns added by the caller do not change the catalogue
+    lau_regions["match_region_id"] = 4
+    assert "match_region_id" not in catalogue.get_regions("LAU").columns
+
+
+def test_region_catalogue_file(tmp_path, monkeypatch):
+    file_path = tmp_path / "regions.parquet"
+    monkeypatch.setenv("REGION_CATALOGUE_FILE", str(file_path))
+    monkeypatch.setattr(
+        region_catalogue.db_access, "get_table", lambda sql_cmd: REGIONS
+    )
+    region_catalogue.region_catalogue.clear()
+
+    assert region_catalogue.get_regions("NUTS3")["id"].tolist() == [4]
+    assert file_path.is_file()
+
+    # later processes read the file instead of the DB
+    region_catalogue.region_catalogue.clear()
+    monkeypatch.setattr(region_catalogue.db_access, "get_table", None)
+    assert region_catalogue.get_regions("LAU")["id"].tolist() == [5, 6]
+
+    region_catalogue.region_catalogue.clear()
+
+
+def test_child_index(monkeypatch):
+    monkeypatch.setattr(
+        region_catalogue.region_hierarchy, "get_parent_ids", HIERARCHY.get_parent_ids
+    )
+    child_index = RegionCatalogue(REGIONS).get_child_index("NUTS3", "LAU")
+
+    row_positions, child_ids = child_index.broadcast([4, 99, 4])
+
+    # unknown parents have no children
+    assert row_positions.tolist() == [0, 0, 2, 2]
+    assert child_ids.tolist() == [5, 6, 5, 6]
+    assert child_index.get_child_counts([4, 99]).tolist() == [2, 0]
+
+    # NUTS3 regions have no NUTS3 parents
+    child_index = RegionCatalogue(REGIONS).get_child_index("NUTS3", "NUTS2")
+    assert child_index.broadcast([4])[1].tolist() == []
+
+    # the parents of the NUTS2 regions are looked up in the hierarchy
+    child_index = RegionCatalogue(REGIONS).get_child_index("NUTS0", "NUTS2")
+    assert child_index.broadcast([1])[1].tolist() == [3]
+
+    with pytest.raises(ValueError, match="no parent resolution"):
+        RegionCatalogue(REGIONS).get_child_index("LAU", "NUTS3")
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+from zoomin.region_hierarchy import RegionHierarchy
+
+
+def test_get_parent_ids():
+    # IT (1) > ITC (2) > ITC1 (3) > ITC11 (4) > LAU 001272 (5)
+    hierarchy = RegionHierarchy(
+        pd.DataFrame(
+            {
+                "region_id": [5, 1, 2, 3, 4],
+                "nuts0_id": [1, 1, 1, 1, 1],
+                "nuts1_id": [2, None, 2, 2, 2],
+                "nuts2_id": [3, None, None, 3, 3],
+                "nuts3_id": [4, None, None, None, 4],
+            }
+        )
+    )
+
+    assert hierarchy.get_parent_ids([5, 4, 3], "NUTS2").tolist() == [3, 3, 3]
+    assert hierarchy.get_parent_ids([5, 1], "NUTS0").tolist() == [1, 1]
+
+    # no parent at a finer resolution and unknown regions
+    assert hierarchy.get_parent_ids([2, 99], "NUTS3").tolist() == [-1, -1]
+
+
+def test_get_parent_ids_of_empty_hierarchy():
+    hierarchy = RegionHierarchy(
+        pd.DataFrame(
+            columns=["region_id", "nuts0_id", "nuts1_id", "nuts2_id", "nuts3_id"]
+        )
+    )
+
+    parent_ids = hierarchy.get_parent_ids([], "NUTS0")
+    assert parent_ids.tolist() == []
+    assert parent_ids.dtype == "int64"
+
+    with pytest.raises(ValueError, match="region hierarchy is empty"):
+        hierarchy.get_parent_ids([1], "NUTS0")
@@ -0,0 +1,152 @@
+import pytest
+from zoomin import schema_management
+
+
+class FakeCursor:
+    """Record the statements and answer the catalog queries of schema_management."""
+
+    def __init__(self, partitioned=False, partitions=(), identity="", indexes=()):
+        self.partitioned = partitioned
+        self.partitions = list(partitions)
+        self.identity = identity
+        self.indexes = list(indexes)
+        self.statements = []
+        self._result = None
+
+    def execute(self, sql_cmd, params=None):
+        sql_cmd = " ".join(sql_cmd.split())
+        self.statements.append(sql_cmd)
+
+        if "pg_partitioned_table" in sql_cmd:
+            self._result = [(self.partitioned,)]
+        elif "pg_inherits" in sql_cmd:
+            self._result = self.partitions
+        elif "to_regclass(%s) IS NOT NULL" in sql_cmd:
+            self._result = [(False,)]
+        elif "attidentity" in sql_cmd:
+            self._result = [(self.identity,)]
+        elif "i.indisprimary;" in sql_cmd:
+            self._result = [(["id"],)]
+        elif "contype = 'f'" in sql_cmd:
+            self._result = [
+                ("fk_region", "FOREIGN KEY (region_id) REFERENCES regions(id)")
+            ]
+        elif "NOT i.indisprimary" in sql_cmd:
+            self._result = self.indexes
+        elif "pg_get_serial_sequence(%s" in sql_cmd:
+            self._result = [("public.processed_data_id_seq",)]
+        else:
+            self._result = None
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+
+def _partitions(modulus, n_partitions):
+    return [
+        (
+            f"processed_data_p{remainder:03d}",
+            f"FOR VALUES WITH (modulus {modulus}, remainder {remainder})",
+            0,
+        )
+        for remainder in range(n_partitions)
+    ]
+
+
+def test_ensure_partitions_creates_missing_partitions():
+    cursor = FakeCursor(partitioned=True, partitions=_partitions(4, 2))
+
+    created = schema_management.ensure_partitions.__wrapped__(cursor, 4)
+
+    assert created == ["processed_data_p002", "processed_data_p003"]
+    assert cursor.statements[-1] == (
+        "CREATE TABLE processed_data_p003 PARTITION OF processed_data "
+        "FOR VALUES WITH (MODULUS 4, REMAINDER 3);"
+    )
+
+
+def test_ensure_partitions_with_other_modulus():
+    cursor = FakeCursor(partitioned=True, partitions=_partitions(32, 2))
+
+    with pytest.raises(ValueError, match="modulus {'32'}, not 16"):
+        schema_management.ensure_partitions.__wrapped__(cursor, 16)
+
+
+def test_ensure_partitions_of_unpartitioned_table():
+    cursor = FakeCursor(partitioned=False)
+
+    with pytest.raises(ValueError, match="not partitioned"):
+        schema_management.ensure_partitions.__wrapped__(cursor, 4)
+
+
+def test_migrate_to_partitioned():
+    cursor = FakeCursor(
+        indexes=[
+            (
+                "idx_processed_data_year",
+                "CREATE INDEX idx_processed_data_year ON public.processed_data_legacy USING btree (year)",
+            )
+        ]
+    )
+
+    schema_management.migrate_to_partitioned.__wrapped__(cursor, 2)
+
+    ddl = [
+        statement
+        for statement in cursor.statements
+        if not statement.startswith("SELECT")
+    ]
+    assert ddl == [
+        "ALTER TABLE processed_data RENAME TO processed_data_legacy;",
+        "CREATE TABLE processed_data (LIKE processed_data_legacy INCLUDING DEFAULTS "
+        "INCLUDING CONSTRAINTS INCLUDING IDENTITY) PARTITION BY HASH (var_detail_id);",
+        "ALTER TABLE processed_data ADD PRIMARY KEY (id, var_detail_id);",
+        "ALTER TABLE processed_data_legacy DROP CONSTRAINT fk_region;",
+        "ALTER TABLE processed_data ADD CONSTRAINT fk_region "
+        "FOREIGN KEY (region_id) REFERENCES regions(id);",
+        "CREATE TABLE processed_data_p000 PARTITION OF processed_data "
+        "FOR VALUES WITH (MODULUS 2, REMAINDER 0);",
+        "CREATE TABLE processed_data_p001 PARTITION OF processed_data "
+        "FOR VALUES WITH (MODULUS 2, REMAINDER 1);",
+        "INSERT INTO processed_data SELECT * FROM processed_data_legacy;",
+        "ALTER INDEX idx_processed_data_year RENAME TO idx_processed_data_year_legacy;",
+        "CREATE INDEX idx_processed_data_year ON processed_data USING btree (year)",
+        "ALTER SEQUENCE public.processed_data_id_seq OWNED BY processed_data.id;",
+        "ANALYZE processed_data;",
+    ]
+
+
+def test_migrate_to_partitioned_with_identity():
+    cursor = FakeCursor(identity="a")
+
+    schema_management.migrate_to_partitioned.__wrapped__(cursor, 1)
+
+    assert (
+        "INSERT INTO processed_data OVERRIDING SYSTEM VALUE "
+        "SELECT * FROM processed_data_legacy;"
+    ) in cursor.statements
+    # the identity sequence of the new table continues after the migrated ids
+    assert (
+        "SELECT setval(pg_get_serial_sequence('processed_data', 'id'), max(id)) "
+        "FROM processed_data HAVING max(id) IS NOT NULL;"
+    ) in cursor.statements
+    assert not any(
+        statement.startswith("ALTER SEQUENCE") for statement in cursor.statements
+    )
+
+
+@pytest.mark.parametrize(
+    "definition",
+    [
+        "CREATE INDEX idx ON public.processed_data_legacy USING btree (year)",
+        "CREATE UNIQUE INDEX idx ON ONLY processed_data_legacy USING btree (id, year)",
+    ],
+)
+def test_move_index_definition(definition):
+    moved = schema_management._move_index_definition(definition, "processed_data")
+
+    assert " ON processed_data USING btree (" in moved
+    assert "legacy" not in moved
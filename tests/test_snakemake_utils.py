@@ -0,0 +1,72 @@
+import json
+from zoomin import snakemake_utils as sm_utls
+from zoomin.dtypes import get_savings_stats
+
+
+def test_merge_bad_proxies(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    sm_utls.write_bad_proxy("it_v1", "LAU", "population", "bad_proxy")
+    sm_utls.write_bad_proxy("it_v1", "LAU", "road_network", None)
+    sm_utls.write_bad_proxy("it_v1", "NUTS3", "deaths", "bad_proxy")
+
+    bad_proxy_dict = sm_utls.merge_bad_proxies("it_v1", "LAU", "bad_proxy_it_v1.json")
+
+    assert bad_proxy_dict == {"population": "bad_proxy"}
+    with open("bad_proxy_it_v1.json") as fp:
+        assert json.load(fp) == bad_proxy_dict
+
+
+def test_merge_job_stats(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        sm_utls,
+        "get_job_counters",
+        iter(
+            [
+                {"proxy_cache": {"hits": 1, "misses": 2, "evictions": 0}},
+                {
+                    "proxy_cache": {"hits": 4, "misses": 3, "evictions": 0},
+                    "memory_savings": {
+                        "var_data": {"bytes_before": 400, "bytes_after": 100}
+                    },
+                },
+                {"proxy_cache": {"hits": 4, "misses": 3, "evictions": 0}},
+                {
+                    "proxy_cache": {"hits": 6, "misses": 3, "evictions": 1},
+                    "memory_savings": {
+                        "var_data": {"bytes_before": 600, "bytes_after": 400}
+                    },
+                },
+            ]
+        ).__next__,
+    )
+
+    # only the counts collected while the job runs are written
+    with sm_utls.recorded_job_stats("it_v1", "LAU", "population"):
+        pass
+    with sm_utls.recorded_job_stats("it_v1", "LAU", "deaths"):
+        pass
+
+    job_stats = sm_utls.merge_job_stats("it_v1", "LAU")
+    assert job_stats == {
+        "proxy_cache": {"hits": 5, "misses": 1, "evictions": 1},
+        "memory_savings": {"var_data": {"bytes_before": 1000, "bytes_after": 500}},
+    }
+    # the saved share is computed from the summed bytes
+    assert get_savings_stats(job_stats["memory_savings"])["var_data"]["saved"] == 0.5
+    assert sm_utls.merge_job_stats("it_v1", "NUTS3") == {}
+
+
+def test_get_job_counters():
+    counters = sm_utls.get_job_counters()
+
+    # only counters, which add up over jobs
+    assert set(counters["db_pool"]) == {
+        "checkouts",
+        "waits",
+        "wait_time",
+        "connects",
+    }
+    assert set(counters["proxy_cache"]) == {"hits", "misses", "evictions"}
+    assert isinstance(counters["memory_savings"], dict)
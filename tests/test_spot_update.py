@@ -0,0 +1,22 @@
+from zoomin import spot_update
+
+
+def test_disaggregate_vars_targets_each_spatial_level(monkeypatch):
+    calls = []
+
+    def mock_disaggregate_batch(var_names, source_resolution, target_resolution):
+        calls.append((var_names, source_resolution, target_resolution))
+        return {var_name: False for var_name in var_names}
+
+    monkeypatch.setattr(
+        spot_update.disagg_manager, "disaggregate_batch", mock_disaggregate_batch
+    )
+
+    bad_proxy_dict = spot_update.disaggregate_vars()
+
+    assert calls == [
+        (spot_update.var_names, "NUTS0", "NUTS2"),
+        (spot_update.var_names, "NUTS0", "NUTS3"),
+        (spot_update.var_names, "NUTS0", "LAU"),
+    ]
+    assert list(bad_proxy_dict) == ["NUTS2", "NUTS3", "LAU"]
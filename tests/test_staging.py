@@ -0,0 +1,169 @@
+import threading
+from contextlib import contextmanager
+from uuid import uuid4
+import pandas as pd
+import pytest
+from zoomin import staging
+from zoomin import snakemake_utils as sm_utls
+
+
+def test_staged_write_in_direct_mode(monkeypatch):
+    monkeypatch.setenv("ZOOMIN_WRITE_MODE", "direct")
+
+    with staging.staged_write("population"):
+        assert staging.get_target_table() == "processed_data"
+
+
+def test_staging_table_name():
+    name = staging._get_staging_table_name("cproj_annual_mean_temperature-2025")
+
+    assert name.startswith("staging_cproj_annual_mean_temperature_2025_")
+    assert len(name) <= 63
+
+
+def mock_db(monkeypatch):
+    """Record the statements of the staging mode instead of running them."""
+    statements = []
+
+    class FakeCursor:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def execute(self, sql_cmd):
+            statements.append(" ".join(sql_cmd.split()))
+
+    class FakeConnection:
+        def cursor(self):
+            return FakeCursor()
+
+    @contextmanager
+    def db_connection():
+        yield FakeConnection()
+
+    monkeypatch.setenv("ZOOMIN_WRITE_MODE", "staging")
+    monkeypatch.setattr(
+        staging.db_access,
+        "execute_sql_cmd",
+        lambda sql_cmd: statements.append(" ".join(sql_cmd.split())),
+    )
+    monkeypatch.setattr(staging.db_access, "db_connection", db_connection)
+    monkeypatch.setattr(
+        staging.db_access,
+        "get_column_types",
+        lambda table: {"id": "int4", "region_id": "int4", "value": "float8"},
+    )
+
+    return statements
+
+
+def test_staged_write_merges_on_success(monkeypatch):
+    statements = mock_db(monkeypatch)
+    invalidated = []
+    monkeypatch.setattr(
+        staging.proxy_cache,
+        "invalidate",
+        lambda var_detail_ids: invalidated.append(set(var_detail_ids)),
+    )
+
+    with staging.staged_write("population"):
+        staging_table = staging.get_target_table()
+        staging.register_written_var_detail_ids([7, 8])
+
+        # other threads keep writing to processed_data
+        other_tables = []
+        thread = threading.Thread(
+            target=lambda: other_tables.append(staging.get_target_table())
+        )
+        thread.start()
+        thread.join()
+
+        # nested blocks write to the same staging table
+        with staging.staged_write("population"):
+            assert staging.get_target_table() == staging_table
+
+    assert staging_table.startswith("staging_population_")
+    assert other_tables == ["processed_data"]
+    assert statements == [
+        f"CREATE UNLOGGED TABLE {staging_table} (LIKE processed_data INCLUDING DEFAULTS); "
+        f"ALTER TABLE {staging_table} DROP COLUMN IF EXISTS id;",
+        # the ids are generated by processed_data
+        f"INSERT INTO processed_data (region_id, value) "
+        f"SELECT region_id, value FROM {staging_table}; DROP TABLE {staging_table};",
+    ]
+    assert invalidated == [{7, 8}]
+    assert staging.get_target_table() == "processed_data"
+
+
+def test_staged_write_drops_staging_table_on_failure(monkeypatch):
+    statements = mock_db(monkeypatch)
+
+    with pytest.raises(RuntimeError):
+        with staging.staged_write("population"):
+            staging_table = staging.get_target_table()
+            raise RuntimeError("disaggregation failed")
+
+    # nothing is merged into or deleted from processed_data
+    assert statements == [
+        f"CREATE UNLOGGED TABLE {staging_table} (LIKE processed_data INCLUDING DEFAULTS); "
+        f"ALTER TABLE {staging_table} DROP COLUMN IF EXISTS id;",
+        f"DROP TABLE IF EXISTS {staging_table};",
+    ]
+    assert staging.get_target_table() == "processed_data"
+
+
+@pytest.mark.parametrize("write_mode, n_cleared", [("staging", 0), ("direct", 1)])
+def test_clear_failed_job(monkeypatch, write_mode, n_cleared):
+    monkeypatch.setenv("ZOOMIN_WRITE_MODE", write_mode)
+    cleared = []
+    monkeypatch.setattr(
+        sm_utls,
+        "clear_rows_from_processed_data",
+        lambda job_name, target_resolution: cleared.append(
+            (job_name, target_resolution)
+        ),
+    )
+
+    sm_utls.clear_failed_job("population", target_resolution="LAU")
+
+    # in staging mode, the failed job left no rows in processed_data
+    assert cleared == [("population", "LAU")] * n_cleared
+
+
+def test_staged_write_with_identity_id(monkeypatch):
+    try:
+        staging.db_access.get_values("SELECT 1;")
+    except Exception:
+        pytest.skip("database not available")
+
+    # processed_data migrated with an identity id, see schema_management
+    table = f"tmp_staging_test_{uuid4().hex[:8]}"
+    staging.db_access.execute_sql_cmd(
+        f"""CREATE TABLE {table} (
+            id integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+            region_id integer NOT NULL,
+            var_detail_id integer NOT NULL,
+            value double precision
+        );"""
+    )
+    monkeypatch.setenv("ZOOMIN_WRITE_MODE", "staging")
+    monkeypatch.setattr(staging, "TARGET_TABLE", table)
+
+    try:
+        with staging.staged_write("population"):
+            staging.db_access.write_table(
+                pd.DataFrame(
+                    {"region_id": [1, 2], "var_detail_id": [7, 7], "value": [1.0, 2.0]}
+                ),
+                staging.get_target_table(),
+            )
+
+        assert staging.db_access.get_values(f"SELECT id FROM {table} ORDER BY id") == [
+            1,
+            2,
+        ]
+
+    finally:
+        staging.db_access.execute_sql_cmd(f"DROP TABLE {table};")
@@ -0,0 +1,171 @@
+"""Serialization of dataframes into the PostgreSQL binary COPY format.
+
+Each column is converted to big-endian NumPy buffers and scattered into one output
+buffer per chunk, so no Python object is created per row or per value. See
+https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4 for the format.
+"""
+from typing import Iterator
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + b"\x00\x00\x00\x00" + b"\x00\x00\x00\x00"
+COPY_TRAILER = b"\xff\xff"
+
+# Postgres type name (udt_name) -> big-endian NumPy type of its binary representation
+FIXED_WIDTH_TYPES = {
+    "int2": np.dtype(">i2"),
+    "int4": np.dtype(">i4"),
+    "int8": np.dtype(">i8"),
+    "float4": np.dtype(">f4"),
+    "float8": np.dtype(">f8"),
+    "bool": np.dtype("?"),
+}
+TEXT_TYPES = {"text", "varchar", "bpchar"}
+
+
+def is_supported(column_types: dict) -> bool:
+    """Return True if all the Postgres types in `column_types` can be encoded."""
+    return all(
+        type_name in FIXED_WIDTH_TYPES or type_name in TEXT_TYPES
+        for type_name in column_types.values()
+    )
+
+
+def _encode_column(column: pd.Series, type_name: str) -> tuple:
+    """Return the field lengths (-1 for NULL) and the concatenated bytes of the non-NULL values."""
+    is_null = column.isna().to_numpy()
+
+    if type_name in TEXT_TYPES:
+        # NOTE: pyarrow encodes all strings to utf-8 in one contiguous buffer
+        values = pa.array(column.astype(object).where(~is_null, None), type=pa.string())
+        _, offsets, data = values.buffers()
+        offsets = np.frombuffer(offsets, dtype=np.int32, count=len(values) + 1)
+        payload = (
+            np.frombuffer(data, dtype=np.uint8, count=offsets[-1])
+            if data is not None
+            else np.empty(0, dtype=np.uint8)
+        )
+        lengths = np.diff(offsets).astype(np.int64)
+
+    else:
+        dtype = FIXED_WIDTH_TYPES[type_name]
+        non_null = column[~is_null] if is_null.any() else column
+        if dtype.kind in "iu" and non_null.dtype.kind == "f":
+            non_null = np.trunc(non_null)
+        payload = non_null.to_numpy().astype(dtype).view(np.uint8)
+        lengths = np.full(len(column), dtype.itemsize, dtype=np.int64)
+
+    lengths[is_null] = -1
+
+    return lengths, payload
+
+
+def _scatter(
+    buffer: np.ndarray, starts: np.ndarray, lengths: np.ndarray, payload: np.ndarray
+) -> None:
+    """Copy the consecutive pieces of `payload` with `lengths` to `starts` in `buffer`."""
+    if payload.size == 0:
+        return
+
+    widths = np.unique(lengths[lengths > 0])
+    if len(widths) == 1:
+        # fixed width: one 2D fancy assignment
+        width = widths[0]
+        starts = starts[lengths > 0]
+        buffer[starts[:, None] + np.arange(width)] = payload.reshape(-1, width)
+    else:
+        lengths = np.maximum(lengths, 0)
+        source_starts = np.cumsum(lengths) - lengths
+        buffer[
+            np.repeat(starts - source_starts, lengths) + np.arange(payload.size)
+        ] = payload
+
+
+def encode_rows(
+    data: pd.DataFrame, column_types: dict, header: bytes = b"", trailer: bytes = b""
+) -> bytes:
+    """Return the rows of `data` as binary COPY tuples, enclosed by `header` and `trailer`.
+
+    :param data: Data to encode. Must contain all columns in `column_types`
+    :type data: pd.DataFrame
+
+    :param column_types: Postgres type name (udt_name) per column, in the order of the COPY column list
+    :type column_types: dict
+
+    :param header: Bytes to put in front of the rows
+    :type header: bytes
+
+    :param trailer: Bytes to put after the rows
+    :type trailer: bytes
+
+    :returns: Encoded rows
+    :rtype: bytes
+    """
+    n_rows = len(data)
+    n_columns = len(column_types)
+
+    fields = [
+        _encode_column(data[column], type_name)
+        for column, type_name in column_types.items()
+    ]
+
+    # field count (int16) + per field: length (int32) + value
+    row_sizes = np.full(n_rows, 2 + 4 * n_columns, dtype=np.int64)
+    for lengths, _ in fields:
+        row_sizes += np.maximum(lengths, 0)
+
+    row_starts = np.cumsum(row_sizes) - row_sizes + len(header)
+    buffer = np.empty(len(header) + int(row_sizes.sum()) + len(trailer), dtype=np.uint8)
+    buffer[: len(header)] = np.frombuffer(header, dtype=np.uint8)
+    buffer[len(buffer) - len(trailer) :] = np.frombuffer(trailer, dtype=np.uint8)
+
+    has_fixed_layout = n_rows > 0 and all(
+        lengths[0] >= 0 and (lengths == lengths[0]).all() for lengths, _ in fields
+    )
+    if has_fixed_layout:
+        # no NULLs and no strings of varying length: all rows share one layout
+        layout = [("n_fields", ">i2")]
+        for i, (lengths, payload) in enumerate(fields):
+            layout += [(f"length_{i}", ">i4"), (f"value_{i}", "u1", (int(lengths[0]),))]
+        rows = buffer[len(header) : len(buffer) - len(trailer)].view(np.dtype(layout))
+
+        rows["n_fields"] = n_columns
+        for i, (lengths, payload) in enumerate(fields):
+            rows[f"length_{i}"] = lengths[0]
+            if lengths[0] > 0:
+                rows[f"value_{i}"] = payload.reshape(n_rows, -1)
+
+        return buffer.tobytes()
+
+    positions = row_starts.copy()
+    _scatter(
+        buffer,
+        positions,
+        np.full(n_rows, 2),
+        np.full(n_rows, n_columns, dtype=">i2").view(np.uint8),
+    )
+    positions += 2
+
+    for lengths, payload in fields:
+        _scatter(
+            buffer,
+            positions,
+            np.full(n_rows, 4),
+            lengths.astype(">i4").view(np.uint8),
+        )
+        positions += 4
+
+        _scatter(buffer, positions, lengths, payload)
+        positions += np.maximum(lengths, 0)
+
+    return buffer.tobytes()
+
+
+def iter_binary_copy(
+    data: pd.DataFrame, column_types: dict, chunksize: int = 100000
+) -> Iterator[bytes]:
+    """Yield `data` as complete binary COPY streams of at most `chunksize` rows each."""
+    for start in range(0, max(len(data), 1), chunksize):
+        chunk = data.iloc[start : start + chunksize]
+        yield encode_rows(chunk, column_types, header=COPY_HEADER, trailer=COPY_TRAILER)
@@ -0,0 +1,146 @@
+"""One lazily created, fork-safe connection pool for all DB access in zoomin."""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+from sqlalchemy import create_engine, event
+
+
+class ConnectionManager:
+    """Own the single SQLAlchemy engine (and thereby the connection pool) of a process.
+
+    The engine is created on first use. If the process was forked (e.g. by Snakemake or
+    dask workers), the child drops the connections inherited from the parent and creates
+    its own pool. The pool is configured with the environment variables
+    ``DB_POOL_SIZE`` (default 5), ``DB_MAX_OVERFLOW`` (default 5) and ``DB_POOL_TIMEOUT``
+    (seconds, default 30).
+
+    :param get_db_uri: Function returning the uri of the database
+    :type get_db_uri: Callable
+    """
+
+    def __init__(self, get_db_uri: Callable[[], str]) -> None:
+        self._get_db_uri = get_db_uri
+        self._engine: Any = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.connects = 0
+
+    @property
+    def pool_size(self) -> int:
+        """Number of connections kept open in the pool."""
+        return int(os.environ.get("DB_POOL_SIZE", "5"))
+
+    @property
+    def max_overflow(self) -> int:
+        """Number of connections that may be opened in addition to the pool size."""
+        return int(os.environ.get("DB_MAX_OVERFLOW", "5"))
+
+    @property
+    def max_connections(self) -> int:
+        """Maximum number of connections that can be checked out at the same time."""
+        return self.pool_size + self.max_overflow
+
+    def _after_fork(self) -> None:
+        if self._engine is not None:
+            # NOTE: the connections belong to the parent process and must not be closed here
+            self._engine.dispose(close=False)
+            self._engine = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def get_engine(self) -> Any:
+        """Return the engine of the current process, creating it on first use."""
+        if self._pid != os.getpid():
+            self._after_fork()
+
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    engine = create_engine(
+                        self._get_db_uri(),
+                        pool_size=self.pool_size,
+                        max_overflow=self.max_overflow,
+                        pool_timeout=int(os.environ.get("DB_POOL_TIMEOUT", "30")),
+                        pool_pre_ping=True,
+                    )
+                    event.listen(engine, "connect", self._on_connect)
+                    self._engine = engine
+
+        return self._engine
+
+    def _on_connect(self, dbapi_connection: Any, connection_record: Any) -> None:
+        self.connects += 1
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Provide a pooled DBAPI connection and return it to the pool afterwards.
+        The transaction is committed on success and rolled back on error.
+        """
+        pool = self.get_engine().pool
+
+        # all connections are in use, the checkout has to wait for one to be returned
+        has_to_wait = pool.checkedin() == 0 and pool.overflow() >= self.max_overflow
+
+        before = time.perf_counter()
+        connection = self.get_engine().raw_connection()
+        wait_time = time.perf_counter() - before
+
+        with self._lock:
+            self.checkouts += 1
+            if has_to_wait:
+                self.waits += 1
+                self.wait_time += wait_time
+
+        try:
+            yield connection
+            connection.commit()
+
+        except BaseException:
+            # the connection might be broken, so it is closed (rolling back the
+            # transaction) instead of being reused
+            connection.invalidate()
+            raise
+
+        finally:
+            # Return the connection to the pool
+            connection.close()
+
+    def metrics(self) -> dict:
+        """Return the state of the pool and the counters of this process."""
+        if self._engine is None or self._pid != os.getpid():
+            checked_out, overflow, checked_in = 0, 0, 0
+        else:
+            pool = self._engine.pool
+            checked_out, overflow, checked_in = (
+                pool.checkedout(),
+                max(pool.overflow(), 0),
+                pool.checkedin(),
+            )
+
+        return {
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "checked_out": checked_out,
+            "checked_in": checked_in,
+            "overflow": overflow,
+            "checkouts": self.checkouts,
+            "waits": self.waits,
+            "wait_time": round(self.wait_time, 3),
+            "connects": self.connects,
+        }
+
+    def dispose(self) -> None:
+        """Close all pooled connections. The engine is created again on next use."""
+        with self._lock:
+            if self._engine is not None:
+                self._engine.dispose()
+                self._engine = None
@@ -1,5 +1,6 @@
 """Creates a copy of staged climate data in processed_data table and aggregates the data to higher spatial levels"""
 from zoomin.db_access import with_db_connection
+from zoomin import region_hierarchy
 
 
 @with_db_connection()
@@ -26,57 +27,97 @@ def copy_climate_data_into_processed_data(cursor):
     cursor.execute(sql_cmd)
 
 
-copy_climate_data_into_processed_data()
+# aggregation of the values of the NUTS3 regions in a parent region, based on
+# the per NUTS3 region sum, count and max of the values
+AGG_MODES = {
+    "climate_projection": (
+        "cproj",
+        "SUM(b.value_sum) / NULLIF(SUM(b.value_count), 0)",
+    ),  # AVG
+    "climate_impact": ("cimp", "MAX(b.value_max)"),  # MAX
+}
 
-# number of chars to consider based on a resolution
-char_dict = {"NUTS3": 5, "NUTS2": 4, "NUTS1": 3, "NUTS0": 2}
 
+def get_aggregate_climate_data_sql(data_type) -> str:
+    """Return the INSERT statement of `aggregate_climate_data` for `data_type`."""
+    var_start, agg_expression = AGG_MODES[data_type]
 
-def aggregate_climate_data(cursor, data_type, agg_spatial_level):
-
-    if data_type == "climate_projection":
-        var_start = "cproj"
-        agg_mode = "AVG"
-    else:
-        var_start = "cimp"
-        agg_mode = "MAX"
-
-    n_char_to_keep = char_dict[agg_spatial_level]
+    group_cols = "b.var_detail_id, b.proxy_detail_id, b.climate_experiment, b.year"
 
     sql_cmd = f"""
     INSERT INTO processed_data (region_id, var_detail_id, confidence_level_id, proxy_detail_id, climate_experiment, year, value)
-    SELECT 
-        r_agg.id,
-        scd.var_detail_id,
-        MIN(scd.confidence_level_id),
-        scd.proxy_detail_id,
-        scd.climate_experiment,
-        scd.year,
-        ROUND(CAST({agg_mode}(scd.value) AS numeric), 5)
-    FROM 
-        staged_climate_data AS scd
-    JOIN 
-        regions AS r_nuts3 ON scd.region_id = r_nuts3.id
-    JOIN 
-        regions AS r_agg ON LEFT(r_nuts3.region_code, {n_char_to_keep}) = r_agg.region_code
-    WHERE 
-        scd.var_detail_id IN (SELECT id FROM var_details WHERE var_name LIKE '{var_start}_%')
-    GROUP BY 
-        r_agg.id,
-        scd.var_detail_id,
-        scd.proxy_detail_id,
-        scd.climate_experiment,
-        scd.year;
+    SELECT region_id, var_detail_id, confidence_level_id, proxy_detail_id, climate_experiment, year, value
+    FROM (
+        SELECT 
+            CASE 
+                WHEN GROUPING(b.nuts2_id) = 0 THEN b.nuts2_id
+                WHEN GROUPING(b.nuts1_id) = 0 THEN b.nuts1_id
+                ELSE b.nuts0_id
+            END AS region_id,
+            b.var_detail_id,
+            MIN(b.confidence_level_id) AS confidence_level_id,
+            b.proxy_detail_id,
+            b.climate_experiment,
+            b.year,
+            ROUND(CAST({agg_expression} AS numeric), 5) AS value
+        FROM (
+            SELECT 
+                h.nuts0_id,
+                h.nuts1_id,
+                h.nuts2_id,
+                scd.var_detail_id,
+                scd.proxy_detail_id,
+                scd.climate_experiment,
+                scd.year,
+                MIN(scd.confidence_level_id) AS confidence_level_id,
+                SUM(scd.value) AS value_sum,
+                COUNT(scd.value) AS value_count,
+                MAX(scd.value) AS value_max
+            FROM 
+                staged_climate_data AS scd
+            JOIN 
+                region_hierarchy AS h ON scd.region_id = h.region_id
+            WHERE 
+                scd.var_detail_id IN (SELECT id FROM var_details WHERE var_name LIKE '{var_start}_%')
+            GROUP BY 
+                h.nuts3_id,
+                h.nuts2_id,
+                h.nuts1_id,
+                h.nuts0_id,
+                scd.var_detail_id,
+                scd.proxy_detail_id,
+                scd.climate_experiment,
+                scd.year
+        ) AS b
+        GROUP BY GROUPING SETS (
+            (b.nuts2_id, {group_cols}),
+            (b.nuts1_id, {group_cols}),
+            (b.nuts0_id, {group_cols})
+        )
+    ) AS agg
+    WHERE region_id IS NOT NULL;
     """
 
-    cursor.execute(sql_cmd)
+    return sql_cmd
+
+
+def aggregate_climate_data(cursor, data_type):
+    """Aggregate all climate vars of `data_type` to NUTS2, NUTS1 and NUTS0 in one statement.
+
+    The values are first reduced per NUTS3 region (sum, count and max). The parent levels are
+    computed from these partial aggregates with GROUPING SETS, so the staged rows are scanned once.
+    """
+    cursor.execute(get_aggregate_climate_data_sql(data_type))
 
 
 @with_db_connection()
 def aggregate_all_levels(cursor):
-    for data_type in ["climate_projection", "climate_impact"]:
-        for agg_spatial_level in ["NUTS0", "NUTS1", "NUTS2"]:
-            aggregate_climate_data(cursor, data_type, agg_spatial_level)
+    region_hierarchy.ensure_region_hierarchy()
+
+    for data_type in AGG_MODES:
+        aggregate_climate_data(cursor, data_type)
 
 
-aggregate_all_levels()
+if __name__ == "__main__":
+    copy_climate_data_into_processed_data()
+    aggregate_all_levels()
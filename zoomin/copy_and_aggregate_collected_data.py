@@ -1,6 +1,7 @@
 """Creates a copy of staged collected data in processed_data table and aggregates the data to higher spatial levels"""
 from zoomin.db_access import with_db_connection
 from zoomin import db_access
+from zoomin import region_hierarchy
 
 # NUTS0 -------------------
 # only copying, no aggregation to higher levels
@@ -28,78 +29,94 @@ def copy_collected_data_into_processed_data(cursor):
     cursor.execute(sql_cmd)
 
 
-copy_collected_data_into_processed_data()
-
 # ---------------------------------
-# number of chars to consider based on a resolution
-char_dict = {"NUTS3": 5, "NUTS2": 4, "NUTS1": 3, "NUTS0": 2}
-
-
-def aggregate_collected_var(cursor, var_detail_id, agg_mode, spatial_resolution):
-
-    if spatial_resolution == "NUTS2":
-        agg_spatial_levels = ["NUTS1", "NUTS0"]
-
-    elif spatial_resolution == "NUTS3":
-        agg_spatial_levels = ["NUTS2", "NUTS1", "NUTS0"]
-
-    elif spatial_resolution == "LAU":
-        agg_spatial_levels = ["NUTS3", "NUTS2", "NUTS1", "NUTS0"]
-
-    for agg_spatial_level in agg_spatial_levels:
-        n_char_to_keep = char_dict[agg_spatial_level]
-
-        # NOTE:for variables with mixed years, the oldest year is considered during aggregation
-        sql_cmd = f"""
-        INSERT INTO processed_data (region_id, var_detail_id, confidence_level_id, proxy_detail_id, year, value)
-        SELECT 
-            r_agg.id,
-            scd.var_detail_id,
-            MIN(scd.confidence_level_id),
-            scd.proxy_detail_id,
-            MIN(scd.year), 
-            ROUND(CAST({agg_mode}(scd.value) AS numeric), 5)
-        FROM 
-            staged_collected_data AS scd
-        JOIN 
-            regions AS r_org ON scd.region_id = r_org.id
-        JOIN 
-            regions AS r_agg ON LEFT(r_org.region_code, {n_char_to_keep}) = r_agg.region_code
-        WHERE 
-            scd.var_detail_id = {var_detail_id}
-        GROUP BY 
-            r_agg.id,
-            scd.var_detail_id,
-            scd.proxy_detail_id;
-        """
-
-        cursor.execute(sql_cmd)
+# original resolutions of the vars that are aggregated to all coarser levels
+AGG_SOURCE_RESOLUTIONS = ["NUTS2", "NUTS3", "LAU"]
+
+
+def get_aggregation_expression(agg_modes):
+    """Return a CASE expression that aggregates scd.value with the var_aggregation_method of each var."""
+    when_clauses = []
+    for agg_mode in agg_modes:
+        if not agg_mode.isidentifier():
+            raise ValueError(f"Invalid var_aggregation_method {agg_mode!r}")
+
+        when_clauses.append(
+            f"WHEN '{agg_mode}' THEN CAST({agg_mode}(scd.value) AS numeric)"
+        )
+
+    return f"CASE v.var_aggregation_method {' '.join(when_clauses)} END"
+
+
+def get_agg_modes():
+    """Return the distinct var_aggregation_method values of var_details."""
+    return db_access.get_table(
+        """SELECT DISTINCT var_aggregation_method FROM var_details
+        WHERE var_aggregation_method IS NOT NULL;"""
+    )["var_aggregation_method"]
+
+
+def get_aggregate_collected_data_sql(agg_modes) -> str:
+    """Return the INSERT statement of `aggregate_collected_data` for the given aggregation methods."""
+    agg_source_resolutions = ", ".join(
+        [f"'{resolution}'" for resolution in AGG_SOURCE_RESOLUTIONS]
+    )
+
+    # NOTE:for variables with mixed years, the oldest year is considered during aggregation
+    sql_cmd = f"""
+    INSERT INTO processed_data (region_id, var_detail_id, confidence_level_id, proxy_detail_id, year, value)
+    SELECT 
+        p.parent_id,
+        scd.var_detail_id,
+        MIN(scd.confidence_level_id),
+        scd.proxy_detail_id,
+        MIN(scd.year), 
+        ROUND({get_aggregation_expression(agg_modes)}, 5)
+    FROM 
+        staged_collected_data AS scd
+    JOIN 
+        var_details AS v ON scd.var_detail_id = v.id
+    JOIN 
+        original_resolutions AS o ON v.original_resolution_id = o.id
+    JOIN 
+        region_hierarchy AS h ON scd.region_id = h.region_id
+    CROSS JOIN LATERAL 
+        (VALUES (h.nuts0_id), (h.nuts1_id), (h.nuts2_id), (h.nuts3_id)) AS p(parent_id)
+    WHERE 
+        (v.var_name NOT LIKE 'eucalc_%%' AND 
+        v.var_name NOT LIKE 'cimp_%%' AND 
+        v.var_name NOT LIKE 'cproj_%%')
+        AND o.original_resolution IN ({agg_source_resolutions})
+        AND v.post_disagg_calculation_eq IS NULL
+        AND p.parent_id IS NOT NULL
+        AND p.parent_id <> scd.region_id
+    GROUP BY 
+        p.parent_id,
+        scd.var_detail_id,
+        scd.proxy_detail_id,
+        v.var_aggregation_method;
+    """
+
+    return sql_cmd
 
 
 @with_db_connection()
 def aggregate_collected_data(cursor):
-    for spatial_resolution in ["NUTS2", "NUTS3", "LAU"]:
-        original_resolution_id = db_access.get_primary_key(
-            "original_resolutions", {"original_resolution": spatial_resolution}
-        )
+    """Aggregate all collected vars to all coarser NUTS levels in a single statement.
 
-        sql_cmd = f"""SELECT id, var_aggregation_method FROM var_details 
-                    WHERE 
-                        (var_name NOT LIKE 'eucalc_%%' AND 
-                        var_name NOT LIKE 'cimp_%%' AND 
-                        var_name NOT LIKE 'cproj_%%')
-                        AND original_resolution_id={original_resolution_id}
-                        AND post_disagg_calculation_eq IS NULL;"""
+    Each row of staged_collected_data is expanded to its parent regions via the region_hierarchy
+    table, and the rows of each parent region are aggregated with the var_aggregation_method of the var.
+    """
+    region_hierarchy.ensure_region_hierarchy()
 
-        var_details = db_access.get_table(sql_cmd)
+    agg_modes = get_agg_modes()
 
-        for idx, row in var_details.iterrows():
-            var_detail_id = row["id"]
-            var_aggregation_method = row["var_aggregation_method"]
+    if len(agg_modes) == 0:
+        return
 
-            aggregate_collected_var(
-                cursor, var_detail_id, var_aggregation_method, spatial_resolution
-            )
+    cursor.execute(get_aggregate_collected_data_sql(agg_modes))
 
 
-aggregate_collected_data()
+if __name__ == "__main__":
+    copy_collected_data_into_processed_data()
+    aggregate_collected_data()
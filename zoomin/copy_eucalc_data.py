@@ -30,4 +30,5 @@ def copy_eucalc_data_into_processed_data(cursor):
     cursor.execute(sql_cmd)
 
 
-copy_eucalc_data_into_processed_data()
+if __name__ == "__main__":
+    copy_eucalc_data_into_processed_data()
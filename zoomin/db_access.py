@@ -1,39 +1,56 @@
 import os
-from typing import Any, Optional, Callable, Iterable
-import csv
-from io import StringIO
-from functools import wraps
-from psycopg2 import pool
+from typing import Any, Optional, Callable, Iterator
+from io import BytesIO
+from uuid import uuid4
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-import dask.dataframe as dd
-from sqlalchemy import create_engine
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 from dotenv import load_dotenv, find_dotenv
+from zoomin.proxy_cache import proxy_cache
+from zoomin import proxy_snapshot
+from zoomin import binary_copy
+from zoomin import staging
+from zoomin.connection_manager import ConnectionManager
 
 # find .env automagically by walking up directories until it's found
 dotenv_path = find_dotenv()
 # load up the entries as environment variables
 load_dotenv(dotenv_path)
 
-db_country = os.environ.get("DB_COUNTRY")
-db_version = os.environ.get("DB_VERSION")
+# bytes passed to the server per call during COPY
+COPY_BUFFER_SIZE = 1 << 20
 
-db_name = f"{db_country.lower()}_v{db_version}"
-db_user = os.environ.get("DB_USER")
-db_pwd = os.environ.get("DB_PASSWORD")
-db_host = os.environ.get("DB_HOST")
-db_port = os.environ.get("DB_PORT")
 
-# Initialize the connection pool
-db_pool = pool.SimpleConnectionPool(
-    minconn=1,
-    maxconn=10,
-    user=db_user,
-    password=db_pwd,
-    host=db_host,
-    port=db_port,
-    database=db_name,
-)
+def get_db_name(db_country: Optional[str] = None) -> str:
+    """Return the name of the database, made up of DB_COUNTRY and DB_VERSION.
+    The environment is read on each call, so that nothing is resolved at import time.
+
+    :param db_country: Country of the database. Defaults to DB_COUNTRY
+    :type db_country: Optional[str]
+    """
+    if db_country is None:
+        db_country = os.environ.get("DB_COUNTRY")
+    db_version = os.environ.get("DB_VERSION")
+
+    if db_country is None or db_version is None:
+        raise ValueError(
+            "DB_COUNTRY and DB_VERSION have to be set to access the database."
+        )
+
+    return f"{db_country.lower()}_v{db_version}"
+
+
+@contextmanager
+def db_connection() -> Iterator[Any]:
+    """Provide a pooled Postgres connection and return it to the pool afterwards.
+    The transaction is committed on success and rolled back on error.
+    """
+    with connection_manager.connection() as connection:
+        yield connection
 
 
 def with_db_connection() -> Any:
@@ -43,26 +60,14 @@ def with_db_connection() -> Any:
         @wraps(func_call)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
             try:
-                # Get connection from the pool
-                connection = db_pool.getconn()
-                if connection is None:
-                    raise Exception("Failed to get DB connection from the pool")
-
-                with connection:
+                with db_connection() as connection:
                     with connection.cursor() as cursor:
                         return_val = func_call(cursor, *args, **kwargs)
 
-                # Return the connection to the pool
-                db_pool.putconn(connection)
-
                 # return value
                 return return_val
 
             except Exception as error:
-                # Return the connection to the pool in case of error
-                if connection is not None:
-                    db_pool.putconn(connection, close=True)
-
                 # Log more details about the error
                 print(
                     f"Attempting to connect to the database for function {func_call.__name__} with args {args} and kwargs {kwargs}"
@@ -76,15 +81,27 @@ def with_db_connection() -> Any:
 
 def get_db_uri() -> str:
     """Return db uri."""
-    return f"postgresql://{db_user}:{db_pwd}@{db_host}:{db_port}/{db_name}"
+    db_user = os.environ.get("DB_USER")
+    db_pwd = os.environ.get("DB_PASSWORD")
+    db_host = os.environ.get("DB_HOST")
+    db_port = os.environ.get("DB_PORT")
+
+    return f"postgresql://{db_user}:{db_pwd}@{db_host}:{db_port}/{get_db_name()}"
+
+
+# the single connection pool of this process. No connection is opened before the
+# first query
+connection_manager = ConnectionManager(get_db_uri)
 
 
 def get_db_engine() -> Any:
-    """Set up database connection engine."""
-    db_uri = get_db_uri()
-    engine = create_engine(db_uri, pool_pre_ping=True)
+    """Return the database connection engine shared by all calls in this process."""
+    return connection_manager.get_engine()
+
 
-    return engine
+def get_pool_metrics() -> dict:
+    """Return the state of the connection pool (checked-out connections, waits, overflow)."""
+    return connection_manager.metrics()
 
 
 @with_db_connection()
@@ -153,26 +170,102 @@ def get_primary_key(table: str, cols_criteria: dict) -> Any:
     return col_vals
 
 
+def _get_arrow_type(type_code: int) -> Any:
+    """Return the arrow type of a Postgres type OID, None for types that are parsed as text."""
+    if type_code in (20, 21, 23):  # int8, int2, int4
+        return pa.int64()
+    if type_code in (700, 701, 1700):  # float4, float8, numeric
+        return pa.float64()
+    if type_code == 16:  # bool
+        return pa.bool_()
+    return None
+
+
 @with_db_connection()
 def get_table(cursor: Any, sql_cmd: str) -> pd.DataFrame:
-    """Return a table as dataframe based on the sql_cmd."""
-    engine = get_db_engine()
-    engine_conn = engine.connect()
+    """Return a table as dataframe based on the sql_cmd.
+
+    The result is streamed with ``COPY (sql_cmd) TO STDOUT`` over the pooled connection
+    through a pipe into the streaming CSV reader of arrow, which parses it block by block
+    into typed arrow buffers. Besides the result, only one block of CSV text is held in
+    memory at a time.
+    """
+    query = sql_cmd.strip().rstrip(";")
+
+    # column types of the result, without executing the query
+    cursor.execute(f"SELECT * FROM ({query}) AS result LIMIT 0")
+    column_types = {}
+    for column in cursor.description:
+        arrow_type = _get_arrow_type(column.type_code)
+        column_types[column.name] = (
+            arrow_type if arrow_type is not None else pa.string()
+        )
+
+    read_fd, write_fd = os.pipe()
+
+    def copy_to_pipe() -> None:
+        with open(write_fd, "wb") as writer:
+            cursor.copy_expert(
+                f"COPY ({query}) TO STDOUT WITH (FORMAT CSV, HEADER)", writer
+            )
 
-    sql_iterator = pd.read_sql_query(sql=sql_cmd, con=engine_conn, chunksize=5)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with open(read_fd, "rb") as reader:
+            copy_future = executor.submit(copy_to_pipe)
 
-    chunks = []
-    for chunk in sql_iterator:
-        chunks.append(chunk)
+            table, parse_error = None, None
+            try:
+                table = pa_csv.open_csv(
+                    reader,
+                    convert_options=pa_csv.ConvertOptions(
+                        column_types=column_types,
+                        strings_can_be_null=True,
+                        true_values=["t"],
+                        false_values=["f"],
+                    ),
+                ).read_all()
+            except Exception as error:
+                parse_error = error
+
+        # NOTE: the reader is closed before the COPY is waited for, so that a failed
+        # parse never leaves the COPY blocked on a full pipe. The COPY then fails
+        # with a broken pipe, which is not the cause
+        copy_error = copy_future.exception()
+
+    if copy_error is not None and not (
+        parse_error is not None and isinstance(copy_error, BrokenPipeError)
+    ):
+        # e.g. a query that failed mid-stream, which leaves incomplete CSV behind
+        raise copy_error
+    if parse_error is not None:
+        raise parse_error
 
-    # Concatenate all processed chunks into a single DataFrame
-    table_df = pd.concat(chunks, ignore_index=True)
+    table_df = table.to_pandas()
 
     return table_df
 
 
-@with_db_connection()
-def get_regions(cursor: Any, resolution: str) -> pd.DataFrame:
+def iter_table(sql_cmd: str, chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+    """Yield the result of the sql_cmd in dataframes of at most `chunksize` rows.
+
+    The rows are fetched through a server-side cursor, so only one chunk is held in
+    memory at a time. Use this for result sets that are too large for `get_table`.
+    """
+    with db_connection() as connection:
+        with connection.cursor(name=f"zoomin_{uuid4().hex}") as cursor:
+            cursor.itersize = chunksize
+            cursor.execute(sql_cmd)
+
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if len(rows) == 0:
+                    break
+
+                columns = [column.name for column in cursor.description]
+                yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+def get_regions(resolution: str) -> pd.DataFrame:
     """Return dataframe of region codes and their primary keys corresponding to the specified resolution from the DB."""
     # Construct sql command
     sql_cmd = f"SELECT id, region_code FROM regions WHERE resolution='{resolution}'"
@@ -183,89 +276,185 @@ def get_regions(cursor: Any, resolution: str) -> pd.DataFrame:
     return regions_df
 
 
-@with_db_connection()
-def get_proxy_data(cursor: Any, var_name: str, spatial_resolution) -> pd.DataFrame:
-    """Return dataframe from processed_data table at specified resolution."""  # TODO: update docstring
-
-    try:
-        if var_name.startswith("cproj_"):
-            sql_cmd = f"""SELECT d.region_id, r.region_code, d.value, d.year, d.confidence_level_id 
-                            FROM processed_data d
-                            JOIN regions r ON d.region_id = r.id
-                            WHERE d.var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}') AND 
-                                d.year=2025 AND 
-                                d.climate_experiment='RCP4.5' AND 
-                                d.region_id IN (SELECT id FROM regions WHERE resolution = '{spatial_resolution}');"""
-        else:
-            sql_cmd = f"""SELECT d.region_id, r.region_code, d.value, d.year, d.confidence_level_id 
+def get_proxy_data_sql(var_name: str, spatial_resolution) -> str:
+    """Return the query of `get_proxy_data`."""
+    if var_name.startswith("cproj_"):
+        sql_cmd = f"""SELECT d.region_id, r.region_code, d.var_detail_id, d.value, d.year, d.confidence_level_id 
                         FROM processed_data d
                         JOIN regions r ON d.region_id = r.id
                         WHERE d.var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}') AND 
-                             d.region_id IN (SELECT id FROM regions WHERE resolution = '{spatial_resolution}');"""
+                            d.year=2025 AND 
+                            d.climate_experiment='RCP4.5' AND 
+                            d.region_id IN (SELECT id FROM regions WHERE resolution = '{spatial_resolution}');"""
+    else:
+        sql_cmd = f"""SELECT d.region_id, r.region_code, d.var_detail_id, d.value, d.year, d.confidence_level_id 
+                    FROM processed_data d
+                    JOIN regions r ON d.region_id = r.id
+                    WHERE d.var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}') AND 
+                         d.region_id IN (SELECT id FROM regions WHERE resolution = '{spatial_resolution}');"""
 
-        data_df = get_table(sql_cmd)
+    return sql_cmd
 
-    except:
-        raise ValueError(f"{var_name} not found. Check your proxy equation")
 
-    return data_df
+def get_proxy_data(var_name: str, spatial_resolution) -> pd.DataFrame:
+    """Return dataframe from processed_data table at specified resolution."""  # TODO: update docstring
 
+    data_df = get_table(get_proxy_data_sql(var_name, spatial_resolution))
 
-def _psql_insert_copy(table: Any, conn: Any, keys: list, data_iter: Iterable) -> None:
-    """Execute SQL statement inserting data.
+    return data_df
 
-    Parameters
-    ----------
-    table : pandas.io.sql.SQLTable
-        Database table
-    conn : sqlalchemy.engine.Engine or sqlalchemy.engine.Connection
-        Database connection
-    keys : list of str
-        Column names
-    data_iter : Iterable
-        Iterable that iterates the values to be inserted
 
+@lru_cache(maxsize=None)
+@with_db_connection()
+def get_column_types(cursor: Any, table: str) -> dict:
+    """Return the Postgres type name (udt_name) of each column of `table`, in column order."""
+    cursor.execute(
+        """SELECT column_name, udt_name FROM information_schema.columns
+        WHERE table_name = %s
+        ORDER BY ordinal_position;""",
+        (table,),
+    )
+
+    return dict(cursor.fetchall())
+
+
+def _iter_csv_copy(
+    data: pd.DataFrame, column_types: dict, chunksize: int
+) -> Iterator[bytes]:
+    """Yield `data` as CSV COPY streams of at most `chunksize` rows each."""
+    for start in range(0, len(data), chunksize):
+        chunk = data.iloc[start : start + chunksize].copy()
+
+        # integers with missing values are floats in pandas, but "1.0" is no valid integer
+        for column, type_name in column_types.items():
+            if (
+                type_name in ("int2", "int4", "int8")
+                and chunk[column].dtype.kind == "f"
+            ):
+                chunk[column] = np.trunc(chunk[column]).astype("Int64")
+
+        buffer = BytesIO()
+        pa_csv.write_csv(
+            pa.Table.from_pandas(chunk, preserve_index=False),
+            buffer,
+            write_options=pa_csv.WriteOptions(include_header=False),
+        )
+        yield buffer.getvalue()
+
+
+def copy_with_cursor(
+    cursor: Any,
+    data: pd.DataFrame,
+    table: str,
+    column_types: dict,
+    chunksize: int = 100000,
+) -> None:
+    """COPY the `column_types` columns of `data` into `table` using `cursor`.
+    Use this to write to temporary tables, which only exist for one connection.
     """
-    # gets a DBAPI connection that can provide a cursor
-    dbapi_conn = conn.connection
-    with dbapi_conn.cursor() as cur:
-        s_buf = StringIO()
-        writer = csv.writer(s_buf)
-        writer.writerows(data_iter)
-        s_buf.seek(0)
+    columns = ", ".join(column_types)
 
-        columns = ", ".join(keys)
-        if table.schema:
-            table_name = f"{table.schema}.{table.name}"
-        else:
-            table_name = table.name
+    if binary_copy.is_supported(column_types):
+        sql_cmd = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT BINARY)"
+        chunks = binary_copy.iter_binary_copy(data, column_types, chunksize)
+    else:
+        # e.g. numeric columns, which have no simple binary representation
+        sql_cmd = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT CSV)"
+        chunks = _iter_csv_copy(data[list(column_types)], column_types, chunksize)
 
-        sql = f"COPY {table_name} ({columns}) FROM STDIN WITH CSV"
-        cur.copy_expert(sql=sql, file=s_buf)
+    for chunk in chunks:
+        cursor.copy_expert(sql_cmd, BytesIO(chunk), size=COPY_BUFFER_SIZE)
 
 
-def add_to_processed_data(db_ready_df: pd.DataFrame) -> None:
-    """Add the data to processed_data table."""
-    if len(db_ready_df) > 10000:
-        db_uri = get_db_uri()
+def _copy_into_table(
+    data: pd.DataFrame, table: str, column_types: dict, chunksize: int
+) -> None:
+    """COPY `data` into `table` over one pooled connection, in one transaction."""
+    with db_connection() as connection:
+        with connection.cursor() as cursor:
+            copy_with_cursor(cursor, data, table, column_types, chunksize)
 
-        ddf = dd.from_pandas(db_ready_df, npartitions=10)
 
-        ddf.to_sql(
-            name="processed_data",
-            uri=db_uri,
-            index=False,
-            if_exists="append",
-            parallel=True,
-        )
+def write_table(
+    data: pd.DataFrame,
+    table: str,
+    chunksize: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> None:
+    """Append `data` to `table` using COPY.
 
-    # for smaller datasets make a normal entry
-    else:
-        engine = get_db_engine()
-        db_ready_df.to_sql(
-            "processed_data",
-            engine,
-            index=False,
-            if_exists="append",
-            method=_psql_insert_copy,
-        )
+    The columns are serialized into the binary COPY format in chunks of `chunksize` rows,
+    so that only one encoded chunk per connection is held in memory. If tables contain
+    columns without binary encoder, CSV COPY is used instead.
+
+    :param data: Data to write. All columns must exist in `table`
+    :type data: pd.DataFrame
+
+    :param table: Name of the table
+    :type table: str
+
+    :param chunksize: Number of rows per COPY chunk. Defaults to the environment
+        variable DB_WRITE_CHUNKSIZE or 100000
+    :type chunksize: Optional[int]
+
+    :param concurrency: Number of pooled connections to write with in parallel. Defaults
+        to the environment variable DB_WRITE_CONCURRENCY or 1. If > 1, each connection
+        writes its part of the data in its own transaction
+    :type concurrency: Optional[int]
+    """
+    if len(data) == 0:
+        return
+
+    if chunksize is None:
+        chunksize = int(os.environ.get("DB_WRITE_CHUNKSIZE", "100000"))
+    if concurrency is None:
+        concurrency = int(os.environ.get("DB_WRITE_CONCURRENCY", "1"))
+
+    table_column_types = get_column_types(table)
+    missing_columns = [col for col in data.columns if col not in table_column_types]
+    if len(missing_columns) > 0:
+        raise ValueError(f"Columns {missing_columns} do not exist in {table}")
+
+    column_types = {col: table_column_types[col] for col in data.columns}
+
+    concurrency = max(
+        1,
+        min(
+            concurrency, connection_manager.max_connections, -(-len(data) // chunksize)
+        ),
+    )
+
+    if concurrency == 1:
+        _copy_into_table(data, table, column_types, chunksize)
+        return
+
+    bounds = np.linspace(0, len(data), concurrency + 1, dtype=int)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(
+                _copy_into_table,
+                data.iloc[start:end],
+                table,
+                column_types,
+                chunksize,
+            )
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+        for future in futures:
+            future.result()
+
+
+def invalidate_processed_data(var_detail_ids) -> None:
+    """Drop cached proxy data of `var_detail_ids`, which are about to be written to processed_data."""
+    proxy_cache.invalidate(var_detail_ids=var_detail_ids)
+    proxy_snapshot.invalidate_snapshots(var_detail_ids=var_detail_ids)
+
+    # in staging mode, the data is written to the staging table of the current job
+    staging.register_written_var_detail_ids(var_detail_ids)
+
+
+def add_to_processed_data(db_ready_df: pd.DataFrame) -> None:
+    """Add the data to processed_data table."""
+    invalidate_processed_data(db_ready_df["var_detail_id"].unique())
+
+    write_table(db_ready_df, staging.get_target_table())
@@ -0,0 +1,181 @@
+"""Variable-level dependencies of the disaggregation and post disaggregation jobs.
+
+A variable depends on the variables of its proxy equation, of its binary
+disaggregation criteria and, for post disaggregation calculation vars, of its
+post_disagg_calculation_eq. The Snakefiles use the graph to start each job as soon
+as the jobs producing its inputs are done, instead of waiting for all vars of the
+previous group.
+"""
+import re
+import pandas as pd
+from zoomin import db_access
+from zoomin import proxy_equation
+
+NO_PROXY = "no proxy, same value all regions"
+
+
+def get_equation_var_names(equation: str, known_var_names=None) -> list:
+    """Return the names of the variables referenced in `equation`.
+
+    Equations that are no valid proxy equations (e.g. with functions in
+    post_disagg_calculation_eq) are scanned for identifiers instead. These are
+    restricted to `known_var_names`, if given.
+    """
+    try:
+        var_names = proxy_equation.get_var_names(equation)
+    except proxy_equation.ProxyEquationError:
+        var_names = list(dict.fromkeys(re.findall(r"[A-Za-z_]\w*", equation)))
+
+    if known_var_names is not None:
+        var_names = [var_name for var_name in var_names if var_name in known_var_names]
+
+    return var_names
+
+
+def get_proxy_var_names(disagg_proxy, disagg_binary_criteria) -> list:
+    """Return the variables used by a proxy and its binary disaggregation criteria."""
+    equations = []
+    if isinstance(disagg_proxy, str) and disagg_proxy != NO_PROXY:
+        equations.append(disagg_proxy)
+    if isinstance(disagg_binary_criteria, str):
+        equations.append(disagg_binary_criteria.split(">=")[0])
+
+    var_names = []
+    for equation in equations:
+        try:
+            var_names += proxy_equation.get_var_names(equation)
+        except proxy_equation.ProxyEquationError:
+            # NOTE: invalid equations are reported by the jobs that use them
+            continue
+
+    return list(dict.fromkeys(var_names))
+
+
+def build_dependency_graph(
+    var_proxies: pd.DataFrame, post_disagg_calculations: pd.DataFrame
+) -> dict:
+    """Return the variables each variable depends on.
+
+    :param var_proxies: One row per variable and proxy with the columns var_name,
+        disaggregation_proxy and disaggregation_binary_criteria
+    :type var_proxies: pd.DataFrame
+
+    :param post_disagg_calculations: One row per post disaggregation calculation var with
+        the columns var_name and post_disagg_calculation_eq
+    :type post_disagg_calculations: pd.DataFrame
+
+    :returns: Set of variable names per variable name. Variables never depend on themselves
+    :rtype: dict
+    """
+    graph = {}
+
+    for var_name, disagg_proxy, disagg_binary_criteria in var_proxies[
+        ["var_name", "disaggregation_proxy", "disaggregation_binary_criteria"]
+    ].itertuples(index=False):
+        graph.setdefault(var_name, set()).update(
+            get_proxy_var_names(disagg_proxy, disagg_binary_criteria)
+        )
+
+    known_var_names = set(graph) | set(post_disagg_calculations["var_name"])
+    for var_name, equation in post_disagg_calculations[
+        ["var_name", "post_disagg_calculation_eq"]
+    ].itertuples(index=False):
+        graph.setdefault(var_name, set()).update(
+            get_equation_var_names(equation, known_var_names)
+        )
+
+    for var_name, dependencies in graph.items():
+        dependencies.discard(var_name)
+
+    return graph
+
+
+def get_dependency_graph() -> dict:
+    """Return the dependency graph of all staged variables of the database."""
+    var_proxies = db_access.get_table(
+        """SELECT DISTINCT v.var_name, p.disaggregation_proxy, p.disaggregation_binary_criteria
+        FROM (
+            SELECT DISTINCT var_detail_id, proxy_detail_id FROM staged_collected_data
+            UNION SELECT DISTINCT var_detail_id, proxy_detail_id FROM staged_eucalc_data
+        ) d
+        JOIN var_details v ON d.var_detail_id = v.id
+        JOIN proxy_details p ON d.proxy_detail_id = p.id"""
+    )
+    post_disagg_calculations = db_access.get_table(
+        """SELECT var_name, post_disagg_calculation_eq FROM var_details
+        WHERE post_disagg_calculation_eq IS NOT NULL"""
+    )
+
+    return build_dependency_graph(var_proxies, post_disagg_calculations)
+
+
+def get_stage_outputs(job_names: list, file_pattern: str) -> dict:
+    """Return the output files of the jobs `job_names` per variable name.
+
+    :param job_names: Names of the jobs. The variable name is the part before "-", so
+        climate vars with one job per year, e.g. "cproj_annual_mean_temperature-2025",
+        get one output file per year
+    :type job_names: list
+
+    :param file_pattern: Output file of a job, with the placeholder {job_name}
+    :type file_pattern: str
+
+    :rtype: dict
+    """
+    stage_outputs = {}
+    for job_name in job_names:
+        stage_outputs.setdefault(job_name.split("-")[0], []).append(
+            file_pattern.format(job_name=job_name)
+        )
+
+    return stage_outputs
+
+
+def get_input_files(var_name: str, graph: dict, stage_outputs: dict) -> list:
+    """Return the output files of the jobs of the current stage that `var_name` depends on.
+
+    Variables that are not produced in the current stage are in the database already
+    and need no input file.
+
+    :param graph: Result of `build_dependency_graph`
+    :type graph: dict
+
+    :param stage_outputs: Output files of the jobs of the stage per variable name. Climate
+        vars, for example, have one output file per year
+    :type stage_outputs: dict
+
+    :rtype: list
+    """
+    return sorted(
+        file
+        for dependency in graph.get(var_name, set())
+        for file in stage_outputs.get(dependency, [])
+    )
+
+
+def find_cycle(graph: dict):
+    """Return a list of variables that depend on each other in a cycle, or None."""
+    visiting, done = [], set()
+
+    def visit(var_name):
+        if var_name in done:
+            return None
+        if var_name in visiting:
+            return visiting[visiting.index(var_name) :] + [var_name]
+
+        visiting.append(var_name)
+        for dependency in sorted(graph.get(var_name, set())):
+            cycle = visit(dependency)
+            if cycle is not None:
+                return cycle
+        visiting.pop()
+        done.add(var_name)
+
+        return None
+
+    for var_name in sorted(graph):
+        cycle = visit(var_name)
+        if cycle is not None:
+            return cycle
+
+    return None
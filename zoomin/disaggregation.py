@@ -1,78 +1,210 @@
-"""Functions to help disaggregate values to LAU and populate DB with data."""
+"""Functions to help disaggregate values to LAU and populate DB with data.
+
+Disaggregated data is created and written to the DB in chunks of source rows, so that
+the target rows of one chunk at most are held in memory. The size of the chunks is
+bounded by ``ZOOMIN_MAX_CHUNK_MB`` (256 MB by default).
+"""
 import os
 import numpy as np
 import pandas as pd
-from dotenv import load_dotenv, find_dotenv
 
-from zoomin.db_access import (
-    get_regions,
-    add_to_processed_data,
-)
+from zoomin.db_access import add_to_processed_data
+from zoomin.region_catalogue import get_child_index
 from zoomin import disaggregation_utils as disagg_utils
+from zoomin import disaggregation_sql
+from zoomin.dtypes import to_compact_dtypes
 
-# find .env automagically by walking up directories until it's found
-dotenv_path = find_dotenv()
-# load up the entries as environment variables
-load_dotenv(dotenv_path)
-
-db_country = os.environ.get("DB_COUNTRY")
-db_version = os.environ.get("DB_VERSION")
-
-db_name = f"{db_country.lower()}_v{db_version}"
 
-
-def distribute_data_equally(
+def get_equally_distributed_data(
     var_data,
     source_resolution,
     target_resolution,
     proxy_confidence_level,
 ):
-    # TODO: docstrings
-    # STEP1: Disaggregate
-    regions_df = get_regions(target_resolution)
+    """Return `var_data` with the value of each source region assigned to all its target regions.
+    Source regions without target regions are left out.
 
-    regions_df = disagg_utils.match_source_target_resolutions(
-        source_resolution, regions_df
-    )
+    :param proxy_confidence_level: Confidence level of the proxy. Either a single value
+        or one value per row of `var_data`
+    :type proxy_confidence_level: int or np.ndarray
 
-    final_df = pd.merge(
-        regions_df,
+    :returns: final_df
+    :rtype: pd.DataFrame
+    """
+    return _get_broadcast_data(
         var_data,
-        left_on="match_region_code",
-        right_on="region_code",
-        how="right",
+        get_child_index(source_resolution, target_resolution),
+        proxy_confidence_level,
+    )
+
+
+def _get_broadcast_data(
+    var_data, child_index, proxy_confidence_level, start=0, stop=None
+):
+    """Return the rows `start` to `stop` of `var_data` repeated for each child region of
+    their source region. Each column of the result is gathered once from `var_data`.
+    """
+    if stop is None:
+        stop = len(var_data)
+
+    row_positions, target_ids = child_index.broadcast(
+        var_data["region_id"].to_numpy()[start:stop]
     )
+    row_positions += start
+
     ## Calculate final confidence_level_id by taking the minimum between confidence_level_id of values
     ## and the proxy_confidence_level
-    final_df.drop(
-        columns=[
-            "region_code_x",
-            "region_code_y",
-            "match_region_code",
-        ],
-        inplace=True,
+    confidence_level_id = var_data["confidence_level_id"].to_numpy()[row_positions]
+    np.minimum(
+        confidence_level_id,
+        np.asarray(proxy_confidence_level)[row_positions]
+        if np.ndim(proxy_confidence_level) > 0
+        else proxy_confidence_level,
+        out=confidence_level_id,
+        casting="same_kind",
     )
-    final_df.rename(columns={"id": "region_id"}, inplace=True)
 
-    final_df["confidence_level_id"] = np.minimum(
-        final_df["confidence_level_id"], proxy_confidence_level
+    final_df = {"region_id": target_ids}
+    for col in var_data.columns:
+        if col == "confidence_level_id":
+            final_df[col] = confidence_level_id
+        elif col not in ["region_id", "region_code"]:
+            final_df[col] = var_data[col].array.take(row_positions)
+
+    return pd.DataFrame(final_df, copy=False)
+
+
+def get_max_chunk_rows(bytes_per_row: int) -> int:
+    """Return the number of target rows per chunk, so that a chunk of rows of
+    `bytes_per_row` bytes stays below ``ZOOMIN_MAX_CHUNK_MB``.
+    """
+    max_chunk_mb = float(os.environ.get("ZOOMIN_MAX_CHUNK_MB", "256"))
+
+    return max(1, int(max_chunk_mb * 1024**2 // max(bytes_per_row, 1)))
+
+
+def get_bytes_per_row(*dfs) -> int:
+    """Return the estimated size of a target row made of the columns of `dfs` in bytes."""
+    bytes_per_row = sum(
+        df.memory_usage(deep=True, index=False).sum() / max(len(df), 1) for df in dfs
     )
+    # NOTE: the arrays a chunk is built from take about as much memory as the chunk itself
+    return int(2 * bytes_per_row)
 
-    add_to_processed_data(final_df)
 
+def iter_chunk_bounds(target_row_counts, chunksize: int):
+    """Yield the (start, stop) positions of consecutive chunks of source rows, such that
+    each chunk has at most `chunksize` target rows. The target rows of a source row are
+    never split, so a chunk with a single source row may exceed `chunksize`.
 
-def perform_proxy_based_disaggregation(
+    :param target_row_counts: Number of target rows of each source row
+    :type target_row_counts: np.ndarray
+    """
+    # number of target rows up to and including each source row
+    row_ends = np.cumsum(target_row_counts)
+
+    start = 0
+    while start < len(row_ends):
+        n_done = row_ends[start - 1] if start > 0 else 0
+        stop = max(
+            int(np.searchsorted(row_ends, n_done + chunksize, side="right")),
+            start + 1,
+        )
+
+        yield start, stop
+
+        start = stop
+
+
+def iter_equally_distributed_data(
     var_data,
+    source_resolution,
+    target_resolution,
+    proxy_confidence_level,
+    chunksize=None,
+):
+    """Yield `var_data` with the value of each source region assigned to all its target
+    regions, in chunks of at most `chunksize` rows (see `iter_chunk_bounds`).
+
+    The target regions are looked up in the cached child index of the region catalogue,
+    instead of merging the regions with `var_data`. Source regions without target
+    regions are left out.
+
+    :param proxy_confidence_level: Confidence level of the proxy. Either a single value
+        or one value per row of `var_data`
+    :type proxy_confidence_level: int or np.ndarray
+
+    :param chunksize: Number of target rows per chunk. Defaults to the rows that fit in
+        ``ZOOMIN_MAX_CHUNK_MB``
+    :type chunksize: Optional[int]
+    """
+    child_index = get_child_index(source_resolution, target_resolution)
+
+    if chunksize is None:
+        chunksize = get_max_chunk_rows(
+            get_bytes_per_row(var_data.drop(columns=["region_code"], errors="ignore"))
+        )
+
+    target_row_counts = child_index.get_child_counts(var_data["region_id"].to_numpy())
+    for start, stop in iter_chunk_bounds(target_row_counts, chunksize):
+        if target_row_counts[start:stop].sum() == 0:
+            continue
+
+        yield _get_broadcast_data(
+            var_data, child_index, proxy_confidence_level, start, stop
+        )
+
+
+def distribute_data_equally(
+    var_data,
+    source_resolution,
+    target_resolution,
+    proxy_confidence_level,
+    staged_source=None,
+):
+    """Assign the value of each source region in `var_data` to all its target regions
+    and add the result to processed_data.
+
+    :param staged_source: Staged table and WHERE clause (table aliased as d) that select
+        the rows of `var_data`. If given and ZOOMIN_DISAGG_BACKEND=sql, the data is
+        disaggregated in the database and `var_data` is not used (it may be None)
+    :type staged_source: tuple
+    """
+    if staged_source is not None and disaggregation_sql.is_sql_backend():
+        disaggregation_sql.distribute_data_equally(
+            *staged_source,
+            source_resolution,
+            target_resolution,
+            proxy_confidence_level,
+        )
+        return
+
+    # STEP1: Disaggregate, writing each chunk to the DB before the next one is created
+    for final_df in iter_equally_distributed_data(
+        var_data, source_resolution, target_resolution, proxy_confidence_level
+    ):
+        add_to_processed_data(final_df)
+
+
+def get_disaggregation_proxy_data(
     source_resolution,
     target_resolution,
     disagg_proxy,
     disagg_binary_criteria,
-    proxy_confidence_level,
-    var_unit,
 ):
-    # TODO: docstrings
-    # STEP1: Disaggregate
-    proxy_data = disagg_utils.solve_proxy_equation(disagg_proxy, target_resolution)
+    """Return the solved `disagg_proxy` at `target_resolution`, matched to the source regions
+    and with `disagg_binary_criteria` applied, if given.
+
+    The proxy equation and the equation of the binary criteria are solved in one batch, so
+    that the vars and sub-terms they share are loaded and evaluated once.
+    """
+    equations = [disagg_proxy]
+    if isinstance(disagg_binary_criteria, str):
+        criteria_equation = disagg_binary_criteria.split(">=")[0]
+        equations.append(criteria_equation)
+
+    results = disagg_utils.solve_proxy_equations(equations, target_resolution)
+    proxy_data = results[disagg_proxy]
 
     if len(proxy_data) == 0:
         raise ValueError("Proxy data not found in the database.")
@@ -83,21 +215,286 @@ def perform_proxy_based_disaggregation(
 
     if isinstance(disagg_binary_criteria, str):
         proxy_data = disagg_utils.apply_binary_disaggregation_criteria(
-            proxy_data, disagg_binary_criteria, target_resolution
+            proxy_data,
+            disagg_binary_criteria,
+            target_resolution,
+            result=results[criteria_equation],
         )
 
-    final_df, is_bad_proxy_list = disagg_utils.disaggregate_data(
-        var_data, proxy_data, proxy_confidence_level
-    )
+    return to_compact_dtypes(proxy_data, "proxy_data")
 
-    final_df.drop(columns=["region_code", "match_region_code"], inplace=True)
+
+def get_proxy_based_disaggregated_data(
+    var_data,
+    proxy_data,
+    proxy_confidence_level,
+    is_number,
+    proxy_index=None,
+):
+    """Disaggregate `var_data` based on the prepared `proxy_data`.
+
+    :param proxy_confidence_level: Confidence level of the proxy. Either a single value
+        or one value per row of `var_data`
+    :type proxy_confidence_level: int or np.ndarray
+
+    :param is_number: Whether the values should be rounded to whole numbers, like population values.
+        Either a single value or one value per row of `var_data`
+    :type is_number: bool or np.ndarray
+
+    :param proxy_index: Positions of the rows of `proxy_data` per source region, see
+        `disaggregation_utils.get_proxy_index`. Built from `proxy_data` if not given
+    :type proxy_index: Optional[ChildIndex]
+
+    :returns: final_df, is_bad_proxy
+    :rtype: pd.DataFrame, pd.Series
+    """
+    final_df, is_bad_proxy = disagg_utils.disaggregate_data(
+        var_data,
+        proxy_data,
+        proxy_confidence_level,
+        proxy_columns=["region_id"],
+        proxy_index=proxy_index,
+    )
 
     # round to whole number if var_unit is number like population values
-    if var_unit == "number":
-        final_df["value"] = final_df["value"].astype(int)
+    # NOTE: truncated as floats, like the per row, share based and SQL paths
+    if np.ndim(is_number) == 0:
+        if is_number:
+            final_df["value"] = np.trunc(final_df["value"])
+    else:
+        # NOTE: values of rows that are no numbers are kept as they are
+        number_var_detail_ids = var_data.loc[
+            np.asarray(is_number, dtype=bool), "var_detail_id"
+        ].unique()
+        is_number_row = final_df["var_detail_id"].isin(number_var_detail_ids)
+        final_df.loc[is_number_row, "value"] = np.trunc(
+            final_df.loc[is_number_row, "value"]
+        )
+
+    return final_df, is_bad_proxy
+
+
+def iter_proxy_based_disaggregated_data(
+    var_data,
+    proxy_data,
+    proxy_confidence_level,
+    is_number,
+    chunksize=None,
+):
+    """Disaggregate `var_data` based on the prepared `proxy_data` and yield the result in
+    chunks of at most `chunksize` target rows (see `iter_chunk_bounds`).
+
+    :param proxy_confidence_level: Confidence level of the proxy. Either a single value
+        or one value per row of `var_data`
+    :type proxy_confidence_level: int or np.ndarray
+
+    :param is_number: Whether the values should be rounded to whole numbers. Either a
+        single value or one value per row of `var_data`
+    :type is_number: bool or np.ndarray
+
+    :param chunksize: Number of target rows per chunk. Defaults to the rows that fit in
+        ``ZOOMIN_MAX_CHUNK_MB``
+    :type chunksize: Optional[int]
+
+    :returns: final_df, is_bad_proxy of each chunk. `is_bad_proxy` is aligned with the
+        rows of the chunk of `var_data`
+    :rtype: Iterator[tuple]
+    """
+    if chunksize is None:
+        chunksize = get_max_chunk_rows(get_bytes_per_row(var_data, proxy_data))
+
+    # NOTE: the proxy rows are indexed once and the index is shared by all chunks
+    proxy_index = disagg_utils.get_proxy_index(proxy_data)
+
+    # number of target regions of each source row
+    target_row_counts = proxy_index.get_child_counts(var_data["region_id"].to_numpy())
+
+    for start, stop in iter_chunk_bounds(target_row_counts, chunksize):
+        yield get_proxy_based_disaggregated_data(
+            var_data.iloc[start:stop],
+            proxy_data,
+            _get_chunk(proxy_confidence_level, start, stop),
+            _get_chunk(is_number, start, stop),
+            proxy_index=proxy_index,
+        )
+
+
+def _get_chunk(value, start: int, stop: int):
+    """Return the rows `start` to `stop` of a per row value, or the single value."""
+    return value if np.ndim(value) == 0 else np.asarray(value)[start:stop]
+
+
+def perform_proxy_based_disaggregation(
+    var_data,
+    source_resolution,
+    target_resolution,
+    disagg_proxy,
+    disagg_binary_criteria,
+    proxy_confidence_level,
+    var_unit,
+    staged_source=None,
+):
+    """Disaggregate `var_data` based on `disagg_proxy` and add the result to processed_data.
+
+    :param staged_source: Staged table and WHERE clause (table aliased as d) that select
+        the rows of `var_data`. If given and ZOOMIN_DISAGG_BACKEND=sql, the shares and
+        the target values are computed in the database and `var_data` is not used (it
+        may be None)
+    :type staged_source: tuple
+
+    :returns: "bad_proxy" if the proxy is 0 in all target regions of a source region
+    :rtype: str or None
+    """
+    # STEP1: Disaggregate
+    proxy_data = get_disaggregation_proxy_data(
+        source_resolution, target_resolution, disagg_proxy, disagg_binary_criteria
+    )
+
+    if staged_source is not None and disaggregation_sql.is_sql_backend():
+        is_bad_proxy = disaggregation_sql.perform_proxy_based_disaggregation(
+            proxy_data,
+            *staged_source,
+            proxy_confidence_level,
+            var_unit == "number",
+        )
+        if is_bad_proxy:
+            return "bad_proxy"
+        return
 
     # TODO: the values should be integers for integer type data . For example: population
-    add_to_processed_data(final_df)
+    bad_proxy = None
+    for final_df, is_bad_proxy in iter_proxy_based_disaggregated_data(
+        var_data, proxy_data, proxy_confidence_level, var_unit == "number"
+    ):
+        add_to_processed_data(final_df)
+
+        if is_bad_proxy.any():
+            bad_proxy = "bad_proxy"
+
+    return bad_proxy
 
-    if any(is_bad_proxy_list):
-        return "bad_proxy"
+
+def get_share_disaggregated_data(
+    var_data,
+    target_regions,
+    shares,
+    proxy_confidence_level,
+    is_number,
+    target_index=None,
+):
+    """Disaggregate all rows of `var_data` (e.g. all pathways and years of an EUCalc var)
+    with one share vector.
+
+    Each row is matched to the target regions of its source region through an index of
+    the target regions per source region, and each column of the result is gathered once.
+
+    :param var_data: Data with the columns region_id, var_detail_id, value,
+        confidence_level_id, year, proxy_detail_id and optionally pathway
+    :type var_data: pd.DataFrame
+
+    :param target_regions: Target regions with the columns region_id, match_region_id and
+        optionally the confidence_level_id of the proxy
+    :type target_regions: pd.DataFrame
+
+    :param shares: Share of each target region in the value of its source region
+    :type shares: np.ndarray
+
+    :param proxy_confidence_level: Confidence level of the proxy
+    :type proxy_confidence_level: int
+
+    :param is_number: Whether the values should be truncated to whole numbers
+    :type is_number: bool
+
+    :param target_index: Positions of the target regions per source region, see
+        `disaggregation_utils.get_proxy_index`. Built from `target_regions` if not given
+    :type target_index: Optional[ChildIndex]
+
+    :returns: final_df, source_ids_without_targets
+    :rtype: pd.DataFrame, np.ndarray
+    """
+    target_ids = target_regions["region_id"].to_numpy()
+    target_confidence_levels = (
+        target_regions["confidence_level_id"].to_numpy()
+        if "confidence_level_id" in target_regions.columns
+        else np.full(len(target_regions), proxy_confidence_level)
+    )
+    shares = np.asarray(shares, dtype=float)
+
+    row_source_ids = var_data["region_id"].to_numpy()
+    row_values = var_data["value"].to_numpy(dtype=float)
+    row_confidence_levels = np.minimum(
+        var_data["confidence_level_id"].to_numpy(), proxy_confidence_level
+    )
+
+    # pairs of row and target region, for each target region of the source region of each row
+    if target_index is None:
+        target_index = disagg_utils.get_proxy_index(target_regions)
+    row_pos, target_pos = target_index.broadcast(row_source_ids)
+
+    source_ids_without_targets = np.unique(
+        row_source_ids[target_index.get_child_counts(row_source_ids) == 0]
+    )
+
+    # NOTE: the values and confidence levels are computed in place of the gathered arrays
+    values = shares[target_pos]
+    values *= row_values[row_pos]
+    if is_number:
+        np.trunc(values, out=values)
+
+    confidence_level_id = target_confidence_levels[target_pos]
+    np.minimum(
+        confidence_level_id,
+        row_confidence_levels[row_pos],
+        out=confidence_level_id,
+        casting="same_kind",
+    )
+
+    final_df = {
+        "region_id": target_ids[target_pos],
+        "confidence_level_id": confidence_level_id,
+        "value": values,
+    }
+    # NOTE: same year, var_detail_id, proxy_detail_id (and pathway) as the source value
+    for col in ["var_detail_id", "proxy_detail_id", "pathway", "year"]:
+        if col in var_data.columns:
+            final_df[col] = var_data[col].array.take(row_pos)
+
+    return pd.DataFrame(final_df, copy=False), source_ids_without_targets
+
+
+def iter_share_disaggregated_data(
+    var_data,
+    target_regions,
+    shares,
+    proxy_confidence_level,
+    is_number,
+    chunksize=None,
+):
+    """Disaggregate all rows of `var_data` with one share vector (see
+    `get_share_disaggregated_data`) and yield the result in chunks of at most `chunksize`
+    target rows (see `iter_chunk_bounds`).
+
+    :param chunksize: Number of target rows per chunk. Defaults to the rows that fit in
+        ``ZOOMIN_MAX_CHUNK_MB``
+    :type chunksize: Optional[int]
+
+    :returns: final_df, source_ids_without_targets of each chunk
+    :rtype: Iterator[tuple]
+    """
+    if chunksize is None:
+        chunksize = get_max_chunk_rows(get_bytes_per_row(var_data))
+
+    # NOTE: the target regions are indexed once and the index is shared by all chunks
+    target_index = disagg_utils.get_proxy_index(target_regions)
+
+    target_row_counts = target_index.get_child_counts(var_data["region_id"].to_numpy())
+
+    for start, stop in iter_chunk_bounds(target_row_counts, chunksize):
+        yield get_share_disaggregated_data(
+            var_data.iloc[start:stop],
+            target_regions,
+            shares,
+            proxy_confidence_level,
+            is_number,
+            target_index=target_index,
+        )
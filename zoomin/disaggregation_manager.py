@@ -1,31 +1,90 @@
 """Main functions to process climate vars, collected vars and EUCalc vars of all spatial levels"""
-from zoomin.db_access import get_table, get_values
+import numpy as np
+import pandas as pd
+from zoomin.db_access import get_table, get_values, add_to_processed_data
 from zoomin import disaggregation as disagg
+from zoomin import disaggregation_utils as disagg_utils
+from zoomin import disaggregation_sql
+from zoomin.region_catalogue import get_regions
+from zoomin.dtypes import to_compact_dtypes
+
+
+def get_staged_var_data(sql_cmd, staged_source) -> tuple:
+    """Return the staged data selected by `sql_cmd` and its proxy_detail_id.
+
+    With ZOOMIN_DISAGG_BACKEND=sql, the staged rows are selected by the INSERT ... SELECT
+    of the SQL backend, so only the proxy_detail_id is read and the data is None.
+
+    :param staged_source: Staged table and WHERE clause (table aliased as d) of `sql_cmd`
+    :type staged_source: tuple
+
+    :returns: var_data, proxy_detail_id
+    :rtype: Optional[pd.DataFrame], int
+    """
+    if disaggregation_sql.is_sql_backend():
+        staged_table, where_clause = staged_source
+        proxy_detail_id = get_values(
+            f"SELECT d.proxy_detail_id FROM {staged_table} d WHERE {where_clause} LIMIT 1;"
+        )
+        return None, proxy_detail_id
+
+    var_data = to_compact_dtypes(get_table(sql_cmd), "var_data")
+
+    return var_data, var_data["proxy_detail_id"][0].item()
+
 
 ############## Climate data ##################
-def disaggregate_climate_var(climate_var_detail) -> None:
-    """Disaggregate to the specified spatial resolution and add to the database."""  # TODO: docstring
+def get_climate_var_where_clause(var_name, years=None) -> str:
+    """Return the condition selecting the staged data of a climate var (table aliased as d)."""
+    where_clause = (
+        f"d.var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}')"
+    )
+    if years is not None:
+        years_str = ", ".join(str(int(year)) for year in years)
+        where_clause = f"{where_clause} AND d.year IN ({years_str})"
+
+    return where_clause
+
+
+def get_climate_var_sql(where_clause) -> str:
+    """Return the query of the staged climate data selected by `where_clause`."""
+    return f"""SELECT d.region_id, d.climate_experiment, d.var_detail_id, d.value, d.confidence_level_id, d.year, d.proxy_detail_id
+                FROM staged_climate_data d
+                WHERE {where_clause}"""
+
+
+def disaggregate_climate_var(climate_var_detail, years=None) -> None:
+    """Disaggregate all years and climate experiments of a climate var from NUTS3 to LAU
+    and add them to the database.
+
+    The data of the var is read in one query and the value of each NUTS3 region is
+    assigned to its LAU regions in one broadcast, which is written to the DB in chunks.
+
+    :param climate_var_detail: Name of the climate var, optionally with a year, e.g.
+        "cproj_annual_mean_temperature-2030", to disaggregate only that year
+    :type climate_var_detail: str
+
+    :param years: Years to disaggregate. Defaults to all staged years
+    :type years: Optional[list]
+    """
     # get data
-    if ("cproj_" in climate_var_detail) or ("cimp_ts" in climate_var_detail):
+    if "-" in climate_var_detail:
         [var_name, data_year] = climate_var_detail.split("-")
 
-        data_year = int(data_year)
-
-        sql_cmd = f"""SELECT r.region_code, d.climate_experiment, d.var_detail_id, d.value, d.confidence_level_id, d.year, d.proxy_detail_id
-                        FROM staged_climate_data d
-                        JOIN regions r ON d.region_id = r.id
-                        WHERE d.var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}') 
-                            AND d.year = {data_year}"""
-        var_data = get_table(sql_cmd)
+        years = [data_year]
 
     else:
         var_name = climate_var_detail
 
-        sql_cmd = f"""SELECT r.region_code, d.climate_experiment, d.var_detail_id, d.value, d.confidence_level_id, d.year, d.proxy_detail_id
-                        FROM staged_climate_data d
-                        JOIN regions r ON d.region_id = r.id
-                        WHERE d.var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}')"""
-        var_data = get_table(sql_cmd)
+    where_clause = get_climate_var_where_clause(var_name, years)
+
+    if disaggregation_sql.is_sql_backend():
+        # NOTE: the staged rows are selected by the INSERT ... SELECT of the SQL backend
+        var_data = None
+    else:
+        var_data = to_compact_dtypes(
+            get_table(get_climate_var_sql(where_clause)), "var_data"
+        )
 
     proxy_confidence_level = 3  # because all climate data is given this rating
 
@@ -39,26 +98,43 @@ def disaggregate_climate_var(climate_var_detail) -> None:
         source_resolution,
         target_resolution,
         proxy_confidence_level,
+        staged_source=("staged_climate_data", where_clause),
     )
 
 
 ############## Collected data ##################
+def get_collected_var_where_clause(var_name) -> str:
+    """Return the condition selecting the staged data of a collected var (table aliased as d)."""
+    return (
+        f"d.var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}')"
+    )
+
+
+def get_collected_var_sql(where_clause) -> str:
+    """Return the query of the staged collected data selected by `where_clause`."""
+    return f"""SELECT d.region_id, r.region_code, d.var_detail_id, d.value, d.confidence_level_id, d.year, d.proxy_detail_id
+                FROM staged_collected_data d
+                JOIN regions r ON d.region_id = r.id
+                WHERE {where_clause};"""
+
+
 def disaggregate_collected_var(var_name, source_resolution, target_resolution) -> None:
     """Disaggregate to the specified spatial resolution and add to the database."""  # TODO: docstring
 
     # get data
-    sql_cmd = f"""SELECT r.region_code, d.var_detail_id, d.value, d.confidence_level_id, d.year, d.proxy_detail_id
-                    FROM staged_collected_data d
-                    JOIN regions r ON d.region_id = r.id
-                    WHERE var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}');"""
-    var_data = get_table(sql_cmd)
+    where_clause = get_collected_var_where_clause(var_name)
+    staged_source = ("staged_collected_data", where_clause)
+
+    var_data, proxy_detail_id = get_staged_var_data(
+        get_collected_var_sql(where_clause),
+        staged_source,
+    )
 
     var_unit = get_values(
         f"SELECT var_unit FROM var_details WHERE var_name = '{var_name}';"
     )
 
     # Disaggregate
-    proxy_detail_id = var_data["proxy_detail_id"][0].item()
 
     proxy_details_row = get_table(
         f"""SELECT disaggregation_proxy, proxy_confidence_level, disaggregation_binary_criteria
@@ -72,7 +148,11 @@ def disaggregate_collected_var(var_name, source_resolution, target_resolution) -
         if disagg_proxy == "no proxy, same value all regions":
 
             disagg.distribute_data_equally(
-                var_data, source_resolution, target_resolution, proxy_confidence_level
+                var_data,
+                source_resolution,
+                target_resolution,
+                proxy_confidence_level,
+                staged_source=staged_source,
             )
 
         else:
@@ -88,6 +168,7 @@ def disaggregate_collected_var(var_name, source_resolution, target_resolution) -
                 disagg_binary_criteria,
                 proxy_confidence_level,
                 var_unit,
+                staged_source=staged_source,
             )
             return bad_proxy
 
@@ -102,20 +183,25 @@ def disaggregate_eucalc_var(var_name, pathway, year, target_resolution) -> None:
     """Disaggregate to the specified spatial resolution and add to the database."""  # TODO: docstring
 
     # get data
-    sql_cmd = f"""SELECT r.region_code, d.var_detail_id, d.pathway, d.value, d.confidence_level_id, d.year, d.proxy_detail_id
-                    FROM staged_eucalc_data d
-                    JOIN regions r ON d.region_id = r.id
-                    WHERE var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}') AND 
+    where_clause = f"""d.var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}') AND 
                             d.pathway = '{pathway}' AND 
                             d.year = {year}"""
+    staged_source = ("staged_eucalc_data", where_clause)
+
+    var_data, proxy_detail_id = get_staged_var_data(
+        f"""SELECT d.region_id, r.region_code, d.var_detail_id, d.pathway, d.value, d.confidence_level_id, d.year, d.proxy_detail_id
+                FROM staged_eucalc_data d
+                JOIN regions r ON d.region_id = r.id
+                WHERE {where_clause}""",
+        staged_source,
+    )
 
-    var_data = get_table(sql_cmd)
-
-    var_unit = f"SELECT var_unit FROM var_details WHERE var_name = '{var_name}';"
+    # NOTE: EUCalc vars with var_unit "number" are truncated to whole numbers, like collected vars
+    var_unit = get_values(
+        f"SELECT var_unit FROM var_details WHERE var_name = '{var_name}';"
+    )
 
     # Disaggregate
-    proxy_detail_id = var_data["proxy_detail_id"][0].item()
-
     proxy_details_row = get_table(
         f"""SELECT disaggregation_proxy, proxy_confidence_level, disaggregation_binary_criteria
                 FROM proxy_details WHERE id={proxy_detail_id}"""
@@ -132,6 +218,7 @@ def disaggregate_eucalc_var(var_name, pathway, year, target_resolution) -> None:
                 "NUTS0",
                 target_resolution,
                 proxy_confidence_level,
+                staged_source=staged_source,
             )
 
         else:
@@ -147,6 +234,7 @@ def disaggregate_eucalc_var(var_name, pathway, year, target_resolution) -> None:
                 disagg_binary_criteria,
                 proxy_confidence_level,
                 var_unit,
+                staged_source=staged_source,
             )
             return bad_proxy
 
@@ -154,3 +242,238 @@ def disaggregate_eucalc_var(var_name, pathway, year, target_resolution) -> None:
         raise ValueError(
             "One of proxy_equation or same_value_all_regions should be provided"
         )
+
+
+def disaggregate_eucalc_var_all_pathways(
+    var_name, target_resolution, pathways=None, years=None
+) -> None:
+    """Disaggregate all pathways and years of an EUCalc var to the specified spatial resolution
+    and add them to the database.
+
+    The staged data is loaded in one query and the proxy is solved once. The
+    (pathway, year) values of the NUTS0 region are multiplied by the share vector of
+    the target regions. The result is written in memory-bounded chunks, see
+    ``ZOOMIN_MAX_CHUNK_MB``.
+
+    :param var_name: Name of the EUCalc var
+    :type var_name: str
+
+    :param target_resolution: The resolution to disaggregate to
+    :type target_resolution: str
+
+    :param pathways: Pathways to disaggregate. Defaults to all staged pathways
+    :type pathways: Optional[list]
+
+    :param years: Years to disaggregate. Defaults to all staged years
+    :type years: Optional[list]
+
+    :returns: "bad_proxy" if the proxy is 0 in all target regions
+    :rtype: str or None
+    """
+    sql_cmd = f"""SELECT d.region_id, d.var_detail_id, d.pathway, d.value, d.confidence_level_id, d.year, d.proxy_detail_id,
+                        v.var_unit, p.disaggregation_proxy, p.proxy_confidence_level, p.disaggregation_binary_criteria
+                    FROM staged_eucalc_data d
+                    JOIN var_details v ON d.var_detail_id = v.id
+                    JOIN proxy_details p ON d.proxy_detail_id = p.id
+                    WHERE v.var_name = '{var_name}'"""
+    if pathways is not None:
+        pathways_str = ", ".join([f"'{pathway}'" for pathway in pathways])
+        sql_cmd = f"{sql_cmd} AND d.pathway IN ({pathways_str})"
+    if years is not None:
+        sql_cmd = (
+            f"{sql_cmd} AND d.year IN ({', '.join(str(int(year)) for year in years)})"
+        )
+
+    var_data = to_compact_dtypes(get_table(sql_cmd), "var_data")
+
+    if len(var_data) == 0:
+        raise ValueError(f"No staged data found for {var_name}")
+
+    detail_cols = [
+        "var_unit",
+        "disaggregation_proxy",
+        "proxy_confidence_level",
+        "disaggregation_binary_criteria",
+    ]
+
+    bad_proxy = None
+    for (disagg_proxy, disagg_binary_criteria), group_data in var_data.groupby(
+        ["disaggregation_proxy", "disaggregation_binary_criteria"],
+        dropna=False,
+        sort=False,
+    ):
+        if not isinstance(disagg_proxy, str):
+            raise ValueError(
+                "One of proxy_equation or same_value_all_regions should be provided"
+            )
+
+        proxy_confidence_level = group_data["proxy_confidence_level"].iloc[0]
+        is_number = group_data["var_unit"].iloc[0] == "number"
+
+        is_proxy_based = disagg_proxy != "no proxy, same value all regions"
+
+        if is_proxy_based:
+            target_regions = disagg.get_disaggregation_proxy_data(
+                "NUTS0", target_resolution, disagg_proxy, disagg_binary_criteria
+            )
+            shares, bad_proxy_source_ids = disagg_utils.get_proxy_shares(target_regions)
+        else:
+            target_regions = get_regions(target_resolution).rename(
+                columns={"id": "region_id"}
+            )
+            target_regions = disagg_utils.match_source_target_resolutions(
+                "NUTS0", target_regions
+            )[["region_id", "match_region_id"]]
+            shares = np.ones(len(target_regions))
+            bad_proxy_source_ids = []
+            # NOTE: equally distributed values are kept as they are
+            is_number = False
+
+        for (
+            final_df,
+            source_ids_without_targets,
+        ) in disagg.iter_share_disaggregated_data(
+            group_data.drop(columns=detail_cols),
+            target_regions,
+            shares,
+            proxy_confidence_level,
+            is_number,
+        ):
+            add_to_processed_data(final_df)
+
+            # INFO: the proxy is bad if it is 0 in all target regions or there are no target regions
+            if is_proxy_based and (
+                len(bad_proxy_source_ids) > 0 or len(source_ids_without_targets) > 0
+            ):
+                bad_proxy = "bad_proxy"
+
+    return bad_proxy
+
+
+############## Batch of collected and EUCalc data ##################
+def get_batch_var_data(var_names) -> pd.DataFrame:
+    """Return the staged data of all `var_names` together with their var and proxy details."""
+    var_names_str = ", ".join([f"'{var_name}'" for var_name in var_names])
+
+    var_data_list = []
+    for staged_table, pathway_col in [
+        ("staged_collected_data", ""),
+        ("staged_eucalc_data", "d.pathway, "),
+    ]:
+        sql_cmd = f"""SELECT v.var_name, v.var_unit, d.region_id, r.region_code, d.var_detail_id, {pathway_col}d.value, d.confidence_level_id, d.year, d.proxy_detail_id,
+                            p.disaggregation_proxy, p.proxy_confidence_level, p.disaggregation_binary_criteria
+                        FROM {staged_table} d
+                        JOIN regions r ON d.region_id = r.id
+                        JOIN var_details v ON d.var_detail_id = v.id
+                        JOIN proxy_details p ON d.proxy_detail_id = p.id
+                        WHERE v.var_name IN ({var_names_str})"""
+        var_data = to_compact_dtypes(get_table(sql_cmd), "var_data")
+
+        if len(var_data) > 0:
+            var_data_list.append(var_data)
+
+    if len(var_data_list) == 0:
+        raise ValueError(f"No staged data found for {sorted(var_names)}")
+
+    var_data = pd.concat(var_data_list, ignore_index=True)
+
+    return var_data
+
+
+def disaggregate_batch(var_names, source_resolution, target_resolution) -> dict:
+    """Disaggregate several collected and/or EUCalc vars to the specified spatial resolution
+    and add them to the database.
+
+    The vars are grouped by their disaggregation proxy and binary criterion. Each proxy is
+    solved once and all vars of a group are disaggregated together. EUCalc vars are
+    disaggregated from NUTS0 for all pathways and years. The result of each group is
+    written in memory-bounded chunks, like that of a single var.
+
+    :param var_names: Names of collected and EUCalc vars
+    :type var_names: list
+
+    :param source_resolution: The resolution of the collected vars
+    :type source_resolution: str
+
+    :param target_resolution: The resolution to disaggregate to
+    :type target_resolution: str
+
+    :returns: "bad_proxy" per var name, for vars whose proxy is 0 in all target regions of a source region
+    :rtype: dict
+    """
+    var_data = get_batch_var_data(var_names)
+
+    missing_var_names = set(var_names) - set(var_data["var_name"])
+    if len(missing_var_names) > 0:
+        raise ValueError(f"No staged data found for {sorted(missing_var_names)}")
+
+    invalid_var_names = var_data.loc[
+        ~var_data["disaggregation_proxy"].apply(lambda x: isinstance(x, str)),
+        "var_name",
+    ].unique()
+    if len(invalid_var_names) > 0:
+        raise ValueError(
+            f"One of proxy_equation or same_value_all_regions should be provided for {sorted(invalid_var_names)}"
+        )
+
+    # NOTE: EUCalc data is always at NUTS0
+    var_data["source_resolution"] = np.where(
+        var_data["var_name"].str.startswith("eucalc_"), "NUTS0", source_resolution
+    )
+
+    detail_cols = [
+        "var_name",
+        "var_unit",
+        "source_resolution",
+        "disaggregation_proxy",
+        "proxy_confidence_level",
+        "disaggregation_binary_criteria",
+    ]
+
+    bad_proxy_dict = {}
+    for (
+        _source_resolution,
+        disagg_proxy,
+        disagg_binary_criteria,
+    ), group_data in var_data.groupby(
+        [
+            "source_resolution",
+            "disaggregation_proxy",
+            "disaggregation_binary_criteria",
+        ],
+        dropna=False,
+        sort=False,
+    ):
+        proxy_confidence_level = group_data["proxy_confidence_level"].to_numpy()
+        group_var_data = group_data.drop(columns=detail_cols)
+
+        if disagg_proxy == "no proxy, same value all regions":
+            for final_df in disagg.iter_equally_distributed_data(
+                group_var_data,
+                _source_resolution,
+                target_resolution,
+                proxy_confidence_level,
+            ):
+                add_to_processed_data(final_df)
+
+        else:
+            proxy_data = disagg.get_disaggregation_proxy_data(
+                _source_resolution,
+                target_resolution,
+                disagg_proxy,
+                disagg_binary_criteria,
+            )
+
+            for final_df, is_bad_proxy in disagg.iter_proxy_based_disaggregated_data(
+                group_var_data,
+                proxy_data,
+                proxy_confidence_level,
+                (group_data["var_unit"] == "number").to_numpy(),
+            ):
+                add_to_processed_data(final_df)
+
+                bad_proxy_index = is_bad_proxy.index[is_bad_proxy.to_numpy()]
+                for var_name in group_data.loc[bad_proxy_index, "var_name"].unique():
+                    bad_proxy_dict[var_name] = "bad_proxy"
+
+    return bad_proxy_dict
@@ -0,0 +1,182 @@
+"""In-database disaggregation backend.
+
+With ``ZOOMIN_DISAGG_BACKEND=sql``, the disaggregated values are computed and written by
+a single INSERT ... SELECT over the staged data and the region_hierarchy table, so the
+target rows (millions for climate vars at LAU) never pass through Python. Proxy
+equations and binary criteria are still solved in Python; only the solved proxy values
+at the target resolution are sent to the database.
+"""
+import os
+from uuid import uuid4
+import pandas as pd
+from zoomin import db_access
+from zoomin import region_hierarchy
+from zoomin import staging
+
+# columns that are passed on from the staged data, in addition to the common ones
+EXTRA_COLUMNS = {
+    "staged_collected_data": [],
+    "staged_climate_data": ["climate_experiment"],
+    "staged_eucalc_data": ["pathway"],
+}
+
+
+def is_sql_backend() -> bool:
+    """Return True if disaggregation runs in the database (ZOOMIN_DISAGG_BACKEND=sql)."""
+    return os.environ.get("ZOOMIN_DISAGG_BACKEND", "pandas").lower() == "sql"
+
+
+def _get_insert_columns(staged_table: str) -> str:
+    columns = ["region_id", "var_detail_id", "confidence_level_id", "proxy_detail_id"]
+    return ", ".join(columns + EXTRA_COLUMNS[staged_table] + ["year", "value"])
+
+
+def _get_var_detail_ids(staged_table: str, where_clause: str) -> list:
+    var_detail_ids = db_access.get_values(
+        f"SELECT DISTINCT d.var_detail_id FROM {staged_table} d WHERE {where_clause}"
+    )
+    return var_detail_ids if isinstance(var_detail_ids, list) else [var_detail_ids]
+
+
+def distribute_data_equally(
+    staged_table,
+    where_clause,
+    source_resolution,
+    target_resolution,
+    proxy_confidence_level,
+):
+    """Assign the value of each source region to all its target regions in the database.
+
+    :param staged_table: Table with the source data
+    :type staged_table: str
+
+    :param where_clause: Condition selecting the source rows. The staged table is aliased as d
+    :type where_clause: str
+
+    :param proxy_confidence_level: Confidence level of the proxy
+    :type proxy_confidence_level: int
+    """
+    region_hierarchy.ensure_region_hierarchy()
+    db_access.invalidate_processed_data(_get_var_detail_ids(staged_table, where_clause))
+
+    parent_col = region_hierarchy.get_parent_column(source_resolution)
+    extra_cols = "".join(f"d.{col}, " for col in EXTRA_COLUMNS[staged_table])
+
+    db_access.execute_sql_cmd(
+        f"""INSERT INTO {staging.get_target_table()}
+            ({_get_insert_columns(staged_table)})
+        SELECT
+            h.region_id,
+            d.var_detail_id,
+            LEAST(d.confidence_level_id, {int(proxy_confidence_level)}),
+            d.proxy_detail_id,
+            {extra_cols}d.year,
+            d.value
+        FROM {staged_table} d
+        JOIN region_hierarchy h
+            ON h.{parent_col} = d.region_id AND h.resolution = '{target_resolution}'
+        WHERE {where_clause};"""
+    )
+
+
+def perform_proxy_based_disaggregation(
+    proxy_data: pd.DataFrame,
+    staged_table,
+    where_clause,
+    proxy_confidence_level,
+    is_number,
+) -> bool:
+    """Disaggregate the source rows in the database, based on the prepared `proxy_data`.
+
+    The share of each target region is its proxy value divided by the sum of the proxy
+    values in its source region, computed with window functions. If that sum is 0, the
+    value is distributed equally.
+
+    :param proxy_data: Proxy values at the target resolution with the columns region_id,
+        match_region_id, confidence_level_id and value
+    :type proxy_data: pd.DataFrame
+
+    :param staged_table: Table with the source data
+    :type staged_table: str
+
+    :param where_clause: Condition selecting the source rows. The staged table is aliased as d
+    :type where_clause: str
+
+    :param proxy_confidence_level: Confidence level of the proxy
+    :type proxy_confidence_level: int
+
+    :param is_number: Whether the values should be truncated to whole numbers
+    :type is_number: bool
+
+    :returns: True if the proxy is 0 in (or missing for) all target regions of a source region
+    :rtype: bool
+    """
+    db_access.invalidate_processed_data(_get_var_detail_ids(staged_table, where_clause))
+
+    extra_cols = "".join(f"d.{col}, " for col in EXTRA_COLUMNS[staged_table])
+    value = "d.value * s.share"
+    if is_number:
+        value = f"TRUNC({value})"
+
+    proxy_table = f"tmp_proxy_{uuid4().hex[:12]}"
+
+    with db_access.db_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""CREATE TEMP TABLE {proxy_table} (
+                    region_id integer,
+                    match_region_id integer,
+                    confidence_level_id integer,
+                    value double precision
+                ) ON COMMIT DROP;"""
+            )
+            db_access.copy_with_cursor(
+                cursor,
+                proxy_data,
+                proxy_table,
+                {
+                    "region_id": "int4",
+                    "match_region_id": "int4",
+                    "confidence_level_id": "int4",
+                    "value": "float8",
+                },
+            )
+
+            shares = f"""SELECT
+                    region_id,
+                    match_region_id,
+                    confidence_level_id,
+                    CASE
+                        WHEN SUM(value) OVER w = 0 THEN 1.0 / COUNT(*) OVER w
+                        ELSE value / SUM(value) OVER w
+                    END AS share,
+                    SUM(value) OVER w = 0 AS is_bad_proxy
+                FROM {proxy_table}
+                WINDOW w AS (PARTITION BY match_region_id)"""
+
+            cursor.execute(
+                f"""INSERT INTO {staging.get_target_table()}
+                    ({_get_insert_columns(staged_table)})
+                SELECT
+                    s.region_id,
+                    d.var_detail_id,
+                    LEAST(s.confidence_level_id, d.confidence_level_id, {int(proxy_confidence_level)}),
+                    d.proxy_detail_id,
+                    {extra_cols}d.year,
+                    {value}
+                FROM {staged_table} d
+                JOIN ({shares}) s ON s.match_region_id = d.region_id
+                WHERE {where_clause};"""
+            )
+
+            # source regions whose proxy is 0 in all target regions or that have no target regions
+            cursor.execute(
+                f"""SELECT EXISTS (
+                    SELECT 1 FROM {staged_table} d
+                    LEFT JOIN ({shares}) s ON s.match_region_id = d.region_id
+                    WHERE ({where_clause}) AND (s.is_bad_proxy OR s.region_id IS NULL)
+                );"""
+            )
+            is_bad_proxy = cursor.fetchone()[0]
+
+    return is_bad_proxy
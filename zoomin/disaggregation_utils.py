@@ -1,92 +1,122 @@
-import re
-import warnings
 import numpy as np
 import pandas as pd
-from zoomin.db_access import get_proxy_data
+from zoomin.db_access import get_proxy_data, get_table
+from zoomin.proxy_cache import proxy_cache
+from zoomin import proxy_snapshot
+from zoomin import proxy_equation
+from zoomin import region_hierarchy
+from zoomin.dtypes import to_compact_dtypes
+from zoomin.region_catalogue import ChildIndex
+
+
+def get_normalized_proxy_data(var_name: str, target_resolution: str) -> pd.DataFrame:
+    """Return proxy data of `var_name` at `target_resolution` with the value column
+    normalized by its maximum. The normalized data is served from the process-wide
+    proxy cache if possible, else from the on-disk snapshot if present, else from the DB.
+    """
+    proxy_data = proxy_cache.get(var_name, target_resolution)
+
+    if proxy_data is None:
+        proxy_data = proxy_snapshot.read_snapshot(var_name, target_resolution)
+        if proxy_data is None:
+            proxy_data = get_proxy_data(var_name, target_resolution)
 
-# number of chars to consider based on a resolution
-char_dict = {"NUTS3": 5, "NUTS2": 4, "NUTS1": 3, "NUTS0": 2}
+        var_detail_ids = proxy_data.pop("var_detail_id").unique()
+
+        # If there is no variance in data, we cannot normailize it. So everything is just set to 0
+        if len(proxy_data["value"].unique()) == 1:
+            proxy_data["value"] = 0
+        else:
+            proxy_data["value"] = (
+                proxy_data["value"] / proxy_data["value"].max()
+            )  # normalizing this way to retain true 0s in the normalized data
 
+        proxy_data = to_compact_dtypes(proxy_data, "proxy_data")
 
-def is_float(s):
-    try:
-        float(s)
-        return True
-    except ValueError:
-        return False
+        # NOTE: empty data is not cached, as it could not be invalidated by var_detail_id
+        if len(var_detail_ids) == 1:
+            proxy_cache.put(
+                var_name, target_resolution, proxy_data, var_detail_ids[0].item()
+            )
 
+    return proxy_data
 
-def solve_proxy_equation(equation: str, target_resolution):
-    # TODO: doctrings
 
-    # read in all the proxy data and normalise value column before performing arithmetic operations
-    operators = r"[\+\-\*\%\(\)\/\n]"
+def export_proxy_snapshots(target_resolution: str) -> None:
+    """Export the data of all variables used in proxy equations or binary disaggregation
+    criteria at `target_resolution` as on-disk snapshots. Unchanged snapshots are kept.
+    Does nothing if snapshots are disabled.
+    """
+    if proxy_snapshot.get_snapshot_dir() is None:
+        return
 
-    # Splitting the string using the defined pattern
-    split_result = re.split(operators, equation)
+    proxy_details = get_table(
+        "SELECT disaggregation_proxy, disaggregation_binary_criteria FROM proxy_details"
+    )
 
-    # Filtering out empty strings and digits
-    var_list = [
-        part.strip()
-        for part in split_result
-        if part.strip() and not part.strip().isdigit() and not is_float(part.strip())
+    equations = [
+        disagg_proxy
+        for disagg_proxy in proxy_details["disaggregation_proxy"].dropna()
+        if disagg_proxy != "no proxy, same value all regions"
+    ]
+    equations += [
+        binary_criteria.split(">=")[0]
+        for binary_criteria in proxy_details["disaggregation_binary_criteria"].dropna()
     ]
 
-    result = None
+    var_names = set()
+    for equation in equations:
+        try:
+            var_names.update(proxy_equation.get_var_names(equation))
+        except proxy_equation.ProxyEquationError:
+            # NOTE: invalid equations are reported by the jobs that use them
+            continue
 
-    for var_name in var_list:
+    for var_name in sorted(var_names):
         proxy_data = get_proxy_data(var_name, target_resolution)
+        proxy_snapshot.write_snapshot(var_name, target_resolution, proxy_data)
 
-        # If there is no variance in data, we cannot normailize it. So everything is just set to 0
-        if len(proxy_data["value"].unique()) == 1:
-            proxy_data["value"] = 0
-        else:
-            proxy_data["value"] = (
-                proxy_data["value"] / proxy_data["value"].max()
-            )  # normalizing this way to retain true 0s in the normalized data
 
-        proxy_data.rename(columns={"value": var_name}, inplace=True)
+def solve_proxy_equations(equations: list, target_resolution: str) -> dict:
+    """Solve several proxy equations at `target_resolution` in one batch.
+    Each variable is loaded once and sub-terms shared by the equations are evaluated once.
 
-        if result is None:
-            result = proxy_data
-        else:
-            result = pd.merge(result, proxy_data, on=["region_code", "region_id"])
-
-            # merged confidence_level_id and year
-            # NOTE: depends on the poorest quality rating and most old data. Hence min
-            result["confidence_level_id"] = result[
-                ["confidence_level_id_x", "confidence_level_id_y"]
-            ].min(axis=1)
-            result["year"] = result[["year_x", "year_y"]].min(axis=1)
-
-            result.drop(
-                columns=[
-                    "confidence_level_id_x",
-                    "confidence_level_id_y",
-                    "year_x",
-                    "year_y",
-                ],
-                inplace=True,
-            )
+    :param equations: Proxy equations
+    :type equations: list
 
-    equation = equation.replace("\n", " ")
+    :param target_resolution: The resolution of the proxy data
+    :type target_resolution: str
+
+    :returns: Dataframe with the columns region_code, region_id, confidence_level_id, year and value per equation
+    :rtype: dict
+    """
+    return proxy_equation.solve_equations(
+        equations,
+        lambda var_name: get_normalized_proxy_data(var_name, target_resolution),
+    )
 
-    result = result.eval(f"value = {equation}")
-    result["value"] = result["value"].replace([np.inf, np.nan], 0)
 
-    result = result[
-        ["region_code", "region_id", "confidence_level_id", "year", "value"]
-    ].copy()
+def solve_proxy_equation(equation: str, target_resolution: str) -> pd.DataFrame:
+    """Solve a proxy equation at `target_resolution`.
 
-    return result
+    :param equation: Proxy equation, for example "population * 0.5 + road_network"
+    :type equation: str
+
+    :param target_resolution: The resolution of the proxy data
+    :type target_resolution: str
+
+    :returns: Dataframe with the columns region_code, region_id, confidence_level_id, year and value
+    :rtype: pd.DataFrame
+    """
+    return solve_proxy_equations([equation], target_resolution)[equation]
 
 
 def match_source_target_resolutions(
     source_resolution: str, proxy_data: pd.DataFrame
 ) -> pd.DataFrame:
     """
-    Add a 'match_region_code' column to `proxy_data`. This column should contain
-    regions from `source_resolution` that correspond to the target regions of `proxy_data`.
+    Add a 'match_region_id' column to `proxy_data`. This column contains the ids of the
+    regions at `source_resolution` that the target regions of `proxy_data` belong to.
 
     :param source_resolution: The resolution of the source value.
     :type source_resolution: str
@@ -97,131 +127,186 @@ def match_source_target_resolutions(
     :returns: proxy_data
     :rtype: pd.DataFrame
     """
-    n_char = char_dict[source_resolution]
-    proxy_data["match_region_code"] = proxy_data["region_code"].str[:n_char]
+    proxy_data["match_region_id"] = region_hierarchy.get_parent_ids(
+        proxy_data["region_id"].to_numpy(), source_resolution
+    )
 
     return proxy_data
 
 
 def apply_binary_disaggregation_criteria(
-    proxy_data, binary_disaggregation_criteria, target_resolution
+    proxy_data, binary_disaggregation_criteria, target_resolution, result=None
 ):
     # TODO: docstring
-    """set the values in the value column of proxy_data to 0 for those region_ids where the corresponding value in the result dataframe is less than the threshold."""
-    out_proxy_data = proxy_data.copy()
+    """set the values in the value column of proxy_data to 0 for those region_ids where the corresponding value in the result dataframe is less than the threshold.
 
+    `result` is the solved equation of the criteria, if it was solved already (e.g. in one
+    batch with the proxy equation).
+    """
     [equation, threshold] = binary_disaggregation_criteria.split(
         ">="
     )  # NOTE: only greater than or equal to is implemented
 
-    result = solve_proxy_equation(equation, target_resolution)
-    result = result[["region_id", "region_code", "value"]].copy()
+    if result is None:
+        result = solve_proxy_equation(equation, target_resolution)
 
-    # Merge the dataframes on 'region_id'
-    merged = proxy_data.merge(result, on=["region_id", "region_code"], how="left")
+    # position of each proxy region in the result, -1 for regions without result
+    positions = pd.Index(result["region_id"]).get_indexer(proxy_data["region_id"])
+    has_result = positions >= 0
 
-    # Update the 'value' column in proxy_data based on the threshold
-    merged.loc[merged["value_y"] < float(threshold), "value_x"] = 0
+    is_below_threshold = np.zeros(len(proxy_data), dtype=bool)
+    is_below_threshold[has_result] = result["value"].to_numpy()[
+        positions[has_result]
+    ] < float(threshold)
 
-    # Drop the extra columns and rename the columns to original names
-    out_proxy_data = merged.drop(columns=["value_y"]).rename(
-        columns={"value_x": "value"}
+    # NOTE: only the value column is replaced, the other columns are shared with proxy_data
+    return proxy_data.assign(
+        value=np.where(is_below_threshold, 0, proxy_data["value"].to_numpy())
     )
 
-    return out_proxy_data
-
-
-def disaggregate_value(
-    target_value, proxy_data
-):  # TODO: add a feature that disaggregates int value resulting in int values again
-    # TODO: docstring
-    disagg_data = proxy_data.copy(deep=True)
-
-    total = disagg_data["value"].values.sum()
-
-    # INFO: If proxy data is 0 in all regions, then the target value cannot
-    # be distributed to target regions. In this case, the provided
-    # proxy is ignored and the target value is equally distributed
-    # to all target regions TODO: raise a warning. Make sure no proxy leads to this situation because
-    # this means that it is a bad_proxy
-    if total == 0:
-        disagg_data = disagg_data.drop(["value"], axis=1)
-        disagg_data["value"] = target_value / len(proxy_data)
-        is_bad_proxy = True
-
-    elif target_value == 0:
-        disagg_data = disagg_data.drop(["value"], axis=1)
-        disagg_data["value"] = 0
-
-        is_bad_proxy = False
-
-    else:
-        # disaggregte
-        disagg_data["share"] = disagg_data["value"] / total
-        disagg_data["disagg_value"] = disagg_data["share"] * target_value
-
-        # clean up columns
-        disagg_data = disagg_data.drop(columns=["value", "share"]).rename(
-            columns={"disagg_value": "value"}
-        )
 
-        is_bad_proxy = False
-
-    return disagg_data, is_bad_proxy
+def get_proxy_index(proxy_data: pd.DataFrame) -> ChildIndex:
+    """Return the positions of the rows of `proxy_data` per source region (match_region_id)."""
+    return ChildIndex(
+        proxy_data["match_region_id"].to_numpy(), np.arange(len(proxy_data))
+    )
 
 
-def disaggregate_data(target_data, proxy_data, proxy_confidence_level):
-    """#TODO: update docstring
+def disaggregate_data(
+    target_data,
+    proxy_data,
+    proxy_confidence_level,
+    proxy_columns=None,
+    proxy_index=None,
+):
+    """
     Spatially disaggregate the passed `target_data` to a target resolution.
     Use `proxy_data` to obtain shares in each target region.
 
-    :param target_data: The data to be disaggregated
-    :type target_data: int/float
+    All source rows are disaggregated in a single pass. The proxy values are
+    summed per source row with a segment sum and each target region gets its
+    share of that sum. If the proxy is 0 in all target regions of a source row,
+    the proxy is ignored, the value is distributed equally to all target regions
+    and the source row is flagged as bad proxy.
+
+    The source rows are matched to their target regions through an index of the proxy
+    rows per source region, and each column of the result is gathered once from the
+    columns of `target_data` and `proxy_data`. The rows of the result are grouped by
+    source row.
+
+    :param target_data: The data to be disaggregated. One row per source region (and year/pathway),
+        identified by region_id
+    :type target_data: pd.DataFrame
 
     :param proxy_data: Data containing values in each target region
     :type proxy_data: pd.DataFrame
 
-    :returns: disagg_data, is_bad_proxy #TODO: check how to write doc string with two return values
+    :param proxy_confidence_level: Confidence level assigned to the proxy. Either a single value
+        or one value per row of `target_data`
+    :type proxy_confidence_level: int or np.ndarray
+
+    :param proxy_columns: Columns of `proxy_data` that are passed on to the result.
+        Defaults to all columns
+    :type proxy_columns: Optional[list]
+
+    :param proxy_index: Positions of the rows of `proxy_data` per source region, see
+        `get_proxy_index`. Built from `proxy_data` if not given
+    :type proxy_index: Optional[ChildIndex]
+
+    :returns: disagg_data, is_bad_proxy. `is_bad_proxy` is a boolean mask aligned with the rows of `target_data`
+    :rtype: pd.DataFrame, pd.Series
     """
-    # disaggregate value in each source region to the corresponding target regions
-    disagg_df_list = []
+    n_sources = len(target_data)
+
+    # pairs of source row and proxy row, for each target region of each source row
+    if proxy_index is None:
+        proxy_index = get_proxy_index(proxy_data)
+    source_pos, proxy_pos = proxy_index.broadcast(target_data["region_id"].to_numpy())
+
+    # per source sums of the proxy values
+    values = proxy_data["value"].to_numpy(dtype=float)[proxy_pos]
+    totals = np.bincount(source_pos, weights=values, minlength=n_sources)
+    counts = np.bincount(source_pos, minlength=n_sources)
+
+    # INFO: If proxy data is 0 in all target regions, then the source value cannot
+    # be distributed based on it. In this case, the provided proxy is ignored and the
+    # value is equally distributed to all target regions. The same applies if there
+    # are no target regions at all.
+    is_bad_proxy = totals == 0
+
+    # NOTE: the shares and values are computed in place of the gathered proxy values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(values, totals[source_pos], out=values)
+    is_bad_proxy_row = is_bad_proxy[source_pos]
+    values[is_bad_proxy_row] = 1 / counts[source_pos[is_bad_proxy_row]]
+    values *= target_data["value"].to_numpy(dtype=float)[source_pos]
+
+    ## Calculate confidence_level_id by taking the minimum of
+    ## confidence_level_id of proxy values, confidence_level_id of target value, and proxy_confidence_level
+    source_confidence_level = np.minimum(
+        target_data["confidence_level_id"].to_numpy(), proxy_confidence_level
+    )
+    confidence_level_id = proxy_data["confidence_level_id"].to_numpy()[proxy_pos]
+    np.minimum(
+        confidence_level_id,
+        source_confidence_level[source_pos],
+        out=confidence_level_id,
+        casting="same_kind",
+    )
 
-    for key_row in target_data.iterrows():
-        row = key_row[1]
-        _proxy_data = proxy_data[proxy_data["match_region_code"] == row["region_code"]]
+    # NOTE: same year, var_detail_id, proxy_detail_id (and pathway) as the target value
+    target_columns = [
+        col
+        for col in ["year", "var_detail_id", "proxy_detail_id", "pathway"]
+        if col in target_data.columns
+    ]
+    if proxy_columns is None:
+        proxy_columns = list(proxy_data.columns)
 
-        is_bad_proxy_list = []
+    disagg_data = {
+        col: proxy_data[col].array.take(proxy_pos)
+        for col in proxy_columns
+        if col not in ["value", "confidence_level_id"] + target_columns
+    }
+    disagg_data["value"] = values
+    disagg_data["confidence_level_id"] = confidence_level_id
+    for col in target_columns:
+        disagg_data[col] = target_data[col].array.take(source_pos)
 
-        disagg_df, is_bad_proxy = disaggregate_value(row["value"], _proxy_data)
-        is_bad_proxy_list.append(is_bad_proxy)
+    is_bad_proxy = pd.Series(is_bad_proxy, index=target_data.index)
 
-        ## Calculate confidence_level_id by taking the minimum of
-        ## confidence_level_id of proxy values, confidence_level_id of target value, and proxy_confidence_level
-        _confidence_level = min(proxy_confidence_level, row["confidence_level_id"])
+    # NOTE: the gathered columns are used as they are, without another copy
+    return pd.DataFrame(disagg_data, copy=False), is_bad_proxy
 
-        disagg_df["confidence_level_id"] = np.minimum(
-            disagg_df[
-                "confidence_level_id"
-            ],  # NOTE: disagg_df had proxy data's quality rating and year at this point
-            _confidence_level,
-        )
 
-        # NOTE: same year as the target value to all
-        target_data_year = row["year"]
-        disagg_df["year"] = target_data_year
+def get_proxy_shares(proxy_data: pd.DataFrame) -> tuple:
+    """Return the share of each target region of `proxy_data` in the value of its source
+    region (match_region_id).
+
+    If the proxy is 0 in all target regions of a source region, the value is shared
+    equally by them.
 
-        # add var_detail_id
-        disagg_df["var_detail_id"] = row["var_detail_id"]
+    :param proxy_data: Data containing values in each target region, matched to the source regions
+    :type proxy_data: pd.DataFrame
 
-        # add proxy_detail_id
-        disagg_df["proxy_detail_id"] = row["proxy_detail_id"]
+    :returns: shares, bad_proxy_source_ids. The ids of the source regions with bad proxy
+    :rtype: np.ndarray, np.ndarray
+    """
+    source_ids, source_pos = np.unique(
+        proxy_data["match_region_id"].to_numpy(), return_inverse=True
+    )
 
-        # add pathway
-        if "pathway" in row.keys():
-            disagg_df["pathway"] = row["pathway"]
+    proxy_values = proxy_data["value"].to_numpy(dtype=float)
+    totals = np.bincount(source_pos, weights=proxy_values, minlength=len(source_ids))
+    counts = np.bincount(source_pos, minlength=len(source_ids))
 
-        disagg_df_list.append(disagg_df)
+    is_bad_proxy = totals == 0
 
-    final_disagg_df = pd.concat(disagg_df_list)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = np.where(
+            is_bad_proxy[source_pos],
+            1 / counts[source_pos],
+            proxy_values / totals[source_pos],
+        )
 
-    return final_disagg_df, is_bad_proxy_list
+    return shares, source_ids[is_bad_proxy]
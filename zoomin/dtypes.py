@@ -0,0 +1,151 @@
+"""Compact dtypes of the dataframes that flow through the disaggregation.
+
+Frames loaded from the DB carry int64 ids, float64 values and strings for the region
+codes. `to_compact_dtypes` converts the columns of `COMPACT_DTYPES` when the data is
+loaded: categorical codes, int32 ids, int8 confidence levels and int16 years. With
+``ZOOMIN_FLOAT32_VALUES=1`` the values are stored as float32, too. Disaggregated values
+are still computed in float64. ``ZOOMIN_COMPACT_DTYPES=0`` keeps the dtypes as loaded.
+
+The memory saved by the conversion is counted per kind of data, see `memory_savings`.
+"""
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+COMPACT_DTYPES = {
+    "region_id": "int32",
+    "match_region_id": "int32",
+    "var_detail_id": "int32",
+    "proxy_detail_id": "int32",
+    "confidence_level_id": "int8",
+    "year": "int16",
+    "region_code": "category",
+    "match_region_code": "category",
+    "pathway": "category",
+    "climate_experiment": "category",
+}
+
+
+def is_compact_dtypes() -> bool:
+    """Return True if loaded data is converted to compact dtypes (ZOOMIN_COMPACT_DTYPES, on by default)."""
+    return int(os.environ.get("ZOOMIN_COMPACT_DTYPES", "1")) == 1
+
+
+def is_float32_values() -> bool:
+    """Return True if values are stored as float32 (ZOOMIN_FLOAT32_VALUES=1)."""
+    return int(os.environ.get("ZOOMIN_FLOAT32_VALUES", "0")) == 1
+
+
+def _can_convert(column: pd.Series, dtype: str) -> bool:
+    if dtype == "category":
+        return True
+
+    # NOTE: columns with missing values or values out of range keep their dtype
+    if column.dtype.kind not in "iuf" or column.isna().any():
+        return False
+    if len(column) == 0:
+        return True
+
+    dtype_info = np.iinfo(dtype)
+    return column.min() >= dtype_info.min and column.max() <= dtype_info.max
+
+
+class MemorySavings:
+    """Memory of the loaded data before and after the conversion to compact dtypes,
+    per kind of data (e.g. "proxy_data").
+    """
+
+    def __init__(self) -> None:
+        self._bytes = {}
+        self._lock = threading.Lock()
+
+    def record(self, label: str, bytes_before: int, bytes_after: int) -> None:
+        with self._lock:
+            totals = self._bytes.setdefault(label, [0, 0])
+            totals[0] += bytes_before
+            totals[1] += bytes_after
+
+    def clear(self) -> None:
+        with self._lock:
+            self._bytes.clear()
+
+    def counters(self) -> dict:
+        """Return the bytes before and after the conversion per kind of data. Unlike
+        `stats`, the counters of several processes can be summed.
+        """
+        with self._lock:
+            return {
+                label: {
+                    "bytes_before": int(bytes_before),
+                    "bytes_after": int(bytes_after),
+                }
+                for label, (bytes_before, bytes_after) in self._bytes.items()
+            }
+
+    def stats(self) -> dict:
+        """Return the MB before and after the conversion and the saved share per kind of data."""
+        return get_savings_stats(self.counters())
+
+
+def get_savings_stats(counters: dict) -> dict:
+    """Return the MB before and after the conversion and the saved share per kind of data,
+    from the byte counters of `MemorySavings.counters` (e.g. summed over jobs).
+    """
+    stats = {}
+    for label, label_counters in counters.items():
+        bytes_before = label_counters.get("bytes_before", 0)
+        bytes_after = label_counters.get("bytes_after", 0)
+        stats[label] = {
+            "mb_before": round(bytes_before / 1024**2, 1),
+            "mb_after": round(bytes_after / 1024**2, 1),
+            "saved": round(1 - bytes_after / bytes_before, 3)
+            if bytes_before > 0
+            else 0.0,
+        }
+
+    return stats
+
+
+memory_savings = MemorySavings()
+
+
+def to_compact_dtypes(data: pd.DataFrame, label: str = "data") -> pd.DataFrame:
+    """Return `data` with the columns of `COMPACT_DTYPES` (and value, if
+    `is_float32_values`) converted to compact dtypes. Other columns are kept as they are.
+
+    :param data: Loaded data
+    :type data: pd.DataFrame
+
+    :param label: Kind of data, under which the saved memory is counted
+    :type label: str
+
+    :rtype: pd.DataFrame
+    """
+    if not is_compact_dtypes():
+        return data
+
+    dtypes = {
+        col: dtype
+        for col, dtype in COMPACT_DTYPES.items()
+        if col in data.columns
+        and data[col].dtype != dtype
+        and _can_convert(data[col], dtype)
+    }
+    if (
+        is_float32_values()
+        and "value" in data.columns
+        and data["value"].dtype == np.float64
+    ):
+        dtypes["value"] = "float32"
+
+    if len(dtypes) == 0:
+        return data
+
+    bytes_before = data.memory_usage(deep=True, index=False).sum()
+    data = data.astype(dtypes)
+    memory_savings.record(
+        label, bytes_before, data.memory_usage(deep=True, index=False).sum()
+    )
+
+    return data
@@ -0,0 +1,192 @@
+"""Index advisor and bootstrap for the hot queries of zoomin.
+
+Checks which of the recommended indexes exist, times the query templates of
+``db_access``, the disaggregation and the copy/aggregate modules with
+``EXPLAIN (ANALYZE, FORMAT JSON)`` and optionally creates the missing indexes.
+The templates are built by the SQL builders of these modules, so they time the
+statements the pipeline runs. Each statement is executed inside a savepoint that
+is rolled back, so the INSERT and DELETE templates do not change any data::
+
+    python -m zoomin.index_advisor            # report only
+    python -m zoomin.index_advisor --apply    # create missing indexes, report before/after
+
+NOTE: indexes are created without CONCURRENTLY (not supported on partitioned tables),
+so run ``--apply`` between pipeline runs.
+"""
+import json
+import argparse
+from typing import Any
+from zoomin.db_access import with_db_connection, get_db_name
+from zoomin import db_access
+from zoomin import region_catalogue
+from zoomin import disaggregation_manager
+from zoomin import snakemake_utils
+from zoomin import copy_and_aggregate_collected_data
+from zoomin import copy_and_aggregate_climate_data
+
+# (name, table, indexed columns/expressions)
+RECOMMENDED_INDEXES = [
+    (
+        "idx_processed_data_var_region_year",
+        "processed_data",
+        "var_detail_id, region_id, year, pathway, climate_experiment",
+    ),
+    ("idx_regions_resolution_id", "regions", "resolution, id, region_code"),
+    ("idx_regions_region_code", "regions", "region_code"),
+    ("idx_var_details_var_name", "var_details", "var_name"),
+    ("idx_staged_collected_data_var", "staged_collected_data", "var_detail_id"),
+    ("idx_staged_climate_data_var_year", "staged_climate_data", "var_detail_id, year"),
+    (
+        "idx_staged_eucalc_data_var_pathway_year",
+        "staged_eucalc_data",
+        "var_detail_id, pathway, year",
+    ),
+]
+
+
+def get_query_templates(var_name: str, climate_var_name: str, agg_modes=()) -> dict:
+    """Return the hot queries of zoomin per template name, filled with sample variables.
+
+    The queries are built by the same functions the pipeline uses. The collected data
+    aggregation is only included if `agg_modes` is not empty, like in the pipeline.
+    """
+    templates = {
+        "get_proxy_data": db_access.get_proxy_data_sql(var_name, "LAU"),
+        "get_regions": region_catalogue.REGIONS_SQL,
+        "get_collected_var_data": disaggregation_manager.get_collected_var_sql(
+            disaggregation_manager.get_collected_var_where_clause(var_name)
+        ),
+        "get_climate_var_data": disaggregation_manager.get_climate_var_sql(
+            disaggregation_manager.get_climate_var_where_clause(climate_var_name)
+        ),
+        "clear_rows_from_processed_data": snakemake_utils.get_clear_rows_sql(
+            var_name, "LAU"
+        ),
+    }
+    if len(agg_modes) > 0:
+        templates[
+            "aggregate_collected_data"
+        ] = copy_and_aggregate_collected_data.get_aggregate_collected_data_sql(
+            agg_modes
+        )
+    templates[
+        "aggregate_climate_data"
+    ] = copy_and_aggregate_climate_data.get_aggregate_climate_data_sql(
+        "climate_projection"
+    )
+
+    return templates
+
+
+def _get_sample_var_names(cursor: Any) -> tuple:
+    """Return the var with most rows in staged_collected_data and a climate projection var."""
+    cursor.execute(
+        """SELECT v.var_name FROM staged_collected_data d
+        JOIN var_details v ON d.var_detail_id = v.id
+        GROUP BY v.var_name ORDER BY COUNT(*) DESC LIMIT 1;"""
+    )
+    var_name = cursor.fetchone()
+    cursor.execute(
+        "SELECT var_name FROM var_details WHERE var_name LIKE 'cproj_%%' LIMIT 1;"
+    )
+    climate_var_name = cursor.fetchone()
+
+    return (
+        var_name[0] if var_name is not None else "",
+        climate_var_name[0] if climate_var_name is not None else "",
+    )
+
+
+def _get_existing_indexes(cursor: Any) -> set:
+    cursor.execute("SELECT indexname FROM pg_indexes;")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _explain(cursor: Any, sql_cmd: str) -> dict:
+    # EXPLAIN ANALYZE executes the statement, the changes of INSERT/DELETE are rolled back
+    cursor.execute("SAVEPOINT index_advisor;")
+    try:
+        cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql_cmd}")
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.execute("ROLLBACK TO SAVEPOINT index_advisor;")
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return {
+        "planning_ms": plan[0]["Planning Time"],
+        "execution_ms": plan[0]["Execution Time"],
+        "node": plan[0]["Plan"]["Node Type"],
+    }
+
+
+@with_db_connection()
+def get_missing_indexes(cursor: Any) -> list:
+    """Return the recommended indexes that do not exist yet."""
+    existing = _get_existing_indexes(cursor)
+    return [index for index in RECOMMENDED_INDEXES if index[0] not in existing]
+
+
+@with_db_connection()
+def time_query_templates(cursor: Any) -> dict:
+    """Return planning and execution time of each query template."""
+    var_name, climate_var_name = _get_sample_var_names(cursor)
+    agg_modes = copy_and_aggregate_collected_data.get_agg_modes()
+
+    return {
+        name: _explain(cursor, sql_cmd)
+        for name, sql_cmd in get_query_templates(
+            var_name, climate_var_name, agg_modes
+        ).items()
+    }
+
+
+@with_db_connection()
+def create_indexes(cursor: Any, indexes: list) -> None:
+    """Create `indexes` and update the planner statistics of their tables."""
+    for name, table, columns in indexes:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns});")
+
+    for table in sorted({table for _, table, _ in indexes}):
+        cursor.execute(f"ANALYZE {table};")
+
+
+def _print_timings(timings_before: dict, timings_after: dict = None) -> None:
+    print(f"{'query template':<32}{'before [ms]':>14}{'after [ms]':>14}  plan")
+    for name, before in timings_before.items():
+        after = timings_after[name] if timings_after is not None else None
+        total_before = before["planning_ms"] + before["execution_ms"]
+        total_after = (
+            f"{after['planning_ms'] + after['execution_ms']:>14.2f}"
+            if after is not None
+            else f"{'-':>14}"
+        )
+        node = after["node"] if after is not None else before["node"]
+        print(f"{name:<32}{total_before:>14.2f}{total_after}  {node}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Check and create the indexes of the hot zoomin queries."
+    )
+    parser.add_argument(
+        "--apply", action="store_true", help="Create the missing indexes"
+    )
+    args = parser.parse_args()
+
+    missing_indexes = get_missing_indexes()
+    print(f"{get_db_name()}: {len(missing_indexes)} recommended indexes missing")
+    for name, table, columns in missing_indexes:
+        print(f"  {name} ON {table} ({columns})")
+
+    timings_before = time_query_templates()
+
+    if args.apply and len(missing_indexes) > 0:
+        create_indexes(missing_indexes)
+        _print_timings(timings_before, time_query_templates())
+    else:
+        _print_timings(timings_before)
+
+
+if __name__ == "__main__":
+    main()
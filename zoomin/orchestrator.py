@@ -0,0 +1,298 @@
+"""Run the Snakemake stages of several country DBs in parallel.
+
+The stages of a country run in order (copy_and_agg -> NUTS1 -> NUTS2 -> NUTS3 -> LAU ->
+post disaggregation calculation), while the stages of different countries overlap on a
+pool of workers. Each stage is one Snakemake run with its own connection budget::
+
+    python -m zoomin.orchestrator de es pl --workers 4 --connections-per-country 8
+
+Stages whose final output in ``output_logs`` exists already are skipped (until a stage
+of the country has to run again), so a failed deployment is resumed by running the
+same command again.
+
+Each job of a stage claims one unit of the ``db_connections`` resource, so at most
+``connections-per-country`` jobs of a stage run at once. Every process of a stage, i.e.
+the Snakemake process (which runs the top-level code of the Snakefile) and the process
+of each running job, has a pool of at most ``connections-per-country`` connections
+(``DB_POOL_SIZE``, with ``DB_MAX_OVERFLOW=0``). A job checks out one connection at a
+time unless ``DB_WRITE_CONCURRENCY`` > 1, so a deployment opens about
+``workers * (connections-per-country + 1)`` connections to the DB server. The hard
+bound is ``workers * (connections-per-country + 1) * connections-per-country``.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Optional
+from zoomin.db_access import get_db_name
+
+STAGES = [
+    "copy_and_agg",
+    "nuts1_disagg",
+    "nuts2_disagg",
+    "nuts3_disagg",
+    "lau_disagg",
+    "post_disagg_calculation",
+]
+
+SNAKEMAKE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "snakemake"
+)
+
+# final output of the `all` rule of each stage, relative to the stage directory
+STAGE_MARKERS = {
+    "copy_and_agg": "output_logs/{db_name}/copy_eucalc_data.log",
+    "nuts1_disagg": "output_logs/bad_proxy_{db_name}.json",
+    "nuts2_disagg": "output_logs/bad_proxy_{db_name}.json",
+    "nuts3_disagg": "output_logs/bad_proxy_{db_name}.json",
+    "lau_disagg": "output_logs/bad_proxy_{db_name}.json",
+    "post_disagg_calculation": "output_logs/finished_{db_name}.log",
+}
+
+
+def get_stage_marker(stage: str, db_name: str, snakemake_dir: str = SNAKEMAKE_DIR):
+    """Return the path of the file that marks `stage` of `db_name` as done."""
+    return os.path.join(
+        snakemake_dir, stage, STAGE_MARKERS[stage].format(db_name=db_name)
+    )
+
+
+def is_stage_done(stage: str, db_name: str, snakemake_dir: str = SNAKEMAKE_DIR):
+    """Return True if `stage` of `db_name` finished in an earlier run."""
+    return os.path.isfile(get_stage_marker(stage, db_name, snakemake_dir))
+
+
+def run_snakemake_stage(
+    country: str,
+    stage: str,
+    cores: int = 1,
+    connections: int = 1,
+    mem_mb: Optional[int] = None,
+    snakemake_dir: str = SNAKEMAKE_DIR,
+) -> None:
+    """Run the Snakemake workflow of `stage` for the DB of `country`.
+
+    :param cores: Number of cores Snakemake may use
+    :type cores: int
+
+    :param connections: Number of jobs of the stage that may use the DB at once, and
+        the pool size of each process of the stage
+    :type connections: int
+
+    :param mem_mb: Memory the jobs of the stage may use at once, in MB. Unlimited if None
+    :type mem_mb: Optional[int]
+    """
+    resources = [f"db_connections={connections}"]
+    if mem_mb is not None:
+        resources.append(f"mem_mb={mem_mb}")
+
+    # NOTE: without overflow, the pool of each process is bounded by its size
+    env = dict(
+        os.environ,
+        DB_COUNTRY=country,
+        DB_POOL_SIZE=str(connections),
+        DB_MAX_OVERFLOW="0",
+    )
+    stage_dir = os.path.join(snakemake_dir, stage)
+
+    log_dir = os.path.join(stage_dir, "output_logs", get_db_name(country))
+    os.makedirs(log_dir, exist_ok=True)
+
+    with open(os.path.join(log_dir, "snakemake.log"), "a") as log_file:
+        subprocess.run(
+            [
+                "snakemake",
+                "-c",
+                str(cores),
+                "--resources",
+                *resources,
+            ],
+            cwd=stage_dir,
+            env=env,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+
+
+def run_deployment(
+    countries: list,
+    stages: Optional[list] = None,
+    n_workers: int = 1,
+    run_stage: Callable[[str, str], None] = run_snakemake_stage,
+    is_done: Callable[[str, str], bool] = None,
+) -> dict:
+    """Run `stages` of all `countries`, overlapping the stages of different countries.
+
+    A failed stage stops the remaining stages of its country, the other countries go on.
+
+    :param countries: Countries of the DBs, e.g. ["de", "es"]
+    :type countries: list
+
+    :param stages: Stages to run, in order. Defaults to all stages
+    :type stages: Optional[list]
+
+    :param n_workers: Number of stages that run at the same time
+    :type n_workers: int
+
+    :param run_stage: Function running a stage of a country
+    :type run_stage: Callable
+
+    :param is_done: Function returning True if a stage of a country can be skipped.
+        Defaults to checking the final output of the stage in output_logs
+    :type is_done: Callable
+
+    :returns: Status ("done", "skipped", "failed" or "not run") and duration in seconds
+        per country and stage
+    :rtype: dict
+    """
+    if stages is None:
+        stages = STAGES
+    if is_done is None:
+
+        def is_done(country: str, stage: str) -> bool:
+            return is_stage_done(stage, get_db_name(country))
+
+    timings = {
+        country: {stage: {"status": "not run", "seconds": 0.0} for stage in stages}
+        for country in countries
+    }
+    lock = threading.Lock()
+
+    def run_timed(country: str, stage: str) -> None:
+        start = time.perf_counter()
+        try:
+            run_stage(country, stage)
+        finally:
+            with lock:
+                timings[country][stage]["seconds"] = round(
+                    time.perf_counter() - start, 1
+                )
+
+    # position of the next stage of each country
+    next_stage = {country: 0 for country in countries}
+    # once a stage of a country ran, the outputs of its later stages are outdated
+    has_run = {country: False for country in countries}
+
+    def submit_next(executor: ThreadPoolExecutor, country: str) -> Optional[tuple]:
+        while next_stage[country] < len(stages):
+            stage = stages[next_stage[country]]
+            next_stage[country] += 1
+
+            if not has_run[country] and is_done(country, stage):
+                timings[country][stage]["status"] = "skipped"
+                continue
+
+            has_run[country] = True
+            return executor.submit(run_timed, country, stage), country, stage
+
+        return None
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        running = {}
+        for country in countries:
+            submitted = submit_next(executor, country)
+            if submitted is not None:
+                running[submitted[0]] = submitted[1:]
+
+        while len(running) > 0:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                country, stage = running.pop(future)
+                try:
+                    future.result()
+                except Exception as error:
+                    timings[country][stage]["status"] = "failed"
+                    print(f"{country}: {stage} failed: {error}", file=sys.stderr)
+                    continue
+
+                timings[country][stage]["status"] = "done"
+                submitted = submit_next(executor, country)
+                if submitted is not None:
+                    running[submitted[0]] = submitted[1:]
+
+    return timings
+
+
+def format_timings(timings: dict) -> str:
+    """Return the timings of `run_deployment` as table with one row per country."""
+    stages = list(next(iter(timings.values())).keys()) if len(timings) > 0 else []
+
+    lines = [f"{'country':<10}" + "".join(f"{stage:>26}" for stage in stages)]
+    for country, stage_timings in timings.items():
+        cells = []
+        for stage in stages:
+            timing = stage_timings[stage]
+            if timing["status"] == "done":
+                cells.append(f"{timing['seconds']:>25.1f}s")
+            else:
+                cells.append(f"{timing['status']:>26}")
+        lines.append(f"{country:<10}" + "".join(cells))
+
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run the Snakemake stages of several country DBs in parallel."
+    )
+    parser.add_argument("countries", nargs="+", help="Countries of the DBs, e.g. de")
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Number of stages run at the same time"
+    )
+    parser.add_argument(
+        "--cores-per-country", type=int, default=4, help="Snakemake cores per stage"
+    )
+    parser.add_argument(
+        "--connections-per-country",
+        type=int,
+        default=8,
+        help="DB connections the jobs of a stage may use at once",
+    )
+    parser.add_argument(
+        "--mem-mb-per-country",
+        type=int,
+        default=None,
+        help="Memory the jobs of a stage may use at once, in MB",
+    )
+    parser.add_argument(
+        "--timings-file",
+        default="deployment_timings.json",
+        help="File the timings are written to",
+    )
+    args = parser.parse_args()
+
+    timings = run_deployment(
+        args.countries,
+        args.stages,
+        n_workers=args.workers,
+        run_stage=lambda country, stage: run_snakemake_stage(
+            country,
+            stage,
+            cores=args.cores_per_country,
+            connections=args.connections_per_country,
+            mem_mb=args.mem_mb_per_country,
+        ),
+    )
+
+    print(format_timings(timings))
+    with open(args.timings_file, "w") as fp:
+        json.dump(timings, fp, indent=2)
+
+    if any(
+        timing["status"] == "failed"
+        for stage_timings in timings.values()
+        for timing in stage_timings.values()
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
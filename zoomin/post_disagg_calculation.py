@@ -6,9 +6,20 @@ def execute_post_disagg_calc(cursor, sql_cmd):
     cursor.execute(sql_cmd)
 
 
-def perform_post_disagg_calculation(var_name: str):
+def perform_post_disagg_calculation(var_name: str, replace_existing: bool = False):
+    """Calculate `var_name` with its calculation_sql_cmd.
 
+    :param replace_existing: If True, previously calculated rows of `var_name` are deleted
+        in the same transaction. A failed calculation therefore leaves processed_data unchanged
+    :type replace_existing: bool
+    """
     sql_cmd = get_col_values(
         "var_details", "calculation_sql_cmd", {"var_name": var_name}
     )
+
+    if replace_existing:
+        sql_cmd = f"""DELETE FROM processed_data 
+                    WHERE var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}');
+                    {sql_cmd}"""
+
     execute_post_disagg_calc(sql_cmd)
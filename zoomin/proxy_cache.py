@@ -0,0 +1,110 @@
+"""Process-wide in-memory cache of normalized proxy data.
+
+The cache lives as long as the process, i.e. one Snakemake job, and saves the repeated
+reads of the proxies of that job (e.g. the vars of a proxy equation and its binary
+criteria). Parallel jobs run in separate processes and do not share it. Reads across
+jobs are saved by the on-disk snapshots of `proxy_snapshot`, which are exported once
+per stage.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+import pandas as pd
+
+
+class ProxyCache:
+    """LRU cache of normalized proxy data keyed by (var_name, resolution).
+
+    Entries remember the var_detail_id they were read for, so that they can be
+    invalidated both by var name and by var_detail_id when processed_data changes.
+    """
+
+    def __init__(self, maxsize: int = 128) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, var_name: str, resolution: str) -> Optional[pd.DataFrame]:
+        """Return a copy of the cached proxy data or None if it is not cached."""
+        key = (var_name, resolution)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+
+        return entry[1].copy()
+
+    def put(
+        self,
+        var_name: str,
+        resolution: str,
+        proxy_data: pd.DataFrame,
+        var_detail_id: Optional[int] = None,
+    ) -> None:
+        """Add proxy data to the cache, evicting the least recently used entry if full."""
+        if self.maxsize <= 0:
+            return
+
+        key = (var_name, resolution)
+
+        with self._lock:
+            self._entries[key] = (var_detail_id, proxy_data.copy())
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(
+        self,
+        var_names: Optional[Iterable[str]] = None,
+        var_detail_ids: Optional[Iterable[int]] = None,
+    ) -> None:
+        """Drop all entries of the given var names and/or var_detail_ids."""
+        var_names = set(var_names) if var_names is not None else set()
+        var_detail_ids = (
+            {int(_id) for _id in var_detail_ids}
+            if var_detail_ids is not None
+            else set()
+        )
+
+        with self._lock:
+            stale_keys = [
+                key
+                for key, (var_detail_id, _) in self._entries.items()
+                if key[0] in var_names or var_detail_id in var_detail_ids
+            ]
+            for key in stale_keys:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current size of the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+
+proxy_cache = ProxyCache(maxsize=int(os.environ.get("PROXY_CACHE_SIZE", "128")))
@@ -0,0 +1,233 @@
+"""Parsing and vectorized evaluation of proxy equations.
+
+A proxy equation such as ``population * 0.5 + employment_in_construction / road_network``
+is parsed once into an abstract syntax tree. All operands are aligned to one region index as
+NumPy arrays and the equation is evaluated in a single vectorized pass. Sub-terms that appear
+in several equations of a batch (e.g. the proxy equation and the binary criterion of a var)
+are evaluated only once.
+
+The grammar is that of arithmetic Python expressions: variable names, numbers and the
+operators ``+ - * / % **``.
+"""
+import ast
+from functools import lru_cache
+from typing import Callable, Iterable
+import numpy as np
+import pandas as pd
+
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Mod: np.mod,
+    # NOTE: float_power, as integer constants to negative powers are invalid with np.power
+    ast.Pow: np.float_power,
+}
+
+UNARY_OPERATORS = {
+    ast.UAdd: np.positive,
+    ast.USub: np.negative,
+}
+
+
+class ProxyEquationError(ValueError):
+    """Raised if a proxy equation is invalid or its variables cannot be resolved."""
+
+
+def _validate_node(node: ast.AST, equation: str) -> None:
+    if isinstance(node, ast.BinOp):
+        if type(node.op) not in BINARY_OPERATORS:
+            raise ProxyEquationError(
+                f"Operator {type(node.op).__name__} is not supported in proxy equation '{equation}'"
+            )
+        _validate_node(node.left, equation)
+        _validate_node(node.right, equation)
+
+    elif isinstance(node, ast.UnaryOp):
+        if type(node.op) not in UNARY_OPERATORS:
+            raise ProxyEquationError(
+                f"Operator {type(node.op).__name__} is not supported in proxy equation '{equation}'"
+            )
+        _validate_node(node.operand, equation)
+
+    elif isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ProxyEquationError(
+                f"Constant {node.value!r} is not supported in proxy equation '{equation}'"
+            )
+
+    elif not isinstance(node, ast.Name):
+        raise ProxyEquationError(
+            f"Expression {ast.unparse(node)} is not supported in proxy equation '{equation}'"
+        )
+
+
+@lru_cache(maxsize=None)
+def parse_equation(equation: str) -> ast.expr:
+    """Parse and validate a proxy equation. The result is cached per equation string."""
+    try:
+        tree = ast.parse(equation.replace("\n", " ").strip(), mode="eval")
+    except SyntaxError as error:
+        raise ProxyEquationError(
+            f"Proxy equation '{equation}' could not be parsed: {error.msg}"
+        ) from error
+
+    _validate_node(tree.body, equation)
+
+    return tree.body
+
+
+def get_var_names(equation: str) -> list:
+    """Return the names of the variables in a proxy equation in order of appearance."""
+    names = [
+        node
+        for node in ast.walk(parse_equation(equation))
+        if isinstance(node, ast.Name)
+    ]
+    names.sort(key=lambda node: node.col_offset)
+
+    return list(dict.fromkeys(node.id for node in names))
+
+
+class EquationEvaluator:
+    """Evaluate a batch of proxy equations on a shared region index.
+
+    :param var_data: Proxy data per variable name. Each dataframe must contain the
+        columns region_id, region_code, value, year and confidence_level_id
+    :type var_data: dict
+    """
+
+    def __init__(self, var_data: dict) -> None:
+        for var_name, data in var_data.items():
+            if len(data) == 0:
+                raise ProxyEquationError(
+                    f"{var_name} not found. Check your proxy equation"
+                )
+            if data["region_id"].duplicated().any():
+                raise ProxyEquationError(
+                    f"{var_name} has more than one value per region and cannot be used in a proxy equation"
+                )
+
+        all_regions = pd.concat(
+            [data[["region_id", "region_code"]] for data in var_data.values()]
+        ).drop_duplicates("region_id")
+        all_regions = all_regions.sort_values("region_id")
+
+        self.region_ids = all_regions["region_id"].to_numpy()
+        self.region_codes = all_regions["region_code"].to_numpy()
+
+        n_regions = len(self.region_ids)
+        self._operands = {}
+        for var_name, data in var_data.items():
+            positions = np.searchsorted(self.region_ids, data["region_id"].to_numpy())
+
+            operand = {}
+            for col in ["value", "year", "confidence_level_id"]:
+                operand[col] = np.full(n_regions, np.nan)
+                operand[col][positions] = data[col].to_numpy(dtype=float)
+
+            operand["is_present"] = np.zeros(n_regions, dtype=bool)
+            operand["is_present"][positions] = True
+
+            self._operands[var_name] = operand
+
+        # evaluated sub-terms, shared by all equations of the batch
+        self._terms: dict = {}
+
+    def _evaluate_node(self, node: ast.expr) -> np.ndarray:
+        if isinstance(node, ast.Constant):
+            return node.value
+
+        if isinstance(node, ast.Name):
+            return self._operands[node.id]["value"]
+
+        key = ast.dump(node)
+        if key not in self._terms:
+            if isinstance(node, ast.BinOp):
+                self._terms[key] = BINARY_OPERATORS[type(node.op)](
+                    self._evaluate_node(node.left), self._evaluate_node(node.right)
+                )
+            else:
+                self._terms[key] = UNARY_OPERATORS[type(node.op)](
+                    self._evaluate_node(node.operand)
+                )
+
+        return self._terms[key]
+
+    def evaluate(self, equation: str) -> pd.DataFrame:
+        """Return the result of `equation` in each region where all its variables have data.
+
+        :returns: Dataframe with the columns region_code, region_id, confidence_level_id, year and value
+        :rtype: pd.DataFrame
+        """
+        var_names = get_var_names(equation)
+
+        for var_name in var_names:
+            if var_name not in self._operands:
+                raise ProxyEquationError(
+                    f"{var_name} not found. Check your proxy equation"
+                )
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = self._evaluate_node(parse_equation(equation))
+
+        value = np.broadcast_to(value, self.region_ids.shape)
+
+        operands = [self._operands[var_name] for var_name in var_names]
+        is_present = np.logical_and.reduce([op["is_present"] for op in operands])
+
+        # NOTE: depends on the poorest quality rating and most old data. Hence min
+        confidence_level_id = np.min(
+            [op["confidence_level_id"] for op in operands], axis=0
+        )
+        year = np.min([op["year"] for op in operands], axis=0)
+
+        value = np.where(np.isfinite(value), value, 0)
+
+        result = pd.DataFrame(
+            {
+                "region_code": self.region_codes[is_present],
+                "region_id": self.region_ids[is_present],
+                "confidence_level_id": confidence_level_id[is_present].astype(int),
+                "year": year[is_present].astype(int),
+                "value": value[is_present],
+            }
+        )
+
+        return result
+
+
+def solve_equations(
+    equations: Iterable[str], load_var: Callable[[str], pd.DataFrame]
+) -> dict:
+    """Solve several proxy equations at once.
+
+    :param equations: Proxy equations
+    :type equations: Iterable[str]
+
+    :param load_var: Function returning the (normalized) proxy data of a variable
+    :type load_var: Callable
+
+    :returns: Result per equation
+    :rtype: dict
+    """
+    equations = list(dict.fromkeys(equations))
+
+    for equation in equations:
+        if len(get_var_names(equation)) == 0:
+            raise ProxyEquationError(
+                f"Proxy equation '{equation}' does not contain any variable"
+            )
+
+    var_names = list(
+        dict.fromkeys(
+            var_name for equation in equations for var_name in get_var_names(equation)
+        )
+    )
+
+    evaluator = EquationEvaluator(
+        {var_name: load_var(var_name) for var_name in var_names}
+    )
+
+    return {equation: evaluator.evaluate(equation) for equation in equations}
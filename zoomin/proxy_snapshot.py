@@ -0,0 +1,145 @@
+"""On-disk Parquet snapshots of proxy data shared by short-lived disaggregation jobs.
+
+The snapshots are stored as ``{PROXY_SNAPSHOT_DIR}/{resolution}/{var_detail_id}__{var_name}.parquet``.
+Snapshots are disabled if the environment variable ``PROXY_SNAPSHOT_DIR`` is not set.
+"""
+import os
+import glob
+import hashlib
+from typing import Iterable, Optional
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CONTENT_HASH_KEY = b"zoomin.content_hash"
+
+
+def get_snapshot_dir() -> Optional[str]:
+    """Return the snapshot directory or None if snapshots are disabled."""
+    return os.environ.get("PROXY_SNAPSHOT_DIR")
+
+
+def get_content_hash(proxy_data: pd.DataFrame) -> str:
+    """Return a hash of the rows in `proxy_data`, independent of their order."""
+    row_hashes = pd.util.hash_pandas_object(
+        proxy_data.sort_values("region_id"), index=False
+    )
+    return hashlib.sha256(row_hashes.to_numpy().tobytes()).hexdigest()
+
+
+def _find_snapshot_files(resolution: str, pattern: str) -> list:
+    snapshot_dir = get_snapshot_dir()
+    if snapshot_dir is None:
+        return []
+
+    return glob.glob(os.path.join(glob.escape(snapshot_dir), resolution, pattern))
+
+
+def _find_var_snapshot_files(var_name: str, resolution: str) -> list:
+    # the pattern also matches vars whose name ends in "__{var_name}", so the part
+    # of the file name after the var_detail_id has to match exactly
+    file_name = f"{var_name}.parquet"
+    return [
+        snapshot_file
+        for snapshot_file in _find_snapshot_files(
+            resolution, f"*__{glob.escape(file_name)}"
+        )
+        if os.path.basename(snapshot_file).split("__", 1)[1] == file_name
+    ]
+
+
+def _get_snapshot_file(var_name: str, resolution: str) -> Optional[str]:
+    snapshot_files = _find_var_snapshot_files(var_name, resolution)
+
+    if len(snapshot_files) == 1:
+        return snapshot_files[0]
+    return None
+
+
+def read_snapshot_content_hash(var_name: str, resolution: str) -> Optional[str]:
+    """Return the content hash stored with the snapshot of `var_name` or None if there is none."""
+    snapshot_file = _get_snapshot_file(var_name, resolution)
+    if snapshot_file is None:
+        return None
+
+    metadata = pq.read_schema(snapshot_file).metadata or {}
+    content_hash = metadata.get(CONTENT_HASH_KEY)
+
+    return content_hash.decode() if content_hash is not None else None
+
+
+def read_snapshot(var_name: str, resolution: str) -> Optional[pd.DataFrame]:
+    """Return the memory-mapped snapshot of `var_name` at `resolution` or None if there is none."""
+    snapshot_file = _get_snapshot_file(var_name, resolution)
+    if snapshot_file is None:
+        return None
+
+    try:
+        table = pq.read_table(snapshot_file, memory_map=True)
+    except FileNotFoundError:
+        # invalidated by another job in the meantime
+        return None
+
+    return table.to_pandas()
+
+
+def write_snapshot(var_name: str, resolution: str, proxy_data: pd.DataFrame) -> bool:
+    """Write `proxy_data` of `var_name` as snapshot, unless an identical one exists already.
+
+    :returns: True if the snapshot was (re)written
+    :rtype: bool
+    """
+    snapshot_dir = get_snapshot_dir()
+    if snapshot_dir is None:
+        return False
+
+    if len(proxy_data) == 0:
+        invalidate_snapshots(var_names=[var_name], resolution=resolution)
+        return False
+
+    content_hash = get_content_hash(proxy_data)
+    if read_snapshot_content_hash(var_name, resolution) == content_hash:
+        return False
+
+    invalidate_snapshots(var_names=[var_name], resolution=resolution)
+
+    var_detail_id = proxy_data["var_detail_id"].iloc[0]
+    resolution_dir = os.path.join(snapshot_dir, resolution)
+    os.makedirs(resolution_dir, exist_ok=True)
+    snapshot_file = os.path.join(resolution_dir, f"{var_detail_id}__{var_name}.parquet")
+
+    table = pa.Table.from_pandas(proxy_data, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), CONTENT_HASH_KEY: content_hash.encode()}
+    )
+
+    # write to a temporary file first, so that readers never see partial files
+    tmp_file = f"{snapshot_file}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp_file)
+    os.replace(tmp_file, snapshot_file)
+
+    return True
+
+
+def invalidate_snapshots(
+    var_names: Optional[Iterable[str]] = None,
+    var_detail_ids: Optional[Iterable[int]] = None,
+    resolution: str = "*",
+) -> None:
+    """Remove the snapshots of the given var names and/or var_detail_ids. By default at all resolutions."""
+    snapshot_files = [
+        snapshot_file
+        for var_name in var_names or []
+        for snapshot_file in _find_var_snapshot_files(var_name, resolution)
+    ]
+    snapshot_files += [
+        snapshot_file
+        for _id in var_detail_ids or []
+        for snapshot_file in _find_snapshot_files(resolution, f"{int(_id)}__*.parquet")
+    ]
+
+    for snapshot_file in snapshot_files:
+        try:
+            os.remove(snapshot_file)
+        except FileNotFoundError:
+            pass
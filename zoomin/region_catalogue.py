@@ -0,0 +1,215 @@
+"""Process-wide catalogue of the regions table.
+
+The regions do not change while the pipeline runs, but the same region list used to be
+read from the DB for every equally distributed variable. The catalogue is loaded once
+per process, from the file ``REGION_CATALOGUE_FILE`` (parquet) if it is set and exists,
+else from the DB. In the latter case the file is written, so that later processes can
+skip the query.
+
+Region codes are categorical. The target regions of each source region (e.g. the LAU
+regions of a NUTS3 region) are indexed once per pair of resolutions from the parent ids
+of the region hierarchy, see `ChildIndex`.
+"""
+import os
+import threading
+from typing import Optional
+import numpy as np
+import pandas as pd
+from zoomin import db_access
+from zoomin import region_hierarchy
+
+
+class ChildIndex:
+    """Child regions of each parent region in compressed sparse row layout: the ids of
+    the children of ``parent_ids[i]`` are ``child_ids[offsets[i]:offsets[i + 1]]``.
+
+    :param parent_ids: Id of the parent of each child region. -1 for children without parent
+    :type parent_ids: np.ndarray
+
+    :param child_ids: Id of each child region
+    :type child_ids: np.ndarray
+    """
+
+    def __init__(self, parent_ids, child_ids) -> None:
+        parent_ids = np.asarray(parent_ids, dtype=np.int64)
+        child_ids = np.asarray(child_ids, dtype=np.int64)
+
+        has_parent = parent_ids >= 0
+        order = np.argsort(parent_ids[has_parent], kind="stable")
+
+        self.child_ids = child_ids[has_parent][order]
+        self.parent_ids, counts = np.unique(
+            parent_ids[has_parent][order], return_counts=True
+        )
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def _get_bounds(self, parent_ids) -> tuple:
+        parent_ids = np.asarray(parent_ids, dtype=np.int64)
+        if len(self.parent_ids) == 0:
+            empty = np.zeros(len(parent_ids), dtype=np.int64)
+            return empty, empty
+
+        positions = np.searchsorted(self.parent_ids, parent_ids)
+        positions = np.minimum(positions, len(self.parent_ids) - 1)
+        is_known = self.parent_ids[positions] == parent_ids
+
+        starts = np.where(is_known, self.offsets[positions], 0)
+        counts = np.where(is_known, self.offsets[positions + 1] - starts, 0)
+
+        return starts, counts
+
+    def get_child_counts(self, parent_ids) -> np.ndarray:
+        """Return the number of children of each of `parent_ids`."""
+        return self._get_bounds(parent_ids)[1]
+
+    def broadcast(self, parent_ids) -> tuple:
+        """Repeat each of `parent_ids` once per child.
+
+        :returns: row_positions, child_ids. The position in `parent_ids` and the id of
+            each child, grouped by parent in the order of `parent_ids`. Parents without
+            children are left out
+        :rtype: np.ndarray, np.ndarray
+        """
+        starts, counts = self._get_bounds(parent_ids)
+
+        row_positions = np.repeat(np.arange(len(counts)), counts)
+        # position of each child within the children of its parent
+        child_offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+
+        return row_positions, self.child_ids[np.repeat(starts, counts) + child_offsets]
+
+
+class RegionCatalogue:
+    """Regions per resolution.
+
+    :param regions: Data with the columns id, region_code and resolution
+    :type regions: pd.DataFrame
+    """
+
+    def __init__(self, regions: pd.DataFrame) -> None:
+        self._regions = {}
+
+        for resolution, resolution_regions in regions.groupby("resolution", sort=False):
+            self._regions[resolution] = pd.DataFrame(
+                {
+                    "id": resolution_regions["id"].to_numpy(),
+                    "region_code": pd.Categorical(
+                        resolution_regions["region_code"].astype(str).to_numpy()
+                    ),
+                }
+            )
+
+        self._child_indexes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def resolutions(self) -> list:
+        return list(self._regions)
+
+    def get_regions(self, resolution: str) -> pd.DataFrame:
+        """Return the regions at `resolution` with the columns id and region_code.
+
+        NOTE: the returned dataframe shares its data with the catalogue. Adding or
+        replacing columns is fine, modifying values in place is not.
+        """
+        if resolution not in self._regions:
+            return pd.DataFrame(
+                {
+                    "id": pd.Series(dtype="int64"),
+                    "region_code": pd.Series(dtype="category"),
+                }
+            )
+
+        return self._regions[resolution].copy(deep=False)
+
+    def get_child_index(
+        self, source_resolution: str, target_resolution: str
+    ) -> ChildIndex:
+        """Return the regions at `target_resolution` of each region at `source_resolution`.
+        The index is built on first use.
+        """
+        key = (source_resolution, target_resolution)
+        if key not in self._child_indexes:
+            with self._lock:
+                if key not in self._child_indexes:
+                    self._child_indexes[key] = self._build_child_index(
+                        source_resolution, target_resolution
+                    )
+
+        return self._child_indexes[key]
+
+    def _build_child_index(
+        self, source_resolution: str, target_resolution: str
+    ) -> ChildIndex:
+        if source_resolution not in region_hierarchy.LEVELS:
+            raise ValueError(
+                f"{source_resolution} is no parent resolution. Use one of {region_hierarchy.LEVELS}"
+            )
+
+        target_ids = self.get_regions(target_resolution)["id"].to_numpy()
+
+        # NOTE: -1 for regions without parent at source_resolution, e.g. NUTS3 regions
+        # have no NUTS3 parents
+        return ChildIndex(
+            region_hierarchy.get_parent_ids(target_ids, source_resolution), target_ids
+        )
+
+
+# query of the regions the catalogue is loaded from
+REGIONS_SQL = "SELECT id, region_code, resolution FROM regions"
+
+
+def _load_regions() -> pd.DataFrame:
+    file_path = os.environ.get("REGION_CATALOGUE_FILE")
+
+    if file_path is not None and os.path.isfile(file_path):
+        return pd.read_parquet(file_path)
+
+    regions = db_access.get_table(REGIONS_SQL)
+
+    if file_path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        # NOTE: written to a temporary file first, so that parallel processes never read a partial file
+        tmp_file_path = f"{file_path}.{os.getpid()}.tmp"
+        regions.to_parquet(tmp_file_path, index=False)
+        os.replace(tmp_file_path, file_path)
+
+    return regions
+
+
+class _CachedRegionCatalogue:
+    """Loads the region catalogue once per process."""
+
+    def __init__(self) -> None:
+        self._catalogue: Optional[RegionCatalogue] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> RegionCatalogue:
+        if self._catalogue is None:
+            with self._lock:
+                if self._catalogue is None:
+                    self._catalogue = RegionCatalogue(_load_regions())
+
+        return self._catalogue
+
+    def clear(self) -> None:
+        self._catalogue = None
+
+
+region_catalogue = _CachedRegionCatalogue()
+
+
+def get_regions(resolution: str) -> pd.DataFrame:
+    """Return the regions at `resolution` with the columns id and region_code, from the
+    process-wide catalogue.
+    """
+    return region_catalogue.get().get_regions(resolution)
+
+
+def get_child_index(source_resolution: str, target_resolution: str) -> ChildIndex:
+    """Return the regions at `target_resolution` of each region at `source_resolution`,
+    from the process-wide catalogue.
+    """
+    return region_catalogue.get().get_child_index(source_resolution, target_resolution)
@@ -0,0 +1,155 @@
+"""Materialized NUTS/LAU region hierarchy.
+
+The table ``region_hierarchy`` maps each region id to the ids of the NUTS0 to NUTS3
+regions it belongs to (including itself at its own resolution). Aggregation SQL joins
+on it instead of ``LEFT(region_code, n)`` and disaggregation matches source and target
+regions with the in-process integer-array mirror of the table.
+
+The table is built by the copy_and_agg stage, or on first use if it does not exist::
+
+    python zoomin/region_hierarchy.py
+"""
+import threading
+from typing import Optional
+import numpy as np
+import pandas as pd
+from zoomin import db_access
+
+LEVELS = ["NUTS0", "NUTS1", "NUTS2", "NUTS3"]
+
+# number of chars of the region code at a resolution
+N_CHARS = {"NUTS0": 2, "NUTS1": 3, "NUTS2": 4, "NUTS3": 5}
+
+
+def get_parent_column(resolution: str) -> str:
+    """Return the column of the region_hierarchy table holding the parent ids at `resolution`."""
+    if resolution not in N_CHARS:
+        raise ValueError(f"{resolution} is no parent resolution. Use one of {LEVELS}")
+
+    return f"{resolution.lower()}_id"
+
+
+@db_access.with_db_connection()
+def build_region_hierarchy(cursor) -> None:
+    """(Re)build the region_hierarchy table from the regions table."""
+    parent_joins = "\n".join(
+        f"""LEFT JOIN regions AS p_{level.lower()}
+            ON p_{level.lower()}.resolution = '{level}'
+            AND p_{level.lower()}.region_code = LEFT(r.region_code, {N_CHARS[level]})"""
+        for level in LEVELS
+    )
+    parent_cols = ", ".join(f"p_{level.lower()}.id" for level in LEVELS)
+    # in-database disaggregation looks up the target regions of a parent at a resolution
+    parent_indexes = "\n".join(
+        f"""CREATE INDEX IF NOT EXISTS idx_region_hierarchy_{level.lower()}
+            ON region_hierarchy ({get_parent_column(level)}, resolution);"""
+        for level in LEVELS
+    )
+
+    cursor.execute(
+        f"""CREATE TABLE IF NOT EXISTS region_hierarchy (
+            region_id integer PRIMARY KEY,
+            resolution varchar NOT NULL,
+            nuts0_id integer,
+            nuts1_id integer,
+            nuts2_id integer,
+            nuts3_id integer
+        );
+        TRUNCATE region_hierarchy;
+        INSERT INTO region_hierarchy (region_id, resolution, nuts0_id, nuts1_id, nuts2_id, nuts3_id)
+        SELECT r.id, r.resolution, {parent_cols}
+        FROM regions AS r
+        {parent_joins};
+        {parent_indexes}
+        ANALYZE region_hierarchy;"""
+    )
+
+    region_hierarchy.clear()
+
+
+def ensure_region_hierarchy() -> None:
+    """Build the region_hierarchy table if it does not exist."""
+    if not db_access.get_values("SELECT to_regclass('region_hierarchy') IS NOT NULL"):
+        build_region_hierarchy()
+
+
+class RegionHierarchy:
+    """Integer-array mirror of the region_hierarchy table.
+
+    :param hierarchy: Data with the columns region_id, nuts0_id, nuts1_id, nuts2_id and nuts3_id
+    :type hierarchy: pd.DataFrame
+    """
+
+    def __init__(self, hierarchy: pd.DataFrame) -> None:
+        hierarchy = hierarchy.sort_values("region_id")
+
+        self.region_ids = hierarchy["region_id"].to_numpy(dtype=np.int64)
+        self.parent_ids = {
+            level: hierarchy[get_parent_column(level)]
+            .fillna(-1)
+            .to_numpy(dtype=np.int64)
+            for level in LEVELS
+        }
+
+    def get_parent_ids(self, region_ids, resolution: str) -> np.ndarray:
+        """Return the id of the region at `resolution` that each of `region_ids` belongs to.
+        -1 for regions without parent at `resolution`.
+
+        :raises ValueError: If the hierarchy is empty and `region_ids` is not
+        """
+        parent_ids = self.parent_ids[resolution]
+        region_ids = np.asarray(region_ids, dtype=np.int64)
+
+        if len(region_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        if len(self.region_ids) == 0:
+            raise ValueError(
+                "The region hierarchy is empty, build the region_hierarchy table first"
+            )
+
+        positions = np.searchsorted(self.region_ids, region_ids)
+        positions = np.minimum(positions, len(self.region_ids) - 1)
+        is_known = self.region_ids[positions] == region_ids
+
+        return np.where(is_known, parent_ids[positions], -1)
+
+
+class _CachedRegionHierarchy:
+    """Loads the region hierarchy once per process."""
+
+    def __init__(self) -> None:
+        self._hierarchy: Optional[RegionHierarchy] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> RegionHierarchy:
+        if self._hierarchy is None:
+            with self._lock:
+                if self._hierarchy is None:
+                    ensure_region_hierarchy()
+
+                    self._hierarchy = RegionHierarchy(
+                        db_access.get_table(
+                            """SELECT region_id, nuts0_id, nuts1_id, nuts2_id, nuts3_id
+                            FROM region_hierarchy"""
+                        )
+                    )
+
+        return self._hierarchy
+
+    def clear(self) -> None:
+        self._hierarchy = None
+
+
+region_hierarchy = _CachedRegionHierarchy()
+
+
+def get_parent_ids(region_ids, resolution: str) -> np.ndarray:
+    """Return the id of the region at `resolution` that each of `region_ids` belongs to.
+    -1 for regions without parent at `resolution`.
+    """
+    return region_hierarchy.get().get_parent_ids(region_ids, resolution)
+
+
+if __name__ == "__main__":
+    build_region_hierarchy()
@@ -0,0 +1,280 @@
+"""Partition layout of the processed_data table.
+
+processed_data is HASH partitioned by var_detail_id, so that all rows of a variable are
+in one partition. Reads, deletes and re-runs of a variable filter on var_detail_id and
+therefore only touch that partition.
+
+Existing country DBs are migrated with::
+
+    python -m zoomin.schema_management migrate --partitions 32
+
+The number of partitions defaults to the environment variable
+``PROCESSED_DATA_PARTITIONS`` or 32.
+"""
+import os
+import re
+import argparse
+from typing import Any
+from zoomin.db_access import with_db_connection, get_db_name, get_column_types
+
+TABLE = "processed_data"
+LEGACY_TABLE = "processed_data_legacy"
+
+
+def get_n_partitions() -> int:
+    """Return the configured number of processed_data partitions."""
+    return int(os.environ.get("PROCESSED_DATA_PARTITIONS", "32"))
+
+
+def _is_partitioned(cursor: Any, table: str = TABLE) -> bool:
+    cursor.execute(
+        """SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON pt.partrelid = c.oid
+            WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+        );""",
+        (table,),
+    )
+    return cursor.fetchone()[0]
+
+
+def _table_exists(cursor: Any, table: str) -> bool:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+    return cursor.fetchone()[0]
+
+
+def _get_partitions(cursor: Any, table: str = TABLE) -> list:
+    cursor.execute(
+        """SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+        FROM pg_inherits i
+        JOIN pg_class c ON i.inhrelid = c.oid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname;""",
+        (table,),
+    )
+    return cursor.fetchall()
+
+
+def _get_identity(cursor: Any, table: str, column: str = "id") -> str:
+    """Return the identity kind of `column` ("a" always, "d" by default), "" if it is no identity column."""
+    cursor.execute(
+        """SELECT attidentity FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attname = %s;""",
+        (table, column),
+    )
+    row = cursor.fetchone()
+    return row[0] if row is not None else ""
+
+
+def _get_secondary_indexes(cursor: Any, table: str) -> list:
+    """Return the names and definitions of the indexes of `table` that do not belong to
+    its primary key.
+    """
+    cursor.execute(
+        """SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i
+        JOIN pg_class c ON i.indexrelid = c.oid
+        WHERE i.indrelid = to_regclass(%s) AND NOT i.indisprimary
+        ORDER BY c.relname;""",
+        (table,),
+    )
+    return cursor.fetchall()
+
+
+def _move_index_definition(definition: str, table: str) -> str:
+    """Return the index `definition` (see pg_get_indexdef) on `table` instead of its table."""
+    return re.sub(r" ON (ONLY )?\S+ USING ", f" ON {table} USING ", definition, count=1)
+
+
+def _create_partitions(cursor: Any, n_partitions: int, table: str = TABLE) -> list:
+    """Create the missing hash partitions of `table` and return their names."""
+    existing = {name for name, _, _ in _get_partitions(cursor, table)}
+
+    created = []
+    for remainder in range(n_partitions):
+        partition = f"{table}_p{remainder:03d}"
+        if partition in existing:
+            continue
+
+        cursor.execute(
+            f"""CREATE TABLE {partition} PARTITION OF {table}
+            FOR VALUES WITH (MODULUS {n_partitions}, REMAINDER {remainder});"""
+        )
+        created.append(partition)
+
+    return created
+
+
+@with_db_connection()
+def get_partition_layout(cursor: Any) -> dict:
+    """Return whether processed_data is partitioned and its partitions with bounds and estimated rows."""
+    return {
+        "partitioned": _is_partitioned(cursor),
+        "partitions": [
+            {"name": name, "bound": bound, "estimated_rows": max(n_rows, 0)}
+            for name, bound, n_rows in _get_partitions(cursor)
+        ],
+    }
+
+
+@with_db_connection()
+def ensure_partitions(cursor: Any, n_partitions: int = None) -> list:
+    """Create missing partitions of the already partitioned processed_data table.
+
+    :returns: Names of the created partitions
+    :rtype: list
+    """
+    if n_partitions is None:
+        n_partitions = get_n_partitions()
+
+    if not _is_partitioned(cursor):
+        raise ValueError(
+            f"{TABLE} is not partitioned. Migrate it with migrate_to_partitioned()"
+        )
+
+    moduli = {
+        bound.split("modulus ")[1].split(",")[0]
+        for _, bound, _ in _get_partitions(cursor)
+    }
+    if len(moduli) > 0 and moduli != {str(n_partitions)}:
+        raise ValueError(
+            f"{TABLE} is partitioned with modulus {moduli}, not {n_partitions}"
+        )
+
+    return _create_partitions(cursor, n_partitions)
+
+
+@with_db_connection()
+def migrate_to_partitioned(
+    cursor: Any, n_partitions: int = None, drop_legacy: bool = False
+) -> None:
+    """Move the rows of an unpartitioned processed_data table into a partitioned one.
+
+    The whole migration runs in one transaction. The old table is kept as
+    processed_data_legacy unless `drop_legacy` is True.
+
+    :param n_partitions: Number of hash partitions. Defaults to PROCESSED_DATA_PARTITIONS or 32
+    :type n_partitions: int
+
+    :param drop_legacy: Whether to drop the old table after the migration
+    :type drop_legacy: bool
+    """
+    if n_partitions is None:
+        n_partitions = get_n_partitions()
+
+    if _is_partitioned(cursor):
+        print(f"{TABLE} is partitioned already.")
+        return
+
+    if _table_exists(cursor, LEGACY_TABLE):
+        raise ValueError(f"{LEGACY_TABLE} exists already. Drop or rename it first.")
+
+    cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE};")
+
+    identity = _get_identity(cursor, LEGACY_TABLE)
+
+    # NOTE: defaults keep drawing ids from the sequence of the old table. Identity columns
+    # get a sequence of their own, which is moved past the migrated ids below
+    cursor.execute(
+        f"""CREATE TABLE {TABLE}
+        (LIKE {LEGACY_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY)
+        PARTITION BY HASH (var_detail_id);"""
+    )
+
+    # primary keys of partitioned tables have to contain the partition key
+    cursor.execute(
+        """SELECT array_agg(a.attname ORDER BY a.attnum)
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = to_regclass(%s) AND i.indisprimary;""",
+        (LEGACY_TABLE,),
+    )
+    primary_key = cursor.fetchone()[0]
+    if primary_key is not None:
+        if "var_detail_id" not in primary_key:
+            primary_key.append("var_detail_id")
+        cursor.execute(
+            f"ALTER TABLE {TABLE} ADD PRIMARY KEY ({', '.join(primary_key)});"
+        )
+
+    # foreign keys (e.g. to regions and var_details) are not copied by LIKE
+    cursor.execute(
+        """SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = to_regclass(%s) AND contype = 'f';""",
+        (LEGACY_TABLE,),
+    )
+    for constraint_name, definition in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {LEGACY_TABLE} DROP CONSTRAINT {constraint_name};")
+        cursor.execute(
+            f"ALTER TABLE {TABLE} ADD CONSTRAINT {constraint_name} {definition};"
+        )
+
+    _create_partitions(cursor, n_partitions)
+
+    overriding = " OVERRIDING SYSTEM VALUE" if identity != "" else ""
+    cursor.execute(f"INSERT INTO {TABLE}{overriding} SELECT * FROM {LEGACY_TABLE};")
+
+    # secondary indexes (e.g. those of the index advisor) are not copied by LIKE. They
+    # are created after the rows are moved, which is faster than updating them per row.
+    # The indexes of the old table are renamed, as index names are unique per schema
+    for index_name, definition in _get_secondary_indexes(cursor, LEGACY_TABLE):
+        legacy_index_name = f"{index_name[:56]}_legacy"
+        cursor.execute(f"ALTER INDEX {index_name} RENAME TO {legacy_index_name};")
+        cursor.execute(_move_index_definition(definition, TABLE))
+
+    if identity != "":
+        cursor.execute(
+            f"""SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), max(id))
+            FROM {TABLE} HAVING max(id) IS NOT NULL;"""
+        )
+    else:
+        # the id sequence must outlive the old table
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id');", (LEGACY_TABLE,))
+        sequence = cursor.fetchone()[0]
+        if sequence is not None:
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id;")
+
+    if drop_legacy:
+        cursor.execute(f"DROP TABLE {LEGACY_TABLE};")
+
+    cursor.execute(f"ANALYZE {TABLE};")
+
+    # the cached column types of processed_data describe the old table
+    get_column_types.cache_clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Manage the partition layout of processed_data."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="Show the partitions of processed_data")
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Migrate processed_data to a partitioned table"
+    )
+    migrate_parser.add_argument("--partitions", type=int, default=None)
+    migrate_parser.add_argument("--drop-legacy", action="store_true")
+
+    ensure_parser = subparsers.add_parser(
+        "ensure", help="Create missing partitions of processed_data"
+    )
+    ensure_parser.add_argument("--partitions", type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_to_partitioned(args.partitions, drop_legacy=args.drop_legacy)
+    elif args.command == "ensure":
+        print(f"Created partitions: {ensure_partitions(args.partitions)}")
+
+    layout = get_partition_layout()
+    print(f"{get_db_name()}: {TABLE} partitioned: {layout['partitioned']}")
+    for partition in layout["partitions"]:
+        print(
+            f"  {partition['name']}: {partition['bound']} (~{partition['estimated_rows']} rows)"
+        )
+
+
+if __name__ == "__main__":
+    main()
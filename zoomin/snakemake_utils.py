@@ -1,20 +1,20 @@
 import os
+import json
+import glob
+from contextlib import contextmanager
 from dotenv import find_dotenv, load_dotenv
 from zoomin import db_access
 from zoomin.db_access import with_db_connection
+from zoomin.proxy_cache import proxy_cache
+from zoomin.dtypes import memory_savings
+from zoomin import proxy_snapshot
+from zoomin import staging
 
 # find .env automagically by walking up directories until it's found
 dotenv_path = find_dotenv()
 # load up the entries as environment variables
 load_dotenv(dotenv_path)
 
-mini_db = int(os.environ.get("MINI_DB"))
-
-db_country = os.environ.get("DB_COUNTRY")
-db_version = os.environ.get("DB_VERSION")
-
-db_name = f"{db_country.lower()}_v{db_version}"
-
 collected_vars_for_mini_db = [
     "relative_gross_value_added_nace_sector_a",
     "road_transport_of_freight",
@@ -112,9 +112,145 @@ climate_vars_for_mini_db = [
 ]
 
 
-def get_climate_vars():
+# memory estimate of one disaggregation job per target resolution, in MB. Used as
+# Snakemake resource, so that memory heavy LAU jobs are not all run at once
+MEM_MB_PER_TARGET_RESOLUTION = {
+    "NUTS1": 1000,
+    "NUTS2": 1500,
+    "NUTS3": 2500,
+    "LAU": 6000,
+}
+
+
+def get_mem_mb(target_resolution: str) -> int:
+    """Return the memory estimate of a disaggregation job to `target_resolution` in MB."""
+    return MEM_MB_PER_TARGET_RESOLUTION[target_resolution]
+
+
+def get_bad_proxy_file(db_name: str, target_resolution: str, job_name: str) -> str:
+    """Return the result file of a job, which holds its bad proxy (if any)."""
+    return f"output_logs/{db_name}/bad_proxy/{target_resolution}/{job_name}.json"
+
+
+def write_bad_proxy(
+    db_name: str, target_resolution: str, job_name: str, bad_proxy
+) -> None:
+    """Write the bad proxy of a job to its result file. Jobs without bad proxy write an empty file,
+    so that results of earlier runs are overwritten.
+
+    Parallel jobs do not share memory, therefore each job writes its own file and the
+    files are merged with `merge_bad_proxies`.
+    """
+    file_path = get_bad_proxy_file(db_name, target_resolution, job_name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    result = {job_name: bad_proxy} if bad_proxy is not None else {}
+    with open(file_path, "w") as fp:
+        json.dump(result, fp)
+
+
+def merge_bad_proxies(db_name: str, target_resolution: str, output_file: str) -> dict:
+    """Merge the bad proxies of all jobs to `target_resolution` into `output_file`."""
+    bad_proxy_dict = {}
+    for file_path in sorted(
+        glob.glob(get_bad_proxy_file(db_name, target_resolution, "*"))
+    ):
+        with open(file_path) as fp:
+            bad_proxy_dict.update(json.load(fp))
+
+    with open(output_file, "w") as fp:
+        json.dump(bad_proxy_dict, fp)
+
+    return bad_proxy_dict
+
+
+def get_job_stats_file(db_name: str, target_resolution: str, job_name: str) -> str:
+    """Return the file holding the statistics (e.g. proxy cache hits) of a job."""
+    return f"output_logs/{db_name}/job_stats/{target_resolution}/{job_name}.json"
+
+
+def get_job_counters() -> dict:
+    """Return the counters of this process that are reported per job."""
+    cache_stats = proxy_cache.stats()
+    pool_metrics = db_access.get_pool_metrics()
+
+    return {
+        "proxy_cache": {
+            key: cache_stats[key] for key in ["hits", "misses", "evictions"]
+        },
+        # NOTE: the state of the pool (e.g. checked-out connections) is left out, only
+        # the counters add up over jobs
+        "db_pool": {
+            key: pool_metrics[key]
+            for key in ["checkouts", "waits", "wait_time", "connects"]
+        },
+        # NOTE: bytes instead of MB and saved shares, which do not add up over jobs
+        "memory_savings": memory_savings.counters(),
+    }
+
+
+def _add_counters(counters: dict, other: dict, sign: int = 1) -> dict:
+    """Return the sum (or, with `sign` -1, the difference) of two nested dicts of counters."""
+    result = dict(counters)
+    for key, value in other.items():
+        if isinstance(value, dict):
+            result[key] = _add_counters(result.get(key, {}), value, sign)
+        else:
+            result[key] = result.get(key, 0) + sign * value
+
+    return result
+
+
+@contextmanager
+def recorded_job_stats(db_name: str, target_resolution: str, job_name: str):
+    """Write the counters collected while the job runs (see `get_job_counters`) to its
+    stats file, if the job succeeds.
+
+    The counters live in the memory of the job's process. Parallel jobs do not share
+    memory, therefore each job writes its own file and the files are summed up with
+    `merge_job_stats`, like the bad proxies.
+    """
+    counters_before = get_job_counters()
+
+    yield
+
+    job_counters = _add_counters(get_job_counters(), counters_before, sign=-1)
+
+    file_path = get_job_stats_file(db_name, target_resolution, job_name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as fp:
+        json.dump(job_counters, fp)
+
+
+def merge_job_stats(db_name: str, target_resolution: str) -> dict:
+    """Return the sum of the counters of all jobs to `target_resolution`."""
+    job_stats = {}
+    for file_path in sorted(
+        glob.glob(get_job_stats_file(db_name, target_resolution, "*"))
+    ):
+        with open(file_path) as fp:
+            job_stats = _add_counters(job_stats, json.load(fp))
+
+    return job_stats
+
 
-    if mini_db == 1:
+def is_mini_db() -> bool:
+    """Return True if only the subset of vars for the mini DB (MINI_DB=1) is processed."""
+    return int(os.environ.get("MINI_DB", "0")) == 1
+
+
+def is_climate_split_years() -> bool:
+    """Return True if climate vars are disaggregated with one job per year (CLIMATE_SPLIT_YEARS=1)
+    instead of one job per var.
+    """
+    return int(os.environ.get("CLIMATE_SPLIT_YEARS", "0")) == 1
+
+
+def get_climate_years(var_name):
+    """Return the years of the climate var `var_name` that are disaggregated. None for
+    vars without years (all data is disaggregated).
+    """
+    if is_mini_db():
         cimp_ts_years = ["2025", "2100"]
         cproj_years = ["2025", "2099"]
     else:
@@ -140,7 +276,20 @@ def get_climate_vars():
             "2099",
         ]
 
-    if mini_db == 1:
+    if "cproj_" in var_name:
+        return cproj_years
+    elif "cimp_ts" in var_name:
+        return cimp_ts_years
+    else:
+        return None
+
+
+def get_climate_vars():
+    """Return the job names of the climate vars. These are the var names, or, if
+    `is_climate_split_years`, e.g. "cproj_annual_mean_temperature-2030" for each year
+    of cproj and cimp_ts vars.
+    """
+    if is_mini_db():
         var_list = climate_vars_for_mini_db
     else:
         sql_cmd = f"""SELECT var_name FROM var_details 
@@ -150,16 +299,17 @@ def get_climate_vars():
 
         var_list = db_access.get_values(sql_cmd)
 
+    if not is_climate_split_years():
+        return list(var_list)
+
     return_list = []
     for var_name in var_list:
-        if "cproj_" in var_name:
-            for year in cproj_years:
-                return_list.append(f"{var_name}-{year}")
-        elif "cimp_ts" in var_name:
-            for year in cimp_ts_years:
-                return_list.append(f"{var_name}-{year}")
-        else:
+        years = get_climate_years(var_name)
+        if years is None:
             return_list.append(var_name)
+        else:
+            for year in years:
+                return_list.append(f"{var_name}-{year}")
 
     return return_list
 
@@ -177,7 +327,7 @@ def get_collected_vars(spatial_level):
 
     return_list = db_access.get_values(sql_cmd)
 
-    if mini_db == 1:
+    if is_mini_db():
         return_list = list(
             set(return_list).intersection(set(collected_vars_for_mini_db))
         )
@@ -193,7 +343,7 @@ def get_eucalc_vars():
 
     return_list = db_access.get_values(sql_cmd)
 
-    if mini_db == 1:
+    if is_mini_db():
         return_list = list(set(return_list).intersection(set(eucalc_vars_for_mini_db)))
 
     return return_list
@@ -206,7 +356,7 @@ def get_post_disagg_calc_vars():
 
     return_list = db_access.get_values(sql_cmd)
 
-    if mini_db == 1:
+    if is_mini_db():
         return_list = list(
             set(return_list).intersection(
                 set(collected_vars_for_mini_db).union(set(eucalc_vars_for_mini_db))
@@ -216,13 +366,10 @@ def get_post_disagg_calc_vars():
     return return_list
 
 
-@with_db_connection()
-def clear_rows_from_processed_data(
-    cursor, var_name, target_resolution=None, year=None, pathway=None
-):
-    if "cproj_" in var_name:
-        [var_name, year] = var_name.split("-")
-
+def get_clear_rows_sql(
+    var_name, target_resolution=None, year=None, pathway=None
+) -> str:
+    """Return the DELETE statement of `clear_rows_from_processed_data`."""
     sql_cmd = f"""DELETE FROM processed_data WHERE 
                     var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}')"""
 
@@ -230,9 +377,35 @@ def clear_rows_from_processed_data(
         sql_cmd = f"{sql_cmd} AND region_id IN (SELECT id FROM regions WHERE resolution = '{target_resolution}')"
 
     if year is not None:
-        sql_cmd = f"{sql_cmd} AND year = year"
+        sql_cmd = f"{sql_cmd} AND year = {year}"
 
     if pathway is not None:
         sql_cmd = f"{sql_cmd} AND pathway = '{pathway}'"
 
-    cursor.execute(sql_cmd)
+    return sql_cmd
+
+
+@with_db_connection()
+def clear_rows_from_processed_data(
+    cursor, var_name, target_resolution=None, year=None, pathway=None
+):
+    if "-" in var_name:
+        # climate job names with a year, e.g. "cproj_annual_mean_temperature-2030"
+        [var_name, year] = var_name.split("-")
+
+    proxy_cache.invalidate(var_names=[var_name])
+    proxy_snapshot.invalidate_snapshots(var_names=[var_name])
+
+    cursor.execute(get_clear_rows_sql(var_name, target_resolution, year, pathway))
+
+
+def clear_failed_job(job_name, target_resolution=None) -> None:
+    """Remove the rows a failed job wrote to processed_data.
+
+    In staging mode, the job wrote to its own staging table only, which is dropped by
+    `staging.staged_write`, so nothing is deleted from processed_data.
+    """
+    if staging.is_staging_enabled():
+        return
+
+    clear_rows_from_processed_data(job_name, target_resolution=target_resolution)
@@ -2,14 +2,12 @@ from zoomin.db_access import with_db_connection
 from zoomin import db_access
 from zoomin import disaggregation_manager as disagg_manager
 
-var_name = "eucalc_ind_material_production_chemicals"
-
-eucalc_years = ["2020", "2025", "2030", "2035", "2040", "2045", "2050"]
-pathways = ["national", "with_behavioural_changes"]
+var_names = ["eucalc_ind_material_production_chemicals"]
 
 
 @with_db_connection()
 def copy_eucalc_data_into_processed_data(cursor):
+    var_names_str = ", ".join([f"'{var_name}'" for var_name in var_names])
 
     sql_cmd = f"""INSERT INTO processed_data (
                     region_id,
@@ -30,17 +28,33 @@ def copy_eucalc_data_into_processed_data(cursor):
                     value
                 FROM 
                     staged_eucalc_data
-                WHERE var_detail_id = (SELECT id FROM var_details WHERE var_name = '{var_name}');"""
+                WHERE var_detail_id IN (SELECT id FROM var_details WHERE var_name IN ({var_names_str}));"""
 
     cursor.execute(sql_cmd)
 
 
-copy_eucalc_data_into_processed_data()
+# NOTE: each spatial level is disaggregated to itself (the vars used to be
+# re-disaggregated to LAU for every level), for all pathways and years of the vars
+SPATIAL_LEVELS = ["NUTS2", "NUTS3", "LAU"]
+
+
+def disaggregate_vars() -> dict:
+    """Disaggregate `var_names` from NUTS0 to each of `SPATIAL_LEVELS`.
+
+    Each proxy shared by the vars is solved once per spatial level.
+
+    :returns: "bad_proxy" per var name, per spatial level
+    :rtype: dict
+    """
+    return {
+        spatial_level: disagg_manager.disaggregate_batch(
+            var_names, "NUTS0", spatial_level
+        )
+        for spatial_level in SPATIAL_LEVELS
+    }
+
+
+if __name__ == "__main__":
+    copy_eucalc_data_into_processed_data()
 
-# disaggregate
-for spatial_level in ["NUTS2", "NUTS3", "LAU"]:
-    for pathway in pathways:
-        for year in eucalc_years:
-            bad_proxy = disagg_manager.disaggregate_eucalc_var(
-                var_name, pathway, year, "LAU"
-            )
+    bad_proxy_dict = disaggregate_vars()
@@ -0,0 +1,110 @@
+"""Staging-table write mode for processed_data.
+
+With ``ZOOMIN_WRITE_MODE=staging`` each job writes into its own UNLOGGED copy of
+processed_data. When the job succeeds, the rows are moved into processed_data in one
+transaction. When it fails, the staging table is dropped, so no rows have to be deleted
+from processed_data.
+"""
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+from uuid import uuid4
+from zoomin import db_access
+from zoomin.proxy_cache import proxy_cache
+from zoomin import proxy_snapshot
+
+TARGET_TABLE = "processed_data"
+
+_state = threading.local()
+
+
+def is_staging_enabled() -> bool:
+    """Return True if jobs write through staging tables (ZOOMIN_WRITE_MODE=staging)."""
+    return os.environ.get("ZOOMIN_WRITE_MODE", "direct").lower() == "staging"
+
+
+def get_target_table() -> str:
+    """Return the table the current thread writes processed data to."""
+    return getattr(_state, "table", None) or TARGET_TABLE
+
+
+def register_written_var_detail_ids(var_detail_ids) -> None:
+    """Remember the var_detail_ids written to the staging table of the current thread."""
+    if getattr(_state, "table", None) is not None:
+        _state.var_detail_ids.update(int(_id) for _id in var_detail_ids)
+
+
+def _get_staging_table_name(job_name: str) -> str:
+    # NOTE: Postgres truncates identifiers to 63 characters
+    job_name = re.sub(r"[^a-z0-9_]", "_", job_name.lower())[:40]
+    return f"staging_{job_name}_{uuid4().hex[:12]}"
+
+
+def create_staging_table(table: str, unlogged: bool = True) -> None:
+    """Create an empty copy of processed_data without its id column.
+
+    The ids are generated by processed_data when the rows are moved, whether id is a
+    serial or an identity column. A copy of an identity column would keep its NOT NULL
+    constraint but not its generator.
+
+    :param unlogged: Whether the table is UNLOGGED
+    :type unlogged: bool
+    """
+    db_access.execute_sql_cmd(
+        f"""CREATE {"UNLOGGED " if unlogged else ""}TABLE {table}
+        (LIKE {TARGET_TABLE} INCLUDING DEFAULTS);
+        ALTER TABLE {table} DROP COLUMN IF EXISTS id;"""
+    )
+
+
+def _get_merge_columns() -> str:
+    """Return the columns of processed_data that are moved from a staging table."""
+    return ", ".join(
+        col for col in db_access.get_column_types(TARGET_TABLE) if col != "id"
+    )
+
+
+@contextmanager
+def staged_write(job_name: str) -> Iterator[None]:
+    """Write all processed data added in this block into processed_data at once.
+
+    Without staging mode, the data is written directly and this is a no-op.
+
+    :param job_name: Name of the job, used in the name of the staging table
+    :type job_name: str
+    """
+    if not is_staging_enabled() or getattr(_state, "table", None) is not None:
+        yield
+        return
+
+    staging_table = _get_staging_table_name(job_name)
+
+    create_staging_table(staging_table)
+
+    _state.table = staging_table
+    _state.var_detail_ids = set()
+    try:
+        yield
+
+        with db_access.db_connection() as connection:
+            with connection.cursor() as cursor:
+                columns = _get_merge_columns()
+                cursor.execute(
+                    f"""INSERT INTO {TARGET_TABLE} ({columns})
+                    SELECT {columns} FROM {staging_table};
+                    DROP TABLE {staging_table};"""
+                )
+
+        # readers may have cached the proxy data while the job was running
+        proxy_cache.invalidate(var_detail_ids=_state.var_detail_ids)
+        proxy_snapshot.invalidate_snapshots(var_detail_ids=_state.var_detail_ids)
+
+    except BaseException:
+        db_access.execute_sql_cmd(f"DROP TABLE IF EXISTS {staging_table};")
+        raise
+
+    finally:
+        _state.table = None
+        _state.var_detail_ids = set()